@@ -39,8 +39,8 @@ det_out['CSD Anomaly'] = csd_out
 # det_out['FCBAD Anomaly'] = fcbad_out
 gmm_out = gmm_anomaly(hsi_img_sub, n_comp = 8, mask = mask_sub)
 det_out['GMM Anomaly'] = gmm_out
-# gmrx_out = gmrx_anomaly(hsi_img_sub, n_comp = 8, mask = mask_sub) <--- moved into dev
-# det_out['GMRX Anomaly'] = gmrx_out
+gmrx_out = gmrx_anomaly(hsi_img_sub, n_comp = 8, mask = mask_sub)
+det_out['GMRX Anomaly'] = gmrx_out
 md_out = md_anomaly(hsi_img_sub, mask_sub)
 det_out['MD Anomaly'] = md_out
 rx_out = rx_anomaly(hsi_img_sub, guard_win, bg_win, mask_sub)
@@ -58,5 +58,4 @@ for key, value in det_out.items():
 	plt.subplot(n_row, n_col, i)
 	plt.imshow(value); plt.title(key)
 	i += 1
-# plt.imshow(gmrx_out)
 plt.show()
@@ -1,5 +1,6 @@
 from hsi_toolkit.anomaly_detectors.cbad_anomaly import *
 from hsi_toolkit.anomaly_detectors.csd_anomaly import *
 from hsi_toolkit.anomaly_detectors.gmm_anomaly import *
+from hsi_toolkit.anomaly_detectors.gmrx_anomaly import *
 from hsi_toolkit.anomaly_detectors.md_anomaly import *
 from hsi_toolkit.anomaly_detectors.rx_anomaly import *
@@ -1,8 +1,8 @@
 from hsi_toolkit.util import img_det
-import numpy as np
+from hsi_toolkit.util import cluster_stats, cluster_scores, stream_cluster_stats
 from sklearn.cluster import KMeans
 
-def cbad_anomaly(hsi_img, n_cluster, mask = None):
+def cbad_anomaly(hsi_img, n_cluster, mask = None, tile_rows = None, out = None):
 	"""
 	Cluster Based Anomaly Detection (CBAD)
 	Ref: Carlotto, Mark J. "A cluster-based approach for detecting man-made objects and changes in imagery." IEEE Transactions on Geoscience and Remote Sensing 43.2 (2005): 374-387.
@@ -12,6 +12,11 @@ def cbad_anomaly(hsi_img, n_cluster, mask = None):
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
 	 n_cluster - number of clusters to use
+	 tile_rows - (optional) streaming mode for images that do not fit in memory (e.g. a np.memmap),
+	             the image is read tile_rows image rows at a time: mini-batch k-means centroids and
+	             cluster statistics come from streaming passes over the tiles, then the tiles are scored
+	             (see util.stream_cluster_stats)
+	 out - (optional) preallocated n_row x n_col output, e.g. a np.memmap, for the detector image
 
 	Outputs:
 	 cbad_out - detector output image
@@ -21,26 +26,27 @@ def cbad_anomaly(hsi_img, n_cluster, mask = None):
 	5/5/2018 - Edited by Alina Zare
 	11/2018 - Python Implementation by Yutai Zhou
 	"""
-	cbad_out, kwargsout = img_det(cbad_out_helper, hsi_img, None, mask, n_cluster = n_cluster)
+	clusters = None
+	if tile_rows is not None:
+		clusters = stream_cluster_stats(hsi_img, n_cluster, tile_rows, mask)
+
+	cbad_out, kwargsout = img_det(cbad_out_helper, hsi_img, None, mask, tile_rows, out, pixel_out = ['idx'], n_cluster = n_cluster, clusters = clusters)
 	cluster_img = kwargsout['idx']
 	return cbad_out, cluster_img
 
 def cbad_out_helper(hsi_data, tgt_sig, kwargs):
 	n_cluster = kwargs['n_cluster']
-	n_bands, n_pixel = hsi_data.shape
-	# cluster the data
-	kmeans = KMeans(n_clusters = n_cluster, n_init = 1).fit(hsi_data.T)
-	# get cluster stats
-	mu = np.zeros((n_bands, n_cluster))
-	sig_inv = np.zeros((n_bands, n_bands, n_cluster))
-
-	for i in range(n_cluster):
-		z = hsi_data[:, kmeans.labels_ == i]
-		mu[:,i] = np.mean(z, 1)
-		sig_inv[:,:,i] = np.linalg.pinv(np.cov(z.T, rowvar=False))
-
-	cbad_data = np.zeros(n_pixel)
-	for i in range(n_pixel):
-		z = hsi_data[:,i] - mu[:,kmeans.labels_[i]]
-		cbad_data[i] = z.T @ sig_inv[:,:,kmeans.labels_[i]] @ z
-	return cbad_data, {'idx': kmeans.labels_}
+	# cluster the data, unless clustered by streaming passes over the image
+	if kwargs.get('clusters') is None:
+		labels = KMeans(n_clusters = n_cluster, n_init = 1).fit(hsi_data.T).labels_
+
+		# get cluster stats
+		mu, sig_inv = cluster_stats(hsi_data, labels, n_cluster)
+	else:
+		kmeans, mu, sig_inv = kwargs['clusters']
+		labels = kmeans.predict(hsi_data.T)
+
+	# score each pixel against its own cluster
+	cbad_data = cluster_scores(hsi_data, labels, mu, sig_inv = sig_inv)
+
+	return cbad_data, {'idx': labels}
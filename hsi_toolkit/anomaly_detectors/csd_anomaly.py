@@ -1,7 +1,7 @@
 from hsi_toolkit.util import pca
 import numpy as np
 
-def csd_anomaly(hsi_img, n_dim_bg, n_dim_tgt, tgt_orth):
+def csd_anomaly(hsi_img, n_dim_bg, n_dim_tgt, tgt_orth, chunk_size = 16384):
 	"""
 	Complementary Subspace Detector
 	 assumes background and target are complementary subspaces
@@ -14,6 +14,7 @@ def csd_anomaly(hsi_img, n_dim_bg, n_dim_tgt, tgt_orth):
 	  n_dim_tgt - number of dimensions to assign to target subspace
 	              use empty matrix, [], to use all remaining after background assignment
 	  tgt_orth - True/False, set target subspace orthogonal to background subspace
+	  chunk_size - number of pixels scored at a time (bounds the temporary memory)
 
 	8/7/2012 - Taylor C. Glenn
 	5/5/2018 - Edited by Alina Zare
@@ -48,14 +49,14 @@ def csd_anomaly(hsi_img, n_dim_bg, n_dim_tgt, tgt_orth):
 	B = evecs[:, bg_rg]
 	S = evecs[:, tgt_rg]
 
-	# run the detector
+	# run the detector, a chunk of pixels at a time
 	csd_data = np.zeros(n_pixel)
 
-	for i in range(n_pixel):
-		Sz = S.T @ z[:,i]
-		Bz = B.T @ z[:,i]
+	for c in range(0, n_pixel, chunk_size):
+		Sz = S.T @ z[:, c:c + chunk_size]
+		Bz = B.T @ z[:, c:c + chunk_size]
 
-		csd_data[i] = Sz.T @ Sz - Bz.T @ Bz
+		csd_data[c:c + chunk_size] = np.sum(Sz ** 2, 0) - np.sum(Bz ** 2, 0)
 
 	csd_out = csd_data.reshape(n_row, n_col, order = 'F')
 
@@ -1,7 +1,7 @@
 from hsi_toolkit.util import img_det
-from sklearn.mixture import GaussianMixture
+from hsi_toolkit.util import get_gmm
 
-def gmm_anomaly(hsi_img, n_comp, mask = None):
+def gmm_anomaly(hsi_img, n_comp, mask = None, gmm = None):
 	"""
 	Gaussian Mixture Model Anomaly Detector
 	 fits GMM assuming entire image is background
@@ -12,6 +12,8 @@ def gmm_anomaly(hsi_img, n_comp, mask = None):
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
 	 n_comp - number of Gaussian components to use
+	 gmm - (optional) pre-fitted mixture model (util.MixtureModel, e.g. MixtureModel.load,
+	       or a fitted sklearn GaussianMixture), fit to the image if not given
 
 	Outputs:
 	  gmm_out - detector output image
@@ -20,11 +22,10 @@ def gmm_anomaly(hsi_img, n_comp, mask = None):
 	5/5/2018 - Edited by Alina Zare
 	11/2018 - Python Implementation by Yutai Zhou
 	"""
-	gmm_out, kwargsout = img_det(gmm_helper, hsi_img, None, mask, n_comp = n_comp)
+	gmm_out, kwargsout = img_det(gmm_helper, hsi_img, None, mask, n_comp = n_comp, gmm = gmm)
 	return gmm_out
 
 def gmm_helper(hsi_data, tgt_sig, kwargs):
-	n_comp = kwargs['n_comp']
-	gmm = GaussianMixture(n_components = n_comp, max_iter = 1, init_params = 'random').fit(hsi_data.T)
-	gmm_data = -gmm.score_samples(hsi_data.T)
+	gmm = get_gmm(hsi_data, kwargs)
+	gmm_data = -gmm.score_samples(hsi_data)
 	return gmm_data, {}
@@ -0,0 +1,50 @@
+from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_gmm
+import numpy as np
+
+def gmrx_anomaly(hsi_img, n_comp, mask = None, gmm = None, tile_rows = None, out = None, n_jobs = None, chunk_size = 16384):
+	"""
+	Gaussian Mixture RX Anomaly Detector
+	 fits GMM assuming entire image is background
+	 assigns pixels to highest posterior probability mixture component
+	 computes pixel Mahlanobis distance to component mean
+
+	Inputs:
+	 hsi_image - n_row x n_col x n_band hyperspectral image
+	 mask - binary image limiting detector operation to pixels where mask is true
+	        if not present or empty, no mask restrictions are used
+	 n_comp - number of Gaussian components to use
+	 gmm - (optional) pre-fitted mixture model (util.MixtureModel, e.g. MixtureModel.load,
+	       or a fitted sklearn GaussianMixture), fit to the image if not given
+	 tile_rows - (optional) out-of-core mode, the image (e.g. a np.memmap) is read tile_rows image rows
+	             at a time, the mixture (if not given) is fit on a strided subset of the rows (see util.img_det)
+	 out - (optional) preallocated n_row x n_col output, e.g. a np.memmap, for the detector image
+	 n_jobs - (optional) number of threads scoring blocks of pixels (-1 for one per CPU),
+	          the mixture model is fit once on all the pixels
+	 chunk_size - number of pixels scored at a time (bounds the temporary memory)
+
+	Outputs:
+	  gmrx_out - detector output image
+
+	8/7/2012 - Taylor C. Glenn - tcg@cise.ufl.edu
+	5/5/2018 - Edited by Alina Zare
+	11/2018 - Python Implementation by Yutai Zhou
+	"""
+	gmm_out, kwargsout = img_det(gmrx_helper, hsi_img, None, mask, tile_rows, out, n_jobs, gmrx_fit, n_comp = n_comp, gmm = gmm, chunk_size = chunk_size)
+	return gmm_out
+
+def gmrx_fit(hsi_data, tgt_sig, kwargs):
+	return dict(kwargs, gmm = get_gmm(hsi_data, kwargs))
+
+def gmrx_helper(hsi_data, tgt_sig, kwargs):
+	n_pixel = hsi_data.shape[1]
+	gmm = get_gmm(hsi_data, kwargs)
+
+	# Mahalanobis distance to every component with the precision Cholesky factors, one GEMM per component
+	dists = gmm.mahalanobis(hsi_data, kwargs.get('chunk_size') or n_pixel)
+
+	# cluster/assign mixture component to each pixel, keep its distance to that component
+	idx = np.argmax(gmm.log_norm[:, np.newaxis] - 0.5 * dists, 0)
+	gmrx_data = dists[idx, np.arange(n_pixel)]
+
+	return gmrx_data, {}
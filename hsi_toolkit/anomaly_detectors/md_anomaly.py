@@ -1,7 +1,8 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
 import numpy as np
 
-def md_anomaly(hsi_img, mask = None):
+def md_anomaly(hsi_img, mask = None, bg_model = None, tile_rows = None, cov_method = 'pinv'):
 	"""
 	Mahalanobis Distance anomaly detector
 	uses global image mean and covariance as background estimates
@@ -10,6 +11,10 @@ def md_anomaly(hsi_img, mask = None):
 	 hsi_image - n_row x n_col x n_band hyperspectral image
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	  dist_img - detector output image
@@ -18,17 +23,17 @@ def md_anomaly(hsi_img, mask = None):
 	5/5/2018 - Edited by Alina Zare
 	11/2018 - Python Implementation by Yutai Zhou
 	"""
-	dist_img, kwargsout = img_det(md_helper, hsi_img, None, mask)
+	dist_img, kwargsout = img_det(md_helper, hsi_img, None, mask, tile_rows = tile_rows, mu = None, sig_inv = None, bg_model = bg_model, cov_method = cov_method)
 	return dist_img
 
 def md_helper(hsi_data, tgt_sig, kwargs):
 	n_pixel = hsi_data.shape[1]
 
-	mu = np.mean(hsi_data, 1)
-	sigma = np.cov(hsi_data.T, rowvar = False)
+	bg_model = get_bg_model(hsi_data, kwargs)
+	mu = bg_model.mu
+	sig_inv = bg_model.sig_inv
 
 	z = hsi_data - mu[:,np.newaxis]
-	sig_inv = np.linalg.pinv(sigma)
 
 	dist_data = np.zeros(n_pixel)
 	for i in range(n_pixel):
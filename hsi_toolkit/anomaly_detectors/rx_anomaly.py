@@ -1,6 +1,7 @@
 import numpy as np
+from hsi_toolkit.util import local_stats, local_sig_inv, sym_pinv, stripe_map
 
-def rx_anomaly(hsi_img, guard_win, bg_win, mask = None):
+def rx_anomaly(hsi_img, guard_win, bg_win, mask = None, rank_update = False, n_refactor = 16, n_jobs = None):
 	"""
 	Widowed Reed-Xiaoli anomaly detector
 		use local mean and covariance to determine pixel to background distance
@@ -11,50 +12,61 @@ def rx_anomaly(hsi_img, guard_win, bg_win, mask = None):
 	           if not present or empty, no mask restrictions are used
 		guard_win - guard window radius (square,symmetric about pixel of interest)
 		bg_win - background window radius
+		rank_update - update the local inverse covariance between neighbouring windows with
+		              Sherman-Morrison-Woodbury rank-k updates instead of inverting every window
+		              (needs more background pixels than bands)
+		n_refactor - number of window steps between exact inversions in rank update mode
+		n_jobs - (optional) number of processes, the image is split into n_jobs column stripes
+		         (with guard_win + bg_win columns of overlap) run in parallel, -1 for one per CPU
 
 	8/7/2012 - Taylor C. Glenn - tcg@cise.ufl.edu
 	5/5/2018 - Edited by Alina Zare
 	10/1/2018 - Python Implementation by Yutai Zhou
 	"""
 	n_row, n_col, n_band = hsi_img.shape
-	n_pixels = n_row * n_col
-	hsi_data = np.reshape(hsi_img, (n_pixels, n_band), order='F').T
-
-	# Create the mask
-	mask_width = 1 + 2 * guard_win + 2 * bg_win
-	b_mask = np.ones((mask_width, mask_width), dtype=bool)
-	b_mask[bg_win:b_mask.shape[0] - bg_win, bg_win:b_mask.shape[0] - bg_win] = 0
 
 	# run the detector (only on fully valid points)
-	mask = np.ones((n_row, n_col)) if mask is None else mask.astype(bool)
-	rx_img = np.zeros((n_row, n_col))
-	half_width = guard_win + bg_win
+	mask = np.ones((n_row, n_col), dtype=bool) if mask is None else mask.astype(bool)
+
+	rx_img, = stripe_map(rx_stripe, hsi_img, guard_win + bg_win, n_jobs, mask, guard_win, bg_win, rank_update, n_refactor)
+	return rx_img
+
+def rx_stripe(hsi_img, stripe, mask, guard_win, bg_win, rank_update, n_refactor):
+	"""
+	rx_anomaly on the output columns stripe = (first, last + 1) of the image, see stripe_map
+	"""
+	n_row, n_col, n_band = hsi_img.shape
+	halo = guard_win + bg_win
+	c0, c1 = max(stripe[0] - halo, 0), min(stripe[1] + halo, n_col)
 
-	for i in range(n_col - mask_width + 1):
-		for j in range(n_row - mask_width + 1):
-			row = j + half_width
-			col = i + half_width
+	hsi_img = hsi_img[:, c0:c1, :]
+	mask = mask[:, c0:c1]
+	rx_img = np.zeros((n_row, c1 - c0))
 
-			if mask[row, col] == 0: continue
+	if rank_update:
+		# local inverse covariances carried between windows by rank-k updates
+		for row, cols, _, mu, sig_inv in local_sig_inv(hsi_img, guard_win, bg_win, rank_update = True, n_refactor = n_refactor):
+			cols, sig_inv, mu = cols[mask[row, cols]], sig_inv[mask[row, cols]], mu[mask[row, cols]]
+			z = hsi_img[row, cols, :] - mu
+			rx_img[row, cols] = np.einsum('ij,ijk,ik->i', z, sig_inv, z)
 
-			b_mask_img = np.zeros((n_row, n_col))
-			b_mask_img[j:mask_width + j, i:mask_width + i] = b_mask
-			b_mask_list = np.reshape(b_mask_img, -1, order='F')
+		return (rx_img[:, stripe[0] - c0:stripe[1] - c0],)
 
-			# pull out background points
-			bg = hsi_data[:, b_mask_list == 1]
+	# local background statistics, a row of window centers at a time
+	for row, cols, _, mu, covariance in local_stats(hsi_img, guard_win, bg_win):
+		cols = cols[mask[row, cols]]
+		if cols.size == 0: continue
+		valid = cols - guard_win - bg_win
+		mu, covariance = mu[valid], covariance[valid]
 
-			# Mahalanobis distance
-			covariance = np.cov(bg.T, rowvar=False)
-			s = np.float32(np.linalg.svd(covariance, compute_uv=False))
-			rcond = np.max(covariance.shape)*np.spacing(np.float32(np.linalg.norm(s, ord=np.inf)))
-			# pinv differs from MATLAB
-			sig_inv = np.linalg.pinv(covariance, rcond=rcond)
+		# Mahalanobis distance
+		# rcond from the largest eigenvalue of the same eigh, no extra decomposition
+		rcond = lambda s_max: n_band * np.spacing(np.float32(s_max))
+		# pinv differs from MATLAB
+		sig_inv = sym_pinv(covariance, rcond=rcond)
 
-			mu = np.mean(bg, 1)
-			z = hsi_img[row, col, :] - mu
-			z = np.reshape(z, (len(z), 1), order='F')
+		z = hsi_img[row, cols, :] - mu
 
-			rx_img[row, col] = z.T @ sig_inv @ z
+		rx_img[row, cols] = np.einsum('ij,ijk,ik->i', z, sig_inv, z)
 
-	return rx_img
+	return (rx_img[:, stripe[0] - c0:stripe[1] - c0],)
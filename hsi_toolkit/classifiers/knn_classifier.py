@@ -2,7 +2,7 @@ from hsi_toolkit.util import img_det
 import numpy as np
 from sklearn.neighbors import NearestNeighbors
 
-def knn_classifier(hsi_img, train_data, K, mask = None):
+def knn_classifier(hsi_img, train_data, K, mask = None, model = None, tile_rows = None, out = None, n_jobs = None, chunk_size = 16384):
 	"""
 	 A simple K nearest neighbors classifier
 
@@ -13,42 +13,148 @@ def knn_classifier(hsi_img, train_data, K, mask = None):
 				   train_data['name'][0, i]: matrix containing name of class i
 	  mask - binary image indicating where to apply classifier
 	  K - number of neighbors to use during classification
+	  model - (optional) fitted KNNModel (e.g. KNNModel.load), built from train_data if not given
+	  tile_rows - (optional) out-of-core mode, the image (e.g. a np.memmap) is read tile_rows image rows
+	              at a time (see util.img_det), the neighbour index is built once for all the tiles
+	  out - (optional) preallocated n_row x n_col output, e.g. a np.memmap, for the class image
+	  n_jobs - (optional) number of threads classifying blocks of pixels (-1 for one per CPU)
+	  chunk_size - number of pixels queried at a time (bounds the temporary memory)
 
 	10/31/2012 - Taylor C. Glenn
 	05/12/2018 - Edited by Alina Zare
 	10/2018 - Python Implementation by Yutai Zhou
 	"""
-	knn_out, kwargsout = img_det(knn_cfr, hsi_img, train_data, mask = mask, K = K);
+	knn_out, kwargsout = img_det(knn_cfr, hsi_img, train_data, mask, tile_rows, out, n_jobs, knn_fit, K = K, model = model, chunk_size = chunk_size)
 	return knn_out
 
+def knn_fit(hsi_data, train_data, kwargs):
+	return dict(kwargs, model = get_knn(train_data, kwargs))
+
 def knn_cfr(hsi_data, train_data, kwargs):
-	K = kwargs['K']
-	train_data = train_data.squeeze()
-	# concatenate the training data
-	train = np.hstack([class_data for class_data in train_data['Spectra']])
-	n_train = train.shape[1]
+	model = get_knn(train_data, kwargs)
 
-	labels = np.zeros((n_train, 1))
-	n_class = train_data.size
+	# classify by majority of K nearest neighbors
+	knn_out = model.predict(hsi_data, kwargs['K'], kwargs.get('chunk_size') or hsi_data.shape[1])
+	return knn_out, {}
 
-	last = -1
-	for i in range(n_class):
-		nt = train_data[i]['Spectra'].shape[1]
-		labels[(last + 1):(last + nt + 1)] = i
-		last += nt
+class KNNModel:
+	"""
+	K nearest neighbors classifier fitted once on the training data
+	 the neighbour index (sklearn NearestNeighbors) is built when the model is created and reused
+	 for every query, so one model classifies all the tiles of a flight line, or is saved to a
+	 .npz file and loaded back for later scenes; pixels are queried in chunks and the neighbour
+	 labels counted with one bincount per chunk
 
-	n_pix = hsi_data.shape[1]
+	Inputs:
+	 train - n_band x n_train training spectra
+	 labels - class index of each training spectrum (n_train, values 0 to n_class - 1)
+	 K - number of neighbors to use during classification
+	 names - (optional) name of each class
 
-	# classify by majority of K nearest neighbors
-	knn_out = np.zeros((n_pix,1))
-	knn = NearestNeighbors(n_neighbors=K)
-	knn.fit(train.T)
-	idx = knn.kneighbors(hsi_data.T)[1]
-
-	for i in range(n_pix):
-		counts = np.zeros((n_class, 1))
-		for j in range(K):
-			counts[int(labels[idx[i,j]])] = counts[int(labels[idx[i,j]])] + 1
-		max_i = np.argmax(counts)
-		knn_out[i,0] = max_i
-	return knn_out.squeeze(), {}
+	Example:
+	 model = KNNModel.from_train_data(train_data, 3)
+	 model.save('classes.npz')
+	 class_out = knn_classifier(hsi_img, None, 3, model = KNNModel.load('classes.npz'))
+	"""
+	def __init__(self, train, labels, K, names = None):
+		self.train = np.asarray(train, dtype = np.float64)
+		self.labels = np.asarray(labels, dtype = int).reshape(-1)
+		self.K = int(K)
+		self.names = None if names is None else np.asarray(names, dtype = str)
+		self.n_class = int(np.max(self.labels)) + 1 if self.names is None else self.names.size
+
+		self.index = NearestNeighbors(n_neighbors = self.K)
+		self.index.fit(self.train.T)
+
+	@classmethod
+	def from_train_data(cls, train_data, K):
+		"""
+		KNNModel of training data given as the numpy void structure of the classifiers
+		 (train_data['Spectra'][0, i] and train_data['name'][0, i] of class i)
+		"""
+		train_data = train_data.squeeze()
+		# concatenate the training data
+		train = np.hstack([class_data for class_data in train_data['Spectra']])
+		labels = np.repeat(np.arange(train_data.size), [class_data.shape[1] for class_data in train_data['Spectra']])
+
+		names = None
+		if 'name' in train_data.dtype.names:
+			names = [np.asarray(name).squeeze() for name in train_data['name']]
+		return cls(train, labels, K, names)
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Load a model saved with KNNModel.save
+		"""
+		with np.load(path) as f:
+			return cls(f['train'], f['labels'], f['K'], f['names'] if 'names' in f else None)
+
+	def save(self, path):
+		"""
+		Save the model to a .npz file
+		"""
+		arrays = {'train': self.train, 'labels': self.labels, 'K': self.K}
+		if self.names is not None:
+			arrays['names'] = self.names
+		np.savez(path, **arrays)
+
+	def kneighbors(self, hsi_data, K = None, chunk_size = 16384):
+		"""
+		Indices of the K nearest training spectra of every pixel
+
+		Inputs:
+		 hsi_data - n_band x n_pixel array of spectra
+		 K - number of neighbors (default the model's K)
+		 chunk_size - number of pixels queried at a time
+
+		Outputs:
+		 idx - n_pixel x K training spectrum indices, nearest first
+		"""
+		K = self.K if K is None else K
+		n_pixel = hsi_data.shape[1]
+		idx = np.empty((n_pixel, K), dtype = int)
+
+		for c in range(0, n_pixel, chunk_size):
+			idx[c:c + chunk_size] = self.index.kneighbors(hsi_data[:, c:c + chunk_size].T, K, return_distance = False)
+
+		return idx
+
+	def votes(self, hsi_data, K = None, chunk_size = 16384):
+		"""
+		Number of the K nearest neighbors of every pixel in each class (n_pixel x n_class)
+		"""
+		n_pixel = hsi_data.shape[1]
+		counts = np.empty((n_pixel, self.n_class), dtype = int)
+
+		for c in range(0, n_pixel, chunk_size):
+			nbr_labels = self.labels[self.kneighbors(hsi_data[:, c:c + chunk_size], K, chunk_size)]
+			n = nbr_labels.shape[0]
+
+			# one bincount over (pixel, class) pairs
+			pairs = np.arange(n)[:, np.newaxis] * self.n_class + nbr_labels
+			counts[c:c + n] = np.bincount(pairs.reshape(-1), minlength = n * self.n_class).reshape(n, self.n_class)
+
+		return counts
+
+	def predict(self, hsi_data, K = None, chunk_size = 16384):
+		"""
+		Majority class of the K nearest neighbors of every pixel (n_pixel, ties go to the lowest class index)
+		"""
+		return np.argmax(self.votes(hsi_data, K, chunk_size), 1)
+
+def get_knn(train_data, kwargs):
+	"""
+	KNNModel for the array based classifier
+
+	Inputs:
+	 train_data - training data structure (see knn_classifier), used if no model is given
+	 kwargs - classifier arguments, model (KNNModel or None) and K
+
+	Outputs:
+	 model - kwargs['model'], or a KNNModel built from train_data
+	"""
+	model = kwargs.get('model')
+	if model is None:
+		return KNNModel.from_train_data(train_data, kwargs['K'])
+	return model
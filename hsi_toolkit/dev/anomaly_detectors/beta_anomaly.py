@@ -1,8 +1,11 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import n_workers
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.special import gammaln, digamma, polygamma
 from scipy.stats import beta
 
-def beta_anomaly(hsi_img, mask):
+def beta_anomaly(hsi_img, mask, method = 'mle', n_newton = 10, n_jobs = None, chunk_size = 16384):
 	"""
 	Beta Distribution Anomaly Detector
 	 fits beta distribution to each band assuming entire image is background
@@ -12,6 +15,13 @@ def beta_anomaly(hsi_img, mask):
 	 hsi_image - n_row x n_col x n_band hyperspectral image
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
+	 method - 'mle' - scipy maximum likelihood fit of each band (default)
+	          'mom' - fast mode, method of moments fit of all the bands at once, refined by n_newton
+	                  batched Newton steps on the maximum likelihood equations
+	 n_newton - number of Newton steps of the 'mom' fit (0 for the moment estimates alone)
+	 n_jobs - (optional) number of workers (-1 for one per CPU), the pixels are scored in blocks run
+	          in threads and the 'mle' bands fit in a process pool (scipy's fit holds the GIL)
+	 chunk_size - number of pixels scored at a time (bounds the temporary memory)
 
 	Outputs:
 	  beta_out - detector output image
@@ -20,27 +30,101 @@ def beta_anomaly(hsi_img, mask):
 	5/5/2018 - Edited by Alina Zare
 	11/2018 - Python Implementation by Yutai Zhou
 	"""
-	beta_out, kwargsout = img_det(beta_helper, hsi_img, None, mask)
+	beta_out, kwargsout = img_det(beta_helper, hsi_img, None, mask, n_jobs = n_jobs, fit_func = beta_fit, method = method, n_newton = n_newton, n_fit_jobs = n_jobs, chunk_size = chunk_size)
 	return beta_out
 
+def beta_fit(hsi_data, tgt_sig, kwargs):
+	n_band = hsi_data.shape[0]
+	method = kwargs.get('method', 'mle')
+
+	# fit the model on a clipped copy, the caller's data is left untouched
+	x = _clip(hsi_data)
+
+	if method == 'mom':
+		alphas, betas = beta_mom_fit(x, kwargs.get('n_newton', 10))
+	elif method == 'mle':
+		n_jobs = min(n_workers(kwargs.get('n_fit_jobs')), n_band)
+		if n_jobs <= 1:
+			params = np.array([_fit_band(band) for band in x])
+		else:
+			with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+				params = np.array(list(pool.map(_fit_band, x, chunksize = -(-n_band // n_jobs))))
+		alphas, betas = params[:,0], params[:,1]
+	else:
+		raise ValueError('unknown method ' + str(method))
+
+	return dict(kwargs, alphas = alphas, betas = betas)
+
+def _fit_band(band):
+	"""
+	scipy maximum likelihood beta fit of one band on [0, 1] (module level for the process pool)
+	"""
+	return beta.fit(band, floc = 0, fscale = 1)[:2]
+
+def beta_mom_fit(x, n_newton = 10):
+	"""
+	Beta distribution of every band, method of moments refined by batched Newton steps
+	 the moment estimates a = m c, b = (1 - m) c, c = m (1 - m) / v - 1 start Newton's method on the
+	 maximum likelihood equations psi(a) - psi(a + b) = mean(log x), psi(b) - psi(a + b) = mean(log(1 - x)),
+	 one 2 x 2 system per band solved in closed form
+
+	Inputs:
+	 x - n_band x n_pixel data in (0, 1)
+	 n_newton - number of Newton steps (0 for the moment estimates alone)
+
+	Outputs:
+	 alphas, betas - beta parameters of each band (n_band vectors)
+	"""
+	m = np.mean(x, 1)
+	v = np.var(x, 1)
+	c = np.maximum(m * (1 - m) / v - 1, 1e-3)
+	a, b = m * c, (1 - m) * c
+
+	mean_log = np.mean(np.log(x), 1)
+	mean_log1m = np.mean(np.log1p(-x), 1)
+
+	for _ in range(n_newton):
+		psi_ab = digamma(a + b)
+		g1 = digamma(a) - psi_ab - mean_log
+		g2 = digamma(b) - psi_ab - mean_log1m
+
+		t_ab = polygamma(1, a + b)
+		j11 = polygamma(1, a) - t_ab
+		j22 = polygamma(1, b) - t_ab
+		det = j11 * j22 - t_ab ** 2
+
+		a_new = a - (j22 * g1 + t_ab * g2) / det
+		b_new = b - (j11 * g2 + t_ab * g1) / det
+
+		# keep the parameters positive
+		a = np.where(a_new > 0, a_new, a / 2)
+		b = np.where(b_new > 0, b_new, b / 2)
+
+	return a, b
+
 def beta_helper(hsi_data, tgt_sig, kwargs):
-	n_band, n_pixel = hsi_data.shape
-	hsi_data[hsi_data <= 0] = 1e-6
-	hsi_data[hsi_data >= 1] = 1 - 1e-6
-
-	alphas = np.zeros(n_band)
-	betas = np.zeros(n_band)
-
-	# fit the model
-	loc = 0; scale = 1
-	for i in range(n_band):
-		params = beta.fit(hsi_data[i,:])
-		alphas[i] = params[0]
-		betas[i] = params[1]
-
-	# compute likelihood of each pixel
-	likelihood = np.zeros((n_band, n_pixel))
-	for i in range(n_band):
-		likelihood[i,:] = beta.logpdf(hsi_data[i,:], alphas[i], betas[i])
-	beta_data = - np.sum(likelihood, 0)
+	# fit the model unless already fit on the whole image
+	if kwargs.get('alphas') is None:
+		kwargs = beta_fit(hsi_data, tgt_sig, kwargs)
+
+	alphas = kwargs['alphas'][:, np.newaxis]
+	betas = kwargs['betas'][:, np.newaxis]
+	log_beta_fn = np.sum(gammaln(alphas) + gammaln(betas) - gammaln(alphas + betas))
+
+	n_pixel = hsi_data.shape[1]
+	chunk_size = kwargs.get('chunk_size') or n_pixel
+
+	# compute likelihood of each pixel, all the bands of a chunk of pixels at once
+	beta_data = np.zeros(n_pixel)
+	for c in range(0, n_pixel, chunk_size):
+		x = _clip(hsi_data[:, c:c + chunk_size])
+		likelihood = (alphas - 1) * np.log(x) + (betas - 1) * np.log1p(-x)
+		beta_data[c:c + chunk_size] = log_beta_fn - np.sum(likelihood, 0)
+
 	return beta_data, {}
+
+def _clip(hsi_data):
+	"""
+	Copy of the data with the values moved into (0, 1)
+	"""
+	return np.clip(hsi_data, 1e-6, 1 - 1e-6)
@@ -1,8 +1,9 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import whitener
 import numpy as np
 import skfuzzy as fuzz
 
-def fcbad_anomaly(hsi_img, n_cluster, mask = None):
+def fcbad_anomaly(hsi_img, n_cluster, mask = None, n_sample = None, chunk_size = 16384):
 	"""
 	Fuzzy Cluster Based Anomaly Detection (FCBAD)
 	Ref: Hytla, Patrick C., et al. "Anomaly detection in hyperspectral imagery: comparison of methods using diurnal and seasonal data." Journal of Applied Remote Sensing 3.1 (2009): 033546
@@ -14,6 +15,9 @@ def fcbad_anomaly(hsi_img, n_cluster, mask = None):
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
 	 n_cluster - number of clusters to use
+	 n_sample - (optional) fit the fuzzy c-means centers on a random subsample of n_sample pixels,
+	            the memberships of all the pixels then follow from the centers in one pass
+	 chunk_size - number of pixels processed at a time (bounds the temporary memory)
 
 	Outputs:
 	 fcbad_out - detector output image
@@ -23,49 +27,81 @@ def fcbad_anomaly(hsi_img, n_cluster, mask = None):
 	5/5/2018 - Edited by Alina Zare
 	11/2018 - Python Implementation by Yutai Zhou
 	"""
-	fcbad_out, kwargsout = img_det(fcbad_out_helper, hsi_img, None, mask, n_cluster = n_cluster)
+	fcbad_out, kwargsout = img_det(fcbad_out_helper, hsi_img, None, mask, pixel_out = ['idx'], n_cluster = n_cluster, n_sample = n_sample, chunk_size = chunk_size)
 	cluster_img = kwargsout['idx']
 	return fcbad_out, cluster_img
 
 def fcbad_out_helper(hsi_data, tgt_sig, kwargs):
 	n_cluster = kwargs['n_cluster']
 	n_band, n_pixel = hsi_data.shape
+	chunk_size = kwargs.get('chunk_size') or n_pixel
 
 	options = {'c': n_cluster, # number of clusters
 			   'm': 2.0,	       # exponent for the partition matrix
 			   'error': 1e-6,  # minimum amount of improvement
 			   'maxiter': 500} # max number of iterations
 
-	C, U, _, _, _, _, _ = fuzz.cluster.cmeans(hsi_data, **options)
-	idx = np.max(U,0)
+	# fuzzy c-means centers, from a random subsample if n_sample is given
+	n_sample = kwargs.get('n_sample')
+	fit_data = hsi_data
+	if n_sample is not None and n_sample < n_pixel:
+		fit_data = hsi_data[:, np.sort(np.random.choice(n_pixel, n_sample, replace = False))]
 
-	# Cluster stats
-	mu = np.zeros((n_band, n_cluster))
-	sig_inv = np.zeros((n_band, n_band, n_cluster))
+	C, _, _, _, _, _, _ = fuzz.cluster.cmeans(fit_data, **options)
 
-	for i in range(n_cluster):
-		mu[:,i] = C[i,:].T
+	# Cluster stats
+	mu = C
+	scatter = np.zeros((n_cluster, n_band, n_band))
+	weights = np.zeros(n_cluster)
+	U_all = np.empty((n_cluster, n_pixel))
+
+	# memberships (kept for the scoring) and membership weighted covariance for each cluster,
+	# accumulated over chunks of pixels
+	for c in range(0, n_pixel, chunk_size):
+		x = hsi_data[:, c:c + chunk_size]
+		U = U_all[:, c:c + chunk_size] = fcm_memberships(x, C, options['m'])
+		for i in range(n_cluster):
+			z = x - mu[i][:, np.newaxis]
+			scatter[i] += (z * U[i]) @ z.T
+			weights[i] += np.sum(U[i])
 
-		#computer membership weighted covariance for the cluster
-		sigma = np.zeros((n_band, n_band))
-		for j in range(n_pixel):
-			z = hsi_data[:,j] - mu[:,i]
-			sigma += U[i,j] * (z @ z.T)
+	sigma = scatter / weights[:, np.newaxis, np.newaxis]
 
-		sigma /= np.sum(U[i,:])
-		s = np.float32(np.linalg.svd(sigma, compute_uv=False))
-		rcond = np.max(sigma.shape)*np.spacing(np.float64(np.linalg.norm(s, ord=np.inf)))
-		sig_inv[:,:,i] = np.linalg.pinv(sigma, rcond=rcond)
+	# inverse Cholesky factors of all the clusters (diagonally loaded if singular)
+	W = whitener(sigma, 'chol')
 
 	# compute total membership weighted Mahalanobis Distance
+	# (needs the covariances of all the pixels, so a second pass over the data)
 	fcbad_data = np.zeros(n_pixel)
+	idx = np.argmax(U_all, 0)
 
-	for j in range(n_pixel):
-		m_dists = np.zeros(n_cluster)
+	for c in range(0, n_pixel, chunk_size):
+		x = hsi_data[:, c:c + chunk_size]
+		U = U_all[:, c:c + chunk_size]
 
+		m_dists = np.zeros(U.shape)
 		for i in range(n_cluster):
-			z = hsi_data[:,j] - mu[:,i]
-			m_dists[i] = z.T @ sig_inv[:,:,i] @ z
+			m_dists[i] = np.sum((W[i] @ (x - mu[i][:, np.newaxis])) ** 2, 0)
+
+		fcbad_data[c:c + chunk_size] = np.sum(U * m_dists, 0)
 
-		fcbad_data[j] = U[:,j].T @ m_dists
 	return fcbad_data, {'idx': idx}
+
+def fcm_memberships(hsi_data, centers, m = 2.0):
+	"""
+	Fuzzy c-means memberships of spectra to given cluster centers (same update as skfuzzy cmeans)
+
+	Inputs:
+	 hsi_data - n_band x n_pixel array of spectra
+	 centers - n_cluster x n_band cluster centers
+	 m - exponent for the partition matrix
+
+	Outputs:
+	 U - n_cluster x n_pixel memberships, each column sums to one
+	"""
+	d2 = np.sum(hsi_data ** 2, 0) - 2 * centers @ hsi_data + np.sum(centers ** 2, 1)[:, np.newaxis]
+	d = np.fmax(np.sqrt(np.maximum(d2, 0)), np.finfo(np.float64).eps)
+
+	# u_i = d_i^(-2 / (m - 1)) / sum_k d_k^(-2 / (m - 1)), scaled by the closest distance
+	U = (d / np.min(d, 0)) ** (-2 / (m - 1))
+	return U / np.sum(U, 0)
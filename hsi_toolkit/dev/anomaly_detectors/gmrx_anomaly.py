@@ -1,38 +1,10 @@
-from hsi_toolkit.util import img_det
-import numpy as np
-from sklearn.mixture import GaussianMixture
-
-def gmrx_anomaly(hsi_img, n_comp, mask = None):
-	"""
-	Gaussian Mixture RX Anomaly Detector
-	 fits GMM assuming entire image is background
-	 assigns pixels to highest posterior probability mixture component
-	 computes pixel Mahlanobis distance to component mean
-
-	Inputs:
-	 hsi_image - n_row x n_col x n_band hyperspectral image
-	 mask - binary image limiting detector operation to pixels where mask is true
-	        if not present or empty, no mask restrictions are used
-	 n_comp - number of Gaussian components to use
-
-	Outputs:
-	  gmrx_out - detector output image
-
-	8/7/2012 - Taylor C. Glenn - tcg@cise.ufl.edu
-	5/5/2018 - Edited by Alina Zare
-	11/2018 - Python Implementation by Yutai Zhou
-	"""
-	gmm_out, kwargsout = img_det(gmrx_helper, hsi_img, None, mask, n_comp = n_comp)
-	return gmm_out
-
-def gmrx_helper(hsi_data, tgt_sig, kwargs):
-	n_comp = kwargs['n_comp']
-	n_pixel = hsi_data.shape[1]
-	gmm = GaussianMixture(n_components = n_comp, max_iter = 1, init_params = 'random').fit(hsi_data.T)
-
-	# cluster/assign mixture component to each pixel, get Mahalanobis distance to components
-	idx = gmm.predict(hsi_data.T)
-
-	gmrx_data = np.zeros(n_pixel)
-	# for i in range(n_pixel):
-	# 	gmrx_data[i] =
+from hsi_toolkit.anomaly_detectors.gmrx_anomaly import gmrx_fit, gmrx_helper
+from hsi_toolkit.anomaly_detectors.gmrx_anomaly import gmrx_anomaly as _gmrx_anomaly
+import functools
+import warnings
+
+@functools.wraps(_gmrx_anomaly)
+def gmrx_anomaly(*args, **kwargs):
+	# gmrx_anomaly moved out of dev, kept here for existing imports
+	warnings.warn('hsi_toolkit.dev.anomaly_detectors.gmrx_anomaly is deprecated, use hsi_toolkit.anomaly_detectors.gmrx_anomaly', DeprecationWarning, stacklevel = 2)
+	return _gmrx_anomaly(*args, **kwargs)
@@ -1,7 +1,8 @@
 from hsi_toolkit.util import pca
+from hsi_toolkit.util import local_stats, sym_pinv, stripe_map
 import numpy as np
 
-def ssrx_anomaly(hsi_img, n_dim_ss, guard_win, bg_win):
+def ssrx_anomaly(hsi_img, n_dim_ss, guard_win, bg_win, n_jobs = None):
 	"""
 	function ssrx_img = ssrx_anomaly(hsi_img,n_dim_ss,guard_win,bg_win)
 
@@ -14,6 +15,8 @@ def ssrx_anomaly(hsi_img, n_dim_ss, guard_win, bg_win):
 	  n_dim_ss - number of leading dimensions to use in the background subspace
 	  guard_win - guard window radius (square,symmetric about pixel of interest)
 	  bg_win - background window radius
+	  n_jobs - (optional) number of processes, the image is split into n_jobs column stripes
+	           (with guard_win + bg_win columns of overlap) run in parallel, -1 for one per CPU
 
 	8/7/2012 - Taylor C. Glenn
 	5/5/2018 - Edited by Alina Zare
@@ -28,37 +31,28 @@ def ssrx_anomaly(hsi_img, n_dim_ss, guard_win, bg_win):
 
 	pca_img = np.reshape(pca_data.T, (n_row, n_col, n_band), order='F')
 	proj = np.eye(n_band) - evecs[:, :n_dim_ss] @ evecs[:, :n_dim_ss].T
-	# Create the mask
-	mask_width = 1 + 2 * guard_win + 2 * bg_win
-	half_width = guard_win + bg_win
-	mask_rg = np.array(range(mask_width)) - 1
-
-	b_mask = np.ones((mask_width, mask_width), dtype=bool)
-	b_mask[bg_win:b_mask.shape[0] - bg_win, bg_win:b_mask.shape[0] - bg_win] = 0
 
 	# run the detector (only on fully valid points)
-	ssrx_img = np.zeros((n_row, n_col))
-
-	for i in range(n_col - mask_width + 1):
-		for j in range(n_row - mask_width + 1):
-			row = j + half_width
-			col = i + half_width
-
-			b_mask_img = np.zeros((n_row, n_col))
-			b_mask_img[j:mask_width + j, i:mask_width + i] = b_mask
-			b_mask_list = np.reshape(b_mask_img, -1, order='F')
-			# pull out background points
-			bg = pca_data[:, b_mask_list == 1]
-
-			# Mahalanobis distance
-			covariance = np.cov(bg.T, rowvar=False)
-
-			s = np.float32(np.linalg.svd(covariance, compute_uv=False))
-			rcond = np.max(covariance.shape)*np.spacing(np.float32(np.linalg.norm(s, ord=np.inf)))
-			# pinv differs from MATLAB
-			sig_inv = np.linalg.pinv(covariance)
-			mu = np.mean(bg, 1)
-			z = proj @ pca_img[row, col, :].squeeze() - proj @ mu
-			ssrx_img[row, col] = z.T @ sig_inv @ z
-
+	ssrx_img, = stripe_map(ssrx_stripe, pca_img, guard_win + bg_win, n_jobs, proj, guard_win, bg_win)
 	return ssrx_img
+
+def ssrx_stripe(pca_img, stripe, proj, guard_win, bg_win):
+	"""
+	ssrx_anomaly on the output columns stripe = (first, last + 1) of the PCA image, see stripe_map
+	"""
+	n_row, n_col, n_band = pca_img.shape
+	halo = guard_win + bg_win
+	c0, c1 = max(stripe[0] - halo, 0), min(stripe[1] + halo, n_col)
+
+	pca_img = pca_img[:, c0:c1, :]
+	ssrx_img = np.zeros((n_row, c1 - c0))
+
+	# local background statistics of the PCA data, a row of window centers at a time
+	for row, cols, _, mu, covariance in local_stats(pca_img, guard_win, bg_win):
+		# Mahalanobis distance
+		# pinv differs from MATLAB
+		sig_inv = sym_pinv(covariance)
+		z = (pca_img[row, cols, :] - mu) @ proj.T
+		ssrx_img[row, cols] = np.einsum('ij,ijk,ik->i', z, sig_inv, z)
+
+	return (ssrx_img[:, stripe[0] - c0:stripe[1] - c0],)
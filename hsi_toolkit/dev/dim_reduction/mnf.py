@@ -1,4 +1,7 @@
+from hsi_toolkit.util import BackgroundModel, estimate_noise_cov, image_key
+import threading
 import numpy as np
+from collections import OrderedDict
 def mnf(in_img, eigval_retain = 1):
 	"""
 	Maximum Noise Fraction code
@@ -18,52 +21,80 @@ def mnf(in_img, eigval_retain = 1):
 	Latest Revision: June 3, 2018
 	Python Implementation by Yutai Zhou on 12/2018
 	"""
-	# get the noise covariance
-	# assumes neighbor pixels are essentially the same except for noise
-	# use a simple mask of neighbor pixels to the right and below
 	n_row, n_col, n_band = in_img.shape
 	n_pixel = n_row * n_col
 
 	hsi_data = in_img.reshape((n_pixel, n_band), order='F').T
 
-	mu = np.mean(hsi_data,1)[:,np.newaxis]
-	running_cov = np.zeros((n_band, n_band))
+	n_dim, A, eig_vals, mu = mnf_transform(in_img, eigval_retain)
+	out_img = (A @ (hsi_data - mu)).T.reshape((n_row, n_col, n_dim), order = 'F')
 
-	for i in range(n_col - 1):
-		for j in range(n_row - 1):
+	return out_img, n_dim, A, eig_vals, mu
 
-			diff1 = (in_img[j,i+1,:] - in_img[j,i,:])[:,np.newaxis]
-			diff2 = (in_img[j+1,i,:] - in_img[j,i,:])[np.newaxis,:]
-			running_cov = running_cov + diff1 @ diff1.T + diff2 @ diff2.T
+def mnf_transform(in_img, eigval_retain = 1, tile_rows = None):
+	"""
+	MNF transform of an image, without transforming the image
+	 the transform only needs the noise covariance and the data mean and covariance, both
+	 accumulated over blocks of rows (so in_img can be a np.memmap); it is cached per image
+	 (with the noise covariance, see util.estimate_noise_cov), so mnf, mtmf_statistic and
+	 later runs on the same image reuse it
 
-	noise_cov = 1 / (2 * (n_row - 1) * (n_col - 1) - 1) * running_cov
+	Inputs:
+	  in_img: hyperspectral data cube (n_row x n_cols x n_bands)
+	  eigval_retain: percentage of eigenvalue to retain durig dimensionality reduction step. If 1, no reduction is done.
+	  tile_rows: (optional) number of image rows read at a time
+
+	Outputs:
+	  n_dim: number of retained dimensions
+	  A: MNF transform (n_dim x n_bands), MNF components are A @ (x - mu)
+	  eig_vals: eigenvalues of the retained components (n_dim x n_dim diagonal matrix)
+	  mu: data mean (n_bands x 1)
+	  (A, eig_vals and mu are shared with the cache and read-only, copy them to modify)
+	"""
+	key = (image_key(in_img), eigval_retain)
+	with _lock:
+		if key in _transforms:
+			_transforms.move_to_end(key)
+			return _transforms[key]
+
+	# get the noise covariance
+	# assumes neighbor pixels are essentially the same except for noise
+	# use a simple mask of neighbor pixels to the right and below
+	noise_cov = estimate_noise_cov(in_img, tile_rows)
 	U_noise, S_noise, _ = np.linalg.svd(noise_cov)
 	S_noise = np.diag(S_noise)
 
 	# align and whiten noise
-	hsi_prime = np.linalg.pinv(np.sqrt(S_noise)) @ U_noise @ (hsi_data - mu)
-
-	# PCA the noise whitened data
-	U, S, _ = np.linalg.svd(np.cov(hsi_prime.T, rowvar=False))
+	W = np.linalg.pinv(np.sqrt(S_noise)) @ U_noise.T
 
-	hsi_mnf = U @ hsi_prime
+	# PCA the noise whitened data, its covariance is W @ sigma @ W.T
+	bg_model = BackgroundModel.from_img(in_img, None, tile_rows or max(1, 16384 // in_img.shape[1]))
+	U, S, _ = np.linalg.svd(W @ bg_model.sigma @ W.T)
 
-	out_img = hsi_mnf.T.reshape((n_row, n_col, n_band), order = 'F')
+	A = U.T @ W
 
-	A = U @ np.linalg.pinv(np.sqrt(S_noise)) @ U_noise
-
-	n_dim = n_band
+	n_dim = A.shape[0]
 	if eigval_retain < 1:
 		pcts = np.cumsum(S) / np.sum(S)
 		cut_ind = np.where(pcts >= eigval_retain)[0]
 
-		out_img = out_img[:,:,:cut_ind[0]+1]
 		n_dim = cut_ind[0]+1
-		# mu = mu[:cut_ind[0]+1,0][:,np.newaxis]
-		# A = A[:,:cut_ind[0]+1]
 		A = A[:cut_ind[0]+1,:]
 
 	eig_vals = np.diag(S[:n_dim])
+	mu = bg_model.mu[:,np.newaxis]
 
-	# print(n_dim,mu.shape, A.shape)
-	return out_img, n_dim, A, eig_vals, mu
+	# cached arrays are shared by every caller, keep them read-only
+	for arr in (A, eig_vals, mu):
+		arr.flags.writeable = False
+
+	with _lock:
+		_transforms[key] = (n_dim, A, eig_vals, mu)
+		while len(_transforms) > 4:
+			_transforms.popitem(last = False)
+
+	return n_dim, A, eig_vals, mu
+
+# MNF transforms of the last few images
+_transforms = OrderedDict()
+_lock = threading.Lock()
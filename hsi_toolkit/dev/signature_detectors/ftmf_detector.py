@@ -1,6 +1,7 @@
+from hsi_toolkit.util import sym_pinv
 import numpy as np
 
-def ftmf_detector(hsi_img, tgt_sig, gamma = 1):
+def ftmf_detector(hsi_img, tgt_sig, gamma = 1, chunk_size = 16384):
 	"""
 	Finite Target Matched Filter
 
@@ -8,6 +9,7 @@ def ftmf_detector(hsi_img, tgt_sig, gamma = 1):
 	 hsi_image - n_row x n_col x n_band hyperspectral image
 	 tgt_sig - target signature (n_band x 1 - column vector)
 	 gamma - scale factor of background variance to model target variance (V_t = gamma^2*V_bg)
+	 chunk_size - number of pixels scored at a time (bounds the temporary memory)
 
 	Outputs:
 	 ftmf_out - detector image
@@ -30,36 +32,90 @@ def ftmf_detector(hsi_img, tgt_sig, gamma = 1):
 	mu = np.mean(hsi_data,1)
 	mu = mu[:,np.newaxis]
 	sigma = np.cov(hsi_data.T, rowvar=False)
-	sig_inv = np.linalg.pinv(sigma)
+	sig_inv = sym_pinv(sigma)
+	logdet = np.linalg.slogdet(sigma)[1]
 
 	s = tgt_sig - mu
-	z = hsi_data - mu
-	f = s.T @ sig_inv
+	f = (s.T @ sig_inv).squeeze()
 
 	#signal to cluster ratio
-	scr = s.T @ sig_inv @ s
+	scr = (s.T @ sig_inv @ s).item()
 
 	ftmf_data = np.zeros(n_pixel)
-	g2p1 = gamma ** 2 + 1
-	for i in range(n_pixel):
-		md = z[:,i] @ sig_inv @ z[:,i] # mahalanobis distance
-		mf = f @ z[:,i] # matched filter
-		A = n_band * g2p1 ** 2
-		B = (mf - 3 * n_band) * g2p1 ** 2 - scr
-		C = -md * g2p1 + n_band * gamma ** 2 + 3 * n_band + scr
-		D = -n_band - mf + md
-
-		r = np.real(np.roots([A, B, C, D]))
-		r_ind = np.where(np.bitwise_and(r>=0, r<=1))[0]
-		if r_ind.shape[0] == 0:
-			alpha = 1
-		else:
-			alpha = r[r_ind[0]]
-		mu_a = alpha * s + (1 - alpha) * mu
-		sigma_a = (alpha ** 2 * gamma ** 2 + (1 - alpha)**2) * sigma
-		sig_inv_a = np.linalg.pinv(sigma_a)
-
-		x_mu_a = hsi_data[:,i][:,np.newaxis] - mu_a
-
-		ftmf_data[i] = (md - x_mu_a.T @ sig_inv_a @ x_mu_a - np.linalg.slogdet(sigma_a)[1]).squeeze()
+	for c in range(0, n_pixel, chunk_size):
+		z = hsi_data[:, c:c + chunk_size] - mu
+		md = np.sum(z * (sig_inv @ z), 0) # mahalanobis distance
+		mf = f @ z # matched filter
+		ftmf_data[c:c + chunk_size] = _ftmf_score(md, mf, scr, n_band, gamma) - logdet
+
 	return ftmf_data.reshape((n_row, n_col), order='F')
+
+def _ftmf_score(md, mf, scr, n_band, gamma):
+	"""
+	Finite target log likelihood ratio of every pixel, maximized over the target fraction alpha in [0, 1]
+	 target + background pixel x = alpha * t + (1 - alpha) * b, with mean mu + alpha * s and covariance
+	 sigma_a = c * sigma, c = alpha^2 * gamma^2 + (1 - alpha)^2, so with z = x - mu
+	 (x - mu_a).T @ inv(sigma_a) @ (x - mu_a) = (md - 2 alpha mf + alpha^2 scr) / c and log|sigma_a| = log|sigma| + n_band log c;
+	 the stationary points of the likelihood are the roots of a cubic in alpha, all the cubics are
+	 solved at once in closed form
+
+	Inputs:
+	 md - Mahalanobis distances z.T @ sig_inv @ z (n vector)
+	 mf - matched filter outputs s.T @ sig_inv @ z (n vector)
+	 scr - signal to clutter ratio s.T @ sig_inv @ s
+	 n_band - number of bands
+	 gamma - target to background standard deviation ratio
+
+	Outputs:
+	 score - md - (x - mu_a).T @ inv(sigma_a) @ (x - mu_a) - n_band log c at the most likely alpha
+	         (log|sigma| not included)
+	"""
+	n = md.size
+	g = gamma ** 2 + 1
+
+	# cubic A alpha^3 + B alpha^2 + C alpha + D = 0, made monic
+	A = n_band * g ** 2
+	B = (mf - 3 * n_band) * g - scr
+	C = -md * g + n_band * gamma ** 2 + 3 * n_band + scr
+	D = -n_band - mf + md
+
+	# candidates: the real roots in [0, 1] and both ends of the interval
+	r = _cubic_roots(B / A, C / A, D / A)
+	alpha = np.where((r >= 0) & (r <= 1), r, np.nan)
+	alpha = np.hstack((alpha, np.zeros((n, 1)), np.ones((n, 1))))
+
+	scale = alpha ** 2 * gamma ** 2 + (1 - alpha) ** 2
+	md_a = (md[:, np.newaxis] - 2 * alpha * mf[:, np.newaxis] + alpha ** 2 * scr) / scale
+	score = md[:, np.newaxis] - md_a - n_band * np.log(scale)
+
+	return np.nanmax(score, 1)
+
+def _cubic_roots(b, c, d):
+	"""
+	Real roots of the monic cubics x^3 + b x^2 + c x + d (b, c, d vectors), trigonometric
+	 solution for three real roots, Cardano's formula for one
+
+	Outputs:
+	 roots - n x 3 real roots, NaN where a cubic has fewer than three
+	"""
+	b, c, d = np.broadcast_arrays(b, c, d)
+
+	# depressed cubic t^3 + p t + q, x = t - b / 3
+	p = c - b ** 2 / 3
+	q = 2 * b ** 3 / 27 - b * c / 3 + d
+	disc = (q / 2) ** 2 + (p / 3) ** 3
+
+	roots = np.full((b.size, 3), np.nan)
+
+	one = disc > 0
+	sq = np.sqrt(disc[one])
+	roots[one, 0] = np.cbrt(-q[one] / 2 + sq) + np.cbrt(-q[one] / 2 - sq)
+
+	three = ~one
+	m = 2 * np.sqrt(-p[three] / 3)
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		theta = np.arccos(np.clip(3 * q[three] / (p[three] * m), -1, 1)) / 3
+	theta = np.where(m > 0, theta, 0)
+	roots[three] = m[:, np.newaxis] * np.cos(theta[:, np.newaxis] - 2 * np.pi * np.arange(3) / 3)
+
+	return roots - b[:, np.newaxis] / 3
@@ -1,8 +1,7 @@
-from hsi_toolkit.util import img_det
-from hsi_toolkit.dev.dim_reduction import mnf
+from hsi_toolkit.dev.dim_reduction import mnf_transform
 import numpy as np
 
-def mtmf_statistic(hsi_img,tgt_sig, mask = None):
+def mtmf_statistic(hsi_img,tgt_sig, mask = None, mnf_model = None, tile_rows = None, out = None, alpha_out = None):
 	"""
 	Mixture Tuned Matched Filter Infeasibility Statistic
 
@@ -11,6 +10,12 @@ def mtmf_statistic(hsi_img,tgt_sig, mask = None):
 	 tgt_sig - target signature (n_band x 1 - column vector)
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
+	 mnf_model - (optional) MNF transform of a previous run, the outputs (n_dim, A, eig_vals, mu) of
+	             dev.dim_reduction.mnf_transform or (out_img, n_dim, A, eig_vals, mu) of mnf, as returned,
+	             by default the (cached) transform of hsi_img from dev.dim_reduction.mnf_transform
+	 tile_rows - (optional) number of image rows transformed and scored at a time (default about 16384 pixels),
+	             hsi_img can be a np.memmap
+	 out, alpha_out - (optional) preallocated n_row x n_col outputs, e.g. np.memmaps, for mtmf_out and alpha
 
 	Outputs:
 	 mtmf_out - MTMF infeasibility statistic
@@ -22,34 +27,47 @@ def mtmf_statistic(hsi_img,tgt_sig, mask = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	mnf_img, n_dim, mnf_vecs, mnf_eigvals, mnf_mu = mnf(hsi_img,1);
-	# tgt_sig = tgt_sig[:n_dim,0][:,np.newaxis]
+	n_row, n_col, n_band = hsi_img.shape
+	mask = np.ones((n_row, n_col), dtype=bool) if mask is None else mask.astype(bool)
+
+	if mnf_model is None:
+		mnf_model = mnf_transform(hsi_img, 1, tile_rows)
+	# both mnf_transform and mnf outputs end with A, eig_vals, mu
+	mnf_vecs, mnf_eigvals, mnf_mu = mnf_model[-3:]
 	s = mnf_vecs @ (tgt_sig - mnf_mu)
 
-	mtmf_out, kwargsout = img_det(mtmf_helper, mnf_img, s, mnf_eigvals = mnf_eigvals)
+	mtmf_out = np.zeros((n_row, n_col)) if out is None else out
+	alpha = np.zeros((n_row, n_col)) if alpha_out is None else alpha_out
+
+	# MNF transform and score blocks of rows
+	step = max(1, 16384 // n_col) if tile_rows is None else tile_rows
+	for r0 in range(0, n_row, step):
+		tile_mask = mask[r0:r0 + step,:]
+		x = np.asarray(hsi_img[r0:r0 + step,:,:], dtype=np.float64)[tile_mask].T
+		if x.shape[1] == 0: continue
+
+		mtmf_data, kwargsout = mtmf_helper(mnf_vecs @ (x - mnf_mu), s, {'mnf_eigvals': mnf_eigvals})
+		mtmf_out[r0:r0 + step,:][tile_mask] = mtmf_data
+		alpha[r0:r0 + step,:][tile_mask] = kwargsout['alpha']
 
-	return mtmf_out, kwargsout['alpha']
+	return mtmf_out, alpha
 
 def mtmf_helper(hsi_data, tgt_sig, kwargs):
 	mnf_eigvals = kwargs['mnf_eigvals']
-	n_band, n_pixel = hsi_data.shape
+	if mnf_eigvals.ndim == 2:
+		mnf_eigvals = np.diag(mnf_eigvals)
 
 	z = hsi_data
 	s = tgt_sig
 	sts = s.T @ s
 
-	alpha = np.zeros(n_pixel)
-	mtmf_data = np.zeros(n_pixel)
-	ev = np.sqrt(mnf_eigvals)
-	one = np.ones(n_band)
+	# matched filter abundances, clipped to [0, 1]
+	alpha = np.clip((s.T @ z / sts).squeeze(0), 0, 1)
 
-	for i in range(n_pixel):
-		# print(s.shape,z.shape, z[:,i].shape)
-		a = (s.T @ z[:,i][:,np.newaxis] / sts).squeeze()
-		alpha[i] = np.max((0, np.min((1, a))))
-		# print(alpha[i])
-		sig_inv = 1 / ((ev * (1 - alpha[i]) - one) ** 2)
+	# diagonal inverse variances of every pixel's mixture
+	ev = np.sqrt(mnf_eigvals)[:, np.newaxis]
+	sig_inv = 1 / ((ev * (1 - alpha) - 1) ** 2)
 
-		mtmf_data[i] = z[:,i][np.newaxis,:] @ sig_inv @ z[:,i][:,np.newaxis]
+	mtmf_data = np.sum(z ** 2 * sig_inv, 0)
 
 	return mtmf_data, {'alpha': alpha}
@@ -1,3 +1,4 @@
+from hsi_toolkit.util import sym_pinv, estimate_noise_cov
 import numpy as np
 def qmf_detector(hsi_img, tgt_sig, tgt_cov):
 	"""
@@ -23,21 +24,13 @@ def qmf_detector(hsi_img, tgt_sig, tgt_cov):
 	hsi_data = hsi_img.reshape((n_pixel, n_band), order ='F').T
 
 	#get an estimate of the noise covariance of the image
-	running_cov = np.zeros((n_band, n_band))
-	for i in range(n_col - 1):
-		for j in range(n_row - 1):
-
-			diff1 = (hsi_img[j,i+1,:] - hsi_img[j,i,:])[:,np.newaxis]
-			diff2 = (hsi_img[j+1,i,:] - hsi_img[j,i,:])[np.newaxis,:]
-			running_cov = running_cov + diff1 @ diff1.T + diff2 @ diff2.T
-
-	noise_cov = running_cov / (2 * n_pixel - 1)
+	noise_cov = estimate_noise_cov(hsi_img)
 	# precompute other stats
 	mu = np.mean(hsi_data,1)
 	sigma = np.cov(hsi_data.T, rowvar=False)
 
-	sig_inv_bn = np.linalg.pinv(sigma + noise_cov)
-	sig_inv_sn = np.linalg.pinv(tgt_cov + noise_cov)
+	sig_inv_bn = sym_pinv(sigma + noise_cov)
+	sig_inv_sn = sym_pinv(tgt_cov + noise_cov)
 
 	z = hsi_data - mu[:, np.newaxis]
 	w = hsi_data - tgt_sig
@@ -1,7 +1,8 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
 import numpy as np
 
-def spsmf_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
+def spsmf_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None, bg_model = None, tile_rows = None, chunk_size = 16384, cov_method = 'pinv'):
 	"""
 	Subpixel Spectral Matched Filter
 	 matched filter derived from a subpixel mixing model
@@ -16,6 +17,11 @@ def spsmf_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
 	        if not present or empty, no mask restrictions are used
 	 mu - background mean (n_band x 1 column vector)
 	 siginv - background inverse covariance (n_band x n_band matrix)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 chunk_size - number of pixels scored at a time (bounds the temporary memory)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 spsmf_out - detector image
@@ -27,35 +33,38 @@ def spsmf_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	spsmf_out, kwargsout = img_det(spsmf_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv)
+	spsmf_out, kwargsout = img_det(spsmf_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method, tile_rows = tile_rows, chunk_size = chunk_size)
 
 	return spsmf_out
 
 def spsmf_helper(hsi_data, tgt_sig, kwargs):
-	mu = np.mean(hsi_data, axis = 1) if kwargs['mu'] is None else kwargs['mu']
-	mu = mu[:, np.newaxis]
-	sig_inv = np.linalg.pinv(np.cov(hsi_data.T, rowvar = False)) if kwargs['sig_inv'] is None else kwargs['sig_inv']
+	bg_model = get_bg_model(hsi_data, kwargs)
+	mu = bg_model.mu[:, np.newaxis]
+	sig_inv = bg_model.sig_inv
 
 	n_band, n_pixel = hsi_data.shape
 	s = tgt_sig # 72 x 1
 	st_sig_inv = s.T @ sig_inv # 1 x 72
 	st_sig_inv_s = s.T @ sig_inv @ s # 1 x 1
+	mu_sig_inv = mu.T @ sig_inv # 1 x 72
 	K = n_band
+	chunk_size = kwargs.get('chunk_size') or n_pixel
 
 	spsmf_data = np.zeros(n_pixel)
 
-	for i in range(n_pixel):
-		x = hsi_data[:,i][:, np.newaxis] # 72x1
-		st_sig_inv_x = st_sig_inv @ x # 1 x 1
-		a0 = (x.T @ sig_inv @ x) * st_sig_inv_s - st_sig_inv_x ** 2
-		a1 = st_sig_inv_x * (s.T @ sig_inv @ mu) - st_sig_inv_s * (mu.T @ sig_inv @ x)
+	# a chunk of pixels at a time, one column per pixel
+	for c in range(0, n_pixel, chunk_size):
+		x = hsi_data[:, c:c + chunk_size] # 72 x n
+		st_sig_inv_x = st_sig_inv @ x # 1 x n
+		a0 = np.sum(x * (sig_inv @ x), 0) * st_sig_inv_s - st_sig_inv_x ** 2
+		a1 = st_sig_inv_x * (st_sig_inv @ mu) - st_sig_inv_s * (mu_sig_inv @ x)
 		a2 = -K * st_sig_inv_s
 
-		beta = (-a1 + np.sqrt(a1 ** 2 - 4 * a2 * a0)) / (2 * a2)
-		alpha = st_sig_inv @ (x - beta * mu) / st_sig_inv_s
+		beta = (-a1 + np.sqrt(a1 ** 2 - 4 * a2 * a0)) / (2 * a2) # 1 x n
+		alpha = (st_sig_inv_x - beta * (st_sig_inv @ mu)) / st_sig_inv_s
 		z1 = x - mu
-		z2 = x - alpha * s - beta * mu
+		z2 = x - s @ alpha - mu @ beta
 
-		spsmf_data[i] = z1.T @ sig_inv @ z1 - (z2.T @ sig_inv @ z2) / (beta ** 2) - 2 * K * np.log(np.abs(beta))
+		spsmf_data[c:c + chunk_size] = (np.sum(z1 * (sig_inv @ z1), 0) - np.sum(z2 * (sig_inv @ z2), 0) / (beta ** 2) - 2 * K * np.log(np.abs(beta))).ravel()
 
 	return spsmf_data, {}
@@ -8,11 +8,13 @@ from hsi_toolkit.signature_detectors.amsd_detector import *
 from hsi_toolkit.signature_detectors.ccmf_detector import *
 from hsi_toolkit.signature_detectors.cem_detector import *
 from hsi_toolkit.signature_detectors.ctmf_detector import *
+from hsi_toolkit.signature_detectors.detector_bank import *
 from hsi_toolkit.signature_detectors.fam_statistic import *
 from hsi_toolkit.signature_detectors.ha_detector import *
 from hsi_toolkit.signature_detectors.hsd_detector import *
 from hsi_toolkit.signature_detectors.hsd_local_detector import *
 from hsi_toolkit.signature_detectors.hua_detector import *
+from hsi_toolkit.signature_detectors.library_detector import *
 from hsi_toolkit.signature_detectors.osp_detector import *
 from hsi_toolkit.signature_detectors.palm_detector import *
 from hsi_toolkit.signature_detectors.sam_detector import *
@@ -1,8 +1,8 @@
 from hsi_toolkit.util import img_det
-from hsi_toolkit.util import unmix
+from hsi_toolkit.util import cached_unmix
 import numpy as np
 
-def abd_detector(hsi_img, tgt_sig, ems, mask = None):
+def abd_detector(hsi_img, tgt_sig, ems, mask = None, tile_rows = None):
 	"""
 	Abundance of Target when unmixed with background endmembers
 
@@ -12,6 +12,7 @@ def abd_detector(hsi_img, tgt_sig, ems, mask = None):
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
 	 ems - background endmembers
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
 
 	Outputs:
 	 abd_out - detector image
@@ -23,14 +24,14 @@ def abd_detector(hsi_img, tgt_sig, ems, mask = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	abd_out, kwargsout = img_det(abd_helper,hsi_img,tgt_sig,mask,ems = ems);
+	abd_out, kwargsout = img_det(abd_helper,hsi_img,tgt_sig,mask,ems = ems, tile_rows = tile_rows);
 
 	return abd_out
 
 def abd_helper(hsi_data, tgt_sig, kwargs):
 	ems = kwargs['ems']
 	# unmix data with target signature and background
-	targ_P = unmix(hsi_data, np.hstack((tgt_sig, ems)))
+	targ_P = cached_unmix(hsi_data, np.hstack((tgt_sig, ems))) if kwargs.get('targ_P') is None else kwargs['targ_P']
 
 	abd_data = targ_P[:,0]
 
@@ -1,7 +1,7 @@
 from hsi_toolkit.util import rx_det
 import numpy as np
 
-def ace_local_detector(hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4, beta = 0):
+def ace_local_detector(hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4, beta = 0, rank_update = False, n_jobs = None):
 	"""
 	Adaptive Cosine/Coherence Estimator with RX style local background estimation
 
@@ -13,6 +13,10 @@ def ace_local_detector(hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4,
 		guard_win - guard window radius (square,symmetric about pixel of interest)
 		bg_win - background window radius
 		beta - scalar value used to diagonal load covariance
+		rank_update - update the local inverse covariance between neighbouring windows with
+		              Sherman-Morrison-Woodbury rank-k updates instead of inverting every window
+		              (needs more background pixels than bands, or beta > 0)
+		n_jobs - (optional) number of processes to run the sliding window in, -1 for one per CPU
 
 	Outputs:
 		out - detector image
@@ -23,32 +27,22 @@ def ace_local_detector(hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4,
 	"""
 	n_row, n_col, n_band = hsi_img.shape
 	mask = np.ones([n_row, n_col]) if mask is None else mask
-	reg = beta * np.eye(n_band)
 
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
 
-	out, kwargsout = rx_det(ace_local_helper, hsi_img, tgt_sig, mask = mask, guard_win = guard_win, bg_win = bg_win, reg = reg)
+	out, kwargsout = rx_det(ace_local_helper, hsi_img, tgt_sig, mask = mask, guard_win = guard_win, bg_win = bg_win, beta = beta, rank_update = rank_update, n_jobs = n_jobs)
 	return out, kwargsout
 
-def ace_local_helper(x, ind, bg, b_mask_list, args, kwargs):
-	if bg is None:
-		sig_inv = args['global_sig_inv']
-		mu = args['mu']
-	else:
-		sig_inv = np.linalg.pinv(np.cov(bg.T, rowvar = False) + kwargs['reg'])
-		mu = np.mean(bg, 1)
-
+def ace_local_helper(x, ind, mu, sig_inv, args, kwargs):
 	z = x - mu
-	s = args['tgt_sig'] - np.tile(mu, (1, args['n_sig'])).T
-
-	sig_out = np.zeros(args['n_sig'])
+	s = args['tgt_sig'] - mu[:, np.newaxis]
 
-	for k in range(args['n_sig']):
-		st_sig_inv = s[:,k].T @ sig_inv
-		st_sig_inv_s = s[:,k].T @ sig_inv @ s[:,k]
-		sig_out[k] = ((st_sig_inv @ z) ** 2) / (st_sig_inv_s * (z.T @ sig_inv @ z))
+	# all signatures at once
+	st_sig_inv = s.T @ sig_inv
+	st_sig_inv_s = np.sum(st_sig_inv * s.T, 1)
+	sig_out = ((st_sig_inv @ z) ** 2) / (st_sig_inv_s * (z.T @ sig_inv @ z))
 
 	sig_index = np.argmax(sig_out, 0)
 
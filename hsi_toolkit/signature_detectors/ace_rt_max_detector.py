@@ -1,7 +1,9 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
+from hsi_toolkit.signature_detectors.library_detector import library_scores
 import numpy as np
 
-def ace_rt_max_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
+def ace_rt_max_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None, bg_model = None, tile_rows = None, cov_method = 'pinv'):
 	"""
 	Adaptive Cosine/Coherence Estimator given Multiple Target Signatures.
 	Confidence value is the max ace score over all target signatures.
@@ -13,6 +15,10 @@ def ace_rt_max_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None
 	        if not present or empty, no mask restrictions are used
 	 mu - background mean (n_band x 1 column vector)
 	 siginv - background inverse covariance (n_band x n_band matrix)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 ace_out - detector image
@@ -26,31 +32,15 @@ def ace_rt_max_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	ace_rt_max_out, kwargsout = img_det(ace_rt_max_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv)
+	ace_rt_max_out, kwargsout = img_det(ace_rt_max_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method, tile_rows = tile_rows)
 	return ace_rt_max_out, kwargsout['mu'], kwargsout['sig_inv']
 
 def ace_rt_max_helper(hsi_data, tgt_sig, kwargs):
-	mu = np.mean(hsi_data, axis = 1) if kwargs['mu'] is None else kwargs['mu']
-	sig_inv = np.linalg.pinv(np.cov(hsi_data.T, rowvar = False)) if kwargs['sig_inv'] is None else kwargs['sig_inv']
+	bg_model = get_bg_model(hsi_data, kwargs)
+	mu = bg_model.mu
+	sig_inv = bg_model.sig_inv
 	mu = mu[:, np.newaxis]
 
-	n_sigs = tgt_sig.shape[1]
-	n_pixel = hsi_data.shape[1]
-
-	S = tgt_sig - mu
-	z = hsi_data - mu
-	det = np.zeros((n_sigs, n_pixel))
-
-	for i in range(n_sigs):
-		s = S[:,i][:,np.newaxis]
-		st_sig_inv = s.T @ sig_inv
-		st_sig_inv_s = s.T @ sig_inv @ s
-
-		A = np.sum(st_sig_inv @ z, 0)
-		B = np.sqrt(st_sig_inv_s)
-		C = np.sqrt(np.sum(z * (sig_inv @ z), 0))
-
-		det[i,:] = A / (B * C)
-
-	ace_rt_data = np.max(det, 0)
+	# every signature in one whitened matrix product
+	ace_rt_data = np.max(library_scores(hsi_data, tgt_sig, 'ace_rt', {'bg_model': bg_model, 'wz': kwargs.get('wz')}), 0)
 	return ace_rt_data, {'mu':mu, 'sig_inv': sig_inv}
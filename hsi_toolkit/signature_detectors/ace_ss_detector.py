@@ -1,7 +1,8 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
 import numpy as np
 
-def ace_ss_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
+def ace_ss_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None, bg_model = None, tile_rows = None, cov_method = 'pinv'):
 	"""
 	Adaptive Cosine/Coherence Estimator - Subspace Formulation
 
@@ -10,6 +11,10 @@ def ace_ss_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
 	 tgt_sigs - target signatures (n_band x M - column vector)
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 ace_ss_out - detector image
@@ -21,13 +26,13 @@ def ace_ss_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	ace_ss_out, kwargsout = img_det(ace_ss_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv)
+	ace_ss_out, kwargsout = img_det(ace_ss_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method, tile_rows = tile_rows)
 	return ace_ss_out
 
 def ace_ss_helper(hsi_data, tgt_sig, kwargs):
-	mu = np.mean(hsi_data, axis = 1) if kwargs['mu'] is None else kwargs['mu']
-	mu = mu[:, np.newaxis]
-	sig_inv = np.linalg.pinv(np.cov(hsi_data.T, rowvar = False)) if kwargs['sig_inv'] is None else kwargs['sig_inv']
+	bg_model = get_bg_model(hsi_data, kwargs)
+	mu = bg_model.mu[:, np.newaxis]
+	sig_inv = bg_model.sig_inv
 	S = tgt_sig - mu
 	z = hsi_data - mu
 
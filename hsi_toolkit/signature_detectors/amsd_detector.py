@@ -1,7 +1,7 @@
 from hsi_toolkit.util import img_det
 import numpy as np
 
-def amsd_detector(hsi_img, tgt_sig, mask = None, n_dim_tgt = 1, n_dim_bg = 5):
+def amsd_detector(hsi_img, tgt_sig, mask = None, n_dim_tgt = 1, n_dim_bg = 5, n_jobs = None, S_bg = None, chunk_size = 16384):
 	"""
 	Adaptive Matched Subspace Detector
 
@@ -19,6 +19,11 @@ def amsd_detector(hsi_img, tgt_sig, mask = None, n_dim_tgt = 1, n_dim_bg = 5):
 	 n_dim_tgt - number of dimensions to use for target subspace,
 	             if argument is 0, use the target sigs themselves
 	 n_dim_bg - number of dimensions to use for background subspace
+	 n_jobs - (optional) number of threads scoring blocks of pixels (-1 for one per CPU),
+	          the subspaces are found once from all the pixels
+	 S_bg - (optional) precomputed background subspace (n_band x n_dim_bg, see amsd_bg_subspace),
+	        skips the correlation matrix and its SVD in repeated runs
+	 chunk_size - number of pixels accumulated / scored at a time (bounds the temporary memory)
 
 	Outputs:
 	 amsd_out - detector image
@@ -30,10 +35,38 @@ def amsd_detector(hsi_img, tgt_sig, mask = None, n_dim_tgt = 1, n_dim_bg = 5):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	amsd_out, kwargsout = img_det(amsd_helper, hsi_img, tgt_sig, mask, n_dim_tgt = n_dim_tgt, n_dim_bg = n_dim_bg)
+	amsd_out, kwargsout = img_det(amsd_helper, hsi_img, tgt_sig, mask, n_jobs = n_jobs, fit_func = amsd_fit, n_dim_tgt = n_dim_tgt, n_dim_bg = n_dim_bg, S_bg = S_bg, chunk_size = chunk_size)
 	return amsd_out
 
-def amsd_helper(hsi_data, tgt_sig, kwargs):
+def amsd_bg_subspace(hsi_img, n_dim_bg = 5, mask = None, chunk_size = 16384):
+	"""
+	AMSD background subspace of an image, to reuse across amsd_detector runs (S_bg argument)
+
+	Inputs:
+	 hsi_image - n_row x n_col x n_band hyperspectral image (array or np.memmap, read a few rows at a time)
+	 n_dim_bg - number of dimensions to use for background subspace
+	 mask - binary image of the background pixels
+	        if not present or empty, all pixels are used
+	 chunk_size - about how many pixels are read at a time
+
+	Outputs:
+	 S_bg - background subspace, leading left singular vectors of the correlation matrix (n_band x n_dim_bg)
+	"""
+	n_row, n_col, n_band = hsi_img.shape
+	mask = np.ones((n_row, n_col), dtype=bool) if mask is None else mask.astype(bool)
+	step = max(1, chunk_size // n_col)
+
+	corr_bg = np.zeros((n_band, n_band))
+	n_pixel = 0
+	for r0 in range(0, n_row, step):
+		x = np.asarray(hsi_img[r0:r0 + step,:,:], dtype=np.float64)[mask[r0:r0 + step,:]]
+		corr_bg += x.T @ x
+		n_pixel += x.shape[0]
+
+	U_bg,_,_ = np.linalg.svd(corr_bg / n_pixel)
+	return U_bg[:,:n_dim_bg]
+
+def amsd_fit(hsi_data, tgt_sig, kwargs):
 	n_dim_tgt = kwargs['n_dim_tgt']
 	n_dim_bg = kwargs['n_dim_bg']
 
@@ -41,20 +74,21 @@ def amsd_helper(hsi_data, tgt_sig, kwargs):
 	n_sigs = tgt_sig.shape[1]
 
 	# find target and background subspace
-	corr_bg = np.zeros((n_band, n_band))
-	for i in range(n_pixel):
-		corr_bg = corr_bg + hsi_data[:,i][:,np.newaxis] @ hsi_data[:,i][np.newaxis,:]
+	S_bg = kwargs.get('S_bg')
+	if S_bg is None:
+		chunk_size = kwargs.get('chunk_size') or n_pixel
+		corr_bg = np.zeros((n_band, n_band))
+		for c in range(0, n_pixel, chunk_size):
+			x = hsi_data[:, c:c + chunk_size]
+			corr_bg += x @ x.T
 
-	corr_bg = corr_bg / n_pixel
-	U_bg,_,_ = np.linalg.svd(corr_bg)
+		corr_bg = corr_bg / n_pixel
+		U_bg,_,_ = np.linalg.svd(corr_bg)
 
-	S_bg = U_bg[:,:n_dim_bg]
+		S_bg = U_bg[:,:n_dim_bg]
 
 	if n_dim_tgt > 0:
-		corr_tgt = np.zeros((n_band, n_band))
-		for i in range(n_sigs):
-			corr_tgt = corr_tgt + tgt_sig[:,i][:,np.newaxis] @ tgt_sig[:,i][np.newaxis,:]
-		corr_tgt = corr_tgt / n_sigs
+		corr_tgt = tgt_sig @ tgt_sig.T / n_sigs
 		U_t,_,_ = np.linalg.svd(corr_tgt)
 
 		S_t = U_t[:,:n_dim_tgt]
@@ -73,10 +107,24 @@ def amsd_helper(hsi_data, tgt_sig, kwargs):
 	P_perp_b = np.eye(n_band) - P_b
 
 	PZ = P_perp_b - P_perp_S
+	return dict(kwargs, PZ = PZ, P_perp_S = P_perp_S)
+
+def amsd_helper(hsi_data, tgt_sig, kwargs):
+	# find the projections unless already found from the whole image
+	if kwargs.get('PZ') is None:
+		kwargs = amsd_fit(hsi_data, tgt_sig, kwargs)
+
+	PZ = kwargs['PZ']
+	P_perp_S = kwargs['P_perp_S']
+	n_pixel = hsi_data.shape[1]
+	chunk_size = kwargs.get('chunk_size') or n_pixel
+
 	amsd_data = np.zeros(n_pixel)
 
-	for i in range(n_pixel):
-		x = hsi_data[:,i][:,np.newaxis]
-		amsd_data[i] = (x.T @ PZ @ x) / (x.T @ P_perp_S @ x)
+	# PZ and P_perp_S are orthogonal projectors, x.T @ P @ x = ||P @ x||^2 without the cancellation
+	# of the quadratic form for pixels close to the target + background subspace
+	for c in range(0, n_pixel, chunk_size):
+		x = hsi_data[:, c:c + chunk_size]
+		amsd_data[c:c + chunk_size] = np.sum((PZ @ x) ** 2, 0) / np.sum((P_perp_S @ x) ** 2, 0)
 
 	return amsd_data, {}
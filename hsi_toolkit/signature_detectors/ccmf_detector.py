@@ -1,8 +1,8 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_gmm, matched_filters, cluster_scores
 import numpy as np
-from sklearn.mixture import GaussianMixture
 
-def ccmf_detector(hsi_img, tgt_sig, mask = None, n_comp = 5, gmm = None):
+def ccmf_detector(hsi_img, tgt_sig, mask = None, n_comp = 5, gmm = None, n_jobs = None):
 	"""
 	Class Conditional Matched Filters
 
@@ -12,11 +12,15 @@ def ccmf_detector(hsi_img, tgt_sig, mask = None, n_comp = 5, gmm = None):
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
 	 n_comp - number of Gaussian components to use
-	 gmm - optional mixture model structure from previous training data
+	 gmm - optional mixture model from previous training data (util.MixtureModel, e.g. MixtureModel.load,
+       or a fitted sklearn GaussianMixture)
+	 n_jobs - (optional) number of threads scoring blocks of pixels (-1 for one per CPU),
+	          the mixture model is fit once on all the pixels
 
 	outputs:
 	 ccmf_out - detector image
-	 gmm - mixture model learned from input image
+	 gmm - mixture model learned from input image, the sklearn GaussianMixture fitted here (or given),
+	       or the util.MixtureModel given
 
 	8/8/2012 - Taylor C. Glenn
 	6/2/2018 - Edited by Alina Zare
@@ -25,36 +29,22 @@ def ccmf_detector(hsi_img, tgt_sig, mask = None, n_comp = 5, gmm = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	ccmf_out, kwargsout = img_det(ccmf_helper, hsi_img, tgt_sig, mask, n_comp = n_comp, gmm = gmm)
+	ccmf_out, kwargsout = img_det(ccmf_helper, hsi_img, tgt_sig, mask, n_jobs = n_jobs, fit_func = ccmf_fit, n_comp = n_comp, gmm = gmm)
 
-	return ccmf_out, kwargsout['gmm']
+	gmm = kwargsout['gmm']
+	return ccmf_out, gmm if gmm.sklearn_gmm is None else gmm.sklearn_gmm
 
-def ccmf_helper(hsi_data, tgt_sig, kwargs):
-	n_comp = kwargs['n_comp']
-	gmm = kwargs['gmm']
-
-	if gmm is None:
-		gmm = GaussianMixture(n_components = n_comp, max_iter = 1, init_params = 'random').fit(hsi_data.T)
+def ccmf_fit(hsi_data, tgt_sig, kwargs):
+	return dict(kwargs, gmm = get_gmm(hsi_data, kwargs))
 
-	n_pixel = hsi_data.shape[1]
+def ccmf_helper(hsi_data, tgt_sig, kwargs):
+	gmm = get_gmm(hsi_data, kwargs)
 
 	# make a matched filter for each background class
-	means = gmm.means_
-	covariances = gmm.covariances_
-	sig_inv = np.zeros(covariances.shape)
-	filt = np.zeros(means.shape)
-
-	for i in range(n_comp):
-		sig_inv[i,:,:] = np.linalg.pinv(covariances[i,:,:])
-
-		s = tgt_sig - means[i,:][:,np.newaxis]
-		filt[i,:] = s.T @ sig_inv[i,:,:] / np.sqrt(s.T @ sig_inv[i,:,:] @ s)
+	filt = matched_filters(tgt_sig, gmm.means, gmm.sig_inv)
 
 	# run the appropriate filter for class of each pixels
-	idx = gmm.predict(hsi_data.T)
-
-	ccmf_data = np.zeros(n_pixel)
-	for i in range(n_pixel):
-		ccmf_data[i] = filt[idx[i],:] @ (hsi_data[:,i] - means[idx[i],:])
+	idx = gmm.predict(hsi_data)
+	ccmf_data = cluster_scores(hsi_data, idx, gmm.means, filt = filt)
 
 	return ccmf_data, {'gmm': gmm}
@@ -1,7 +1,8 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
 import numpy as np
 
-def cem_detector(hsi_img, tgt_sig, mask = None):
+def cem_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None, bg_model = None, tile_rows = None, cov_method = 'pinv'):
 	"""
 	Constrained Energy Minimization Detector
 	 solution to filter with minimum energy projected into background space
@@ -13,6 +14,12 @@ def cem_detector(hsi_img, tgt_sig, mask = None):
 	 tgt_sigs - target signatures (n_band x n_sigs)
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
+	 mu - (optional) background mean (n_band x 1 column vector)
+	 sig_inv - (optional) background inverse covariance (n_band x n_band matrix)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 cem_out - detector image
@@ -25,21 +32,21 @@ def cem_detector(hsi_img, tgt_sig, mask = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	cem_out, kwargsout = img_det(cem_helper, hsi_img, tgt_sig, mask)
+	cem_out, kwargsout = img_det(cem_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method, tile_rows = tile_rows)
 
 	return cem_out, kwargsout['w']
 
-def cem_helper(hsi_data, tgt_sig, kwarg):
+def cem_helper(hsi_data, tgt_sig, kwargs):
 	n_pixel = hsi_data.shape[1]
 	n_sigs = tgt_sig.shape[1]
 
-	R = np.cov(hsi_data.T, rowvar=False)
-	mu = np.mean(hsi_data,1)
-	mu = mu[:,np.newaxis]
+	bg_model = get_bg_model(hsi_data, kwargs)
+	mu = bg_model.mu
+	mu = np.reshape(mu, (-1, 1))
+	R_inv = bg_model.sig_inv
 
 	z = hsi_data - mu
 	M = tgt_sig - mu
-	R_inv = np.linalg.pinv(R)
 
 	w = R_inv @ M @ np.linalg.pinv(M.T @ R_inv @ M) * np.ones((n_sigs,1))
 
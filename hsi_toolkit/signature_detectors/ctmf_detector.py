@@ -1,7 +1,9 @@
+from hsi_toolkit.util import img_det
+from hsi_toolkit.util import cluster_stats, cluster_scores, matched_filters, stream_cluster_stats
 import numpy as np
 from sklearn.cluster import KMeans
 
-def ctmf_detector(hsi_img, tgt_sig, n_cluster = 2):
+def ctmf_detector(hsi_img, tgt_sig, n_cluster = 2, tile_rows = None, out = None):
 	"""
 	Cluster Tuned Matched Filter
 	 k-means cluster all spectra, make a matched filter for each cluster
@@ -10,6 +12,11 @@ def ctmf_detector(hsi_img, tgt_sig, n_cluster = 2):
 	 hsi_image - n_row x n_col x n_band hyperspectral image
 	 tgt_sig - target signature (n_band x 1 - column vector)
 	 n_cluster - number of clusters to use
+	 tile_rows - (optional) streaming mode for images that do not fit in memory (e.g. a np.memmap),
+	             the image is read tile_rows image rows at a time: mini-batch k-means centroids and
+	             cluster statistics come from streaming passes over the tiles, then the tiles are scored
+	             (see util.stream_cluster_stats)
+	 out - (optional) preallocated n_row x n_col output, e.g. a np.memmap, for the detector image
 
 	Outputs:
 	 ctmf_out - detector output image
@@ -22,35 +29,28 @@ def ctmf_detector(hsi_img, tgt_sig, n_cluster = 2):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	n_row, n_col, n_band = hsi_img.shape
-	n_pixel = n_row * n_col
+	clusters = None
+	if tile_rows is not None:
+		clusters = stream_cluster_stats(hsi_img, n_cluster, tile_rows)
 
-	hsi_data = hsi_img.reshape((n_pixel,n_band), order='F').T
+	ctmf_out, kwargsout = img_det(ctmf_helper, hsi_img, tgt_sig, None, tile_rows, out, pixel_out = ['idx'], n_cluster = n_cluster, clusters = clusters)
+	return ctmf_out, kwargsout['idx']
 
-	# cluster the data
-	idx = KMeans(n_clusters = n_cluster, n_init = 1, max_iter=100).fit(hsi_data.T).labels_
+def ctmf_helper(hsi_data, tgt_sig, kwargs):
+	n_cluster = kwargs['n_cluster']
 
-	cluster_img = idx.reshape((n_row, n_col), order = 'F')
+	# cluster the data, unless clustered by streaming passes over the image
+	if kwargs.get('clusters') is None:
+		idx = KMeans(n_clusters = n_cluster, n_init = 1, max_iter=100).fit(hsi_data.T).labels_
 
-	# get cluster stats, create match filters
-	mu = np.zeros((n_band,n_cluster))
-	sig_inv = np.zeros((n_band, n_band, n_cluster))
-	f = np.zeros((n_band,n_cluster))
+		# get cluster stats
+		mu, sig_inv = cluster_stats(hsi_data, idx, n_cluster)
+	else:
+		kmeans, mu, sig_inv = kwargs['clusters']
+		idx = kmeans.predict(hsi_data.T)
 
-	for i in range(n_cluster):
-		z = hsi_data[:, idx == i]
+	# create match filters, compute matched filter output of each point
+	f = matched_filters(tgt_sig, mu, sig_inv)
+	ctmf_data = cluster_scores(hsi_data, idx, mu, filt = f)
 
-		mu[:,i] = np.mean(z,1)
-		sig_inv[:,:,i] = np.linalg.pinv(np.cov(z.T, rowvar=False))
-
-		s = tgt_sig - mu[:,i][:,np.newaxis]
-		f[:,i] = s.T @ sig_inv[:,:,i] / np.sqrt(s.T @ sig_inv[:,:,i] @ s)
-
-	# compute matched filter output of each point
-	ctmf_data = np.zeros(n_pixel)
-
-	for i in range(n_pixel):
-		z = hsi_data[:,i] - mu[:,idx[i]]
-		ctmf_data[i] = f[:,idx[i]] @ z
-
-	return ctmf_data.reshape([n_row, n_col], order='F'), cluster_img
+	return ctmf_data, {'idx': idx}
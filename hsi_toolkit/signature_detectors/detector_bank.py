@@ -0,0 +1,147 @@
+from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
+from hsi_toolkit.util import cached_unmix
+from hsi_toolkit.signature_detectors.abd_detector import abd_helper
+from hsi_toolkit.signature_detectors.ace_detector import ace_det_helper
+from hsi_toolkit.signature_detectors.ace_rt_detector import ace_rt_helper
+from hsi_toolkit.signature_detectors.ace_rt_max_detector import ace_rt_max_helper
+from hsi_toolkit.signature_detectors.ace_ss_detector import ace_ss_helper
+from hsi_toolkit.signature_detectors.cem_detector import cem_helper
+from hsi_toolkit.signature_detectors.ha_detector import ha_helper, ha_fit
+from hsi_toolkit.signature_detectors.hsd_detector import hsd_helper
+from hsi_toolkit.signature_detectors.hua_detector import hua_helper, hua_fit
+from hsi_toolkit.signature_detectors.library_detector import library_helper
+from hsi_toolkit.signature_detectors.osp_detector import osp_helper
+from hsi_toolkit.signature_detectors.sam_detector import sam_helper
+from hsi_toolkit.signature_detectors.smf_detector import smf_det_array_helper
+import numpy as np
+
+class DetectorBank:
+	"""
+	Bank of global signature detectors run in one pass over the data
+	 the image is flattened and masked once, and the intermediates the detectors
+	 share are computed once per pass: background mean, covariance, inverse covariance,
+	 PCA basis and whitening (one BackgroundModel), the whitened mean-centered data and the
+	 unmixing abundances for each set of background endmembers
+
+	Inputs:
+	 specs - list of detector specs, (name, detector) or (name, detector, kwargs)
+	         name - key of the detector image in the output
+	         detector - one of DetectorBank.detectors:
+	                    abd, ace, ace_rt, ace_rt_max, ace_ss, cem, ha, hsd, hua, library, osp, sam, smf, smf_max
+	         kwargs - (optional) detector arguments, e.g. {'ems': ems} for abd / ha / hsd / hua,
+	                  {'n_dim_ss': 10} for osp, {'n_comp': 2} for ha / hua, {'method': 'ace'} for library
+
+	Example:
+	 bank = DetectorBank([('SMF', 'smf'), ('ACE', 'ace'), ('HSD', 'hsd', {'ems': ems}), ('OSP', 'osp', {'n_dim_ss': 10})])
+	 det_out = bank.run(hsi_img, tgt_sig)
+	"""
+	# array based detector and its default arguments
+	detectors = {
+		'abd': (abd_helper, {}),
+		'ace': (ace_det_helper, {}),
+		'ace_rt': (ace_rt_helper, {}),
+		'ace_rt_max': (ace_rt_max_helper, {}),
+		'ace_ss': (ace_ss_helper, {}),
+		'cem': (cem_helper, {}),
+		'ha': (ha_helper, {'n_comp': 2}),
+		'hsd': (hsd_helper, {}),
+		'hua': (hua_helper, {'n_comp': 2}),
+		'library': (library_helper, {'method': 'ace_rt'}),
+		'osp': (osp_helper, {'n_dim_ss': 2}),
+		'sam': (sam_helper, {}),
+		'smf': (smf_det_array_helper, {}),
+		'smf_max': (library_helper, {'method': 'smf'}),
+	}
+
+	# global fit of the detectors with a model of their own (fit once in tiled mode, shared by every tile)
+	fits = {
+		'ha': ha_fit,
+		'hua': hua_fit,
+	}
+
+	def __init__(self, specs):
+		self.specs = []
+		for spec in specs:
+			name, detector = spec[0], spec[1]
+			if detector not in self.detectors:
+				raise ValueError('unknown detector ' + str(detector))
+
+			kwargs = dict(self.detectors[detector][1])
+			if len(spec) > 2:
+				kwargs.update(spec[2])
+			self.specs.append((name, detector, kwargs))
+
+	def run(self, hsi_img, tgt_sig, mask = None, bg_model = None, tile_rows = None, cov_method = 'pinv'):
+		"""
+		Run every detector of the bank
+
+		Inputs:
+		 hsi_image - n_row x n_col x n_band hyperspectral image
+		 tgt_sig - target signature (n_band x 1 - column vector), or signatures (n_band x n_sig)
+		 mask - binary image limiting detector operation to pixels where mask is true
+		        if not present or empty, no mask restrictions are used
+		 bg_model - (optional) BackgroundModel with precomputed background statistics
+		 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+		 cov_method - inversion method of the background covariance when it is computed here,
+		              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
+
+		Outputs:
+		 det_out - dictionary of detector images, keyed by the spec names
+		"""
+		if tgt_sig.ndim == 1:
+			tgt_sig = tgt_sig[:, np.newaxis]
+		if len(self.specs) == 0:
+			return {}
+
+		# in tiled mode the ha / hua abundance mixtures are fit once on a strided subset of the rows
+		fit_func = self.bank_fit if tile_rows is not None else None
+
+		# the first detector image comes back as the img_det output, the others in kwargsout
+		first_out, kwargsout = img_det(self.bank_helper, hsi_img, tgt_sig, mask, tile_rows = tile_rows, fit_func = fit_func, pixel_out = [name for name, _, _ in self.specs[1:]], bg_model = bg_model, cov_method = cov_method)
+		kwargsout[self.specs[0][0]] = first_out
+		return {name: kwargsout[name] for name, _, _ in self.specs}
+
+	def bank_fit(self, hsi_data, tgt_sig, kwargs):
+		bg_model = get_bg_model(hsi_data, kwargs)
+
+		fitted = {}
+		for name, detector, det_kwargs in self.specs:
+			if detector in self.fits:
+				fitted[name] = self.fits[detector](hsi_data, tgt_sig, dict({'bg_model': bg_model}, **det_kwargs))
+
+		return dict(kwargs, fitted = fitted)
+
+	def bank_helper(self, hsi_data, tgt_sig, kwargs):
+		bg_model = get_bg_model(hsi_data, kwargs)
+		shared = {'bg_model': bg_model}
+
+		# whitened mean-centered data, for the detectors scoring in whitened space
+		if any(detector in ('ace_rt_max', 'library', 'smf_max') for _, detector, _ in self.specs):
+			shared['wz'] = bg_model.whiten(hsi_data - bg_model.mu[:, np.newaxis])
+
+		# abundances per set of background endmembers
+		abundances = {}
+		def unmixed(ems, with_tgt):
+			key = (id(ems), with_tgt)
+			if key not in abundances:
+				abundances[key] = cached_unmix(hsi_data, np.hstack((tgt_sig, ems)) if with_tgt else ems)
+			return abundances[key]
+
+		det_out = {}
+		for name, detector, det_kwargs in self.specs:
+			helper = self.detectors[detector][0]
+			helper_kwargs = dict(shared, **det_kwargs)
+			if name in kwargs.get('fitted', {}):
+				helper_kwargs.update({key: val for key, val in kwargs['fitted'][name].items() if key in ('gmm_bg', 'hud_rg', 'bg_rg')})
+			if any(key in det_kwargs for key in ('bg_model', 'mu', 'sig_inv')):
+				helper_kwargs.pop('wz', None)
+
+			if 'ems' in det_kwargs:
+				helper_kwargs['targ_P'] = unmixed(det_kwargs['ems'], True)
+				if detector != 'abd':
+					helper_kwargs['P'] = unmixed(det_kwargs['ems'], False)
+
+			det_out[name] = helper(hsi_data, tgt_sig, helper_kwargs)[0]
+
+		return det_out.pop(self.specs[0][0]), det_out
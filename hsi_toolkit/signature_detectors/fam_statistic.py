@@ -1,5 +1,6 @@
 import numpy as np
-def fam_statistic(hsi_img, tgt_sig, mu = None, sig_inv = None):
+from hsi_toolkit.util import get_bg_model
+def fam_statistic(hsi_img, tgt_sig, mu = None, sig_inv = None, bg_model = None, chunk_size = 16384, cov_method = 'pinv'):
 	"""
 	False Alarm Mitigation Statistic from Subpixel Replacement Model
 
@@ -8,6 +9,10 @@ def fam_statistic(hsi_img, tgt_sig, mu = None, sig_inv = None):
 	 tgt_sig - target signature (n_band x 1 - column vector)
 	 mu - background mean (n_band x 1 column vector)
 	 siginv - background inverse covariance (n_band x n_band matrix)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 chunk_size - number of pixels scored at a time (bounds the temporary memory)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 fam_out - false alarm mitigation statistic
@@ -24,23 +29,22 @@ def fam_statistic(hsi_img, tgt_sig, mu = None, sig_inv = None):
 	n_pixel = n_row * n_col
 
 	hsi_data = hsi_img.reshape((n_pixel, n_band), order='F').T
-	if mu is None:
-		mu = np.mean(hsi_data, axis = 1)
-	if sig_inv is None:
-		sig_inv = np.linalg.pinv(np.cov(hsi_data.T, rowvar = False))
+	bg_model = get_bg_model(hsi_data, {'bg_model': bg_model, 'mu': mu, 'sig_inv': sig_inv, 'cov_method': cov_method})
+	mu = bg_model.mu[:, np.newaxis]
+	sig_inv = bg_model.sig_inv
 
-	mu = mu[:, np.newaxis]
 	s = tgt_sig
 	sts = s.T @ s
 	s_mu = s - mu
 
-	z = hsi_data - mu
 	fam_data = np.zeros(n_pixel)
 
-	for i in range(n_pixel):
-		alpha = s.T @ hsi_data[:,i] / sts
-		w = z[:,i][:, np.newaxis] - alpha * s_mu
-		fam_data[i] = w.T @ sig_inv @ w
+	# a chunk of pixels at a time
+	for c in range(0, n_pixel, chunk_size):
+		x = hsi_data[:, c:c + chunk_size]
+		alpha = s.T @ x / sts
+		w = x - mu - s_mu @ alpha
+		fam_data[c:c + chunk_size] = np.sum(w * (sig_inv @ w), 0)
 
 	fam_out = fam_data.reshape((n_row, n_col), order = 'F')
 	return fam_out
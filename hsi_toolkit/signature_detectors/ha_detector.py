@@ -1,5 +1,5 @@
 from hsi_toolkit.util import img_det
-from hsi_toolkit.util import unmix
+from hsi_toolkit.util import cached_unmix
 import numpy as np
 from sklearn.mixture import GaussianMixture
 
@@ -28,19 +28,27 @@ def ha_detector(hsi_img, tgt_sig, ems, mask = None, n_comp = 2):
 	ha_out, kwargsout = img_det(ha_helper, hsi_img, tgt_sig, mask, ems = ems, n_comp = n_comp)
 	return ha_out
 
+def ha_fit(hsi_data, tgt_sig, kwargs):
+	# abundance mixture fit once (e.g. on a subsample), shared by every block / tile
+	_, fit = ha_helper(hsi_data, tgt_sig, kwargs)
+	return dict(kwargs, **fit)
+
 def ha_helper(hsi_data, tgt_sig, kwargs):
 	ems = kwargs['ems']
 	n_comp = kwargs['n_comp']
 
 	n_pixel = hsi_data.shape[1]
 
-	# unmix data with only background endmembers
-	P = unmix(hsi_data, ems)
+	# unmix data with only background endmembers (unless given precomputed)
+	P = cached_unmix(hsi_data, ems) if kwargs.get('P') is None else kwargs['P']
 
 	# unmix data with target signature as well
-	targ_P = unmix(hsi_data, np.hstack((tgt_sig, ems)))
+	targ_P = cached_unmix(hsi_data, np.hstack((tgt_sig, ems))) if kwargs.get('targ_P') is None else kwargs['targ_P']
 
-	gmm_bg = GaussianMixture(n_components = n_comp, max_iter = 1, init_params = 'random').fit(P)
+	# background abundance mixture (unless given already fit, see ha_fit)
+	gmm_bg = kwargs.get('gmm_bg')
+	if gmm_bg is None:
+		gmm_bg = GaussianMixture(n_components = n_comp, max_iter = 1, init_params = 'random').fit(P)
 
 	# compute mixture likelihood ratio of each pixel
 	n_endmeber = ems.shape[1]
@@ -56,4 +64,4 @@ def ha_helper(hsi_data, tgt_sig, kwargs):
 		hs_data[i] = z[np.newaxis,:] @ z[:,np.newaxis] / (w[np.newaxis,:] @ w[:,np.newaxis])
 
 	ha_data = hs_data + ll_tgt - ll_bg
-	return ha_data, {}
+	return ha_data, {'gmm_bg': gmm_bg}
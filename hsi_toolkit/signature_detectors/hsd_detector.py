@@ -1,8 +1,9 @@
 from hsi_toolkit.util import img_det
-from hsi_toolkit.util import unmix
+from hsi_toolkit.util import get_bg_model
+from hsi_toolkit.util import cached_unmix
 import numpy as np
 
-def hsd_detector(hsi_img, tgt_sig, ems, mask = None, sig_inv = None):
+def hsd_detector(hsi_img, tgt_sig, ems, mask = None, sig_inv = None, bg_model = None, tile_rows = None, n_jobs = None, cov_method = 'pinv'):
 	"""
 	Hybrid Structured Detector
 
@@ -19,10 +20,16 @@ def hsd_detector(hsi_img, tgt_sig, ems, mask = None, sig_inv = None):
 	        if not present or empty, no mask restrictions are used
 	 ems - background endmembers
 	 siginv - background inverse covariance (n_band x n_band matrix)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 n_jobs - (optional) number of threads scoring blocks of pixels (-1 for one per CPU),
+	          the background statistics are computed once from all the pixels
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 hsd_out - detector image
-	 tgt_p - target proportion in unmixing
+	 tgt_p - target proportion in unmixing (n_row x n_col x n_tgt for several target signatures)
 
 	8/19/2012 - Taylor C. Glenn
 	6/2/2018 - Edited by Alina Zare
@@ -31,27 +38,30 @@ def hsd_detector(hsi_img, tgt_sig, ems, mask = None, sig_inv = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	hsd_out, kwargsout = img_det(hsd_helper, hsi_img, tgt_sig, mask, ems = ems, sig_inv = sig_inv)
+	hsd_out, kwargsout = img_det(hsd_helper, hsi_img, tgt_sig, mask, tile_rows = tile_rows, n_jobs = n_jobs, fit_func = hsd_fit, pixel_out = ['tgt_p'], ems = ems, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method)
 	return hsd_out, kwargsout['tgt_p']
 
+def hsd_fit(hsi_data, tgt_sig, kwargs):
+	# inverse covariance computed once here, not in every block
+	bg_model = get_bg_model(hsi_data, kwargs)
+	return dict(kwargs, bg_model = bg_model, sig_inv = bg_model.sig_inv)
+
 def hsd_helper(hsi_data, tgt_sig, kwargs):
 	ems = kwargs['ems']
-	sig_inv = np.linalg.pinv(np.cov(hsi_data.T, rowvar = False)) if kwargs['sig_inv'] is None else kwargs['sig_inv']
-
-	n_pixel = hsi_data.shape[1]
+	bg_model = get_bg_model(hsi_data, kwargs)
+	sig_inv = bg_model.sig_inv
 
-	# unmix data with only background endmembers
-	P = unmix(hsi_data, ems)
+	# unmix data with only background endmembers (unless given precomputed)
+	P = cached_unmix(hsi_data, ems) if kwargs.get('P') is None else kwargs['P']
 
 	# unmix data with target signature as well
-	targ_P = unmix(hsi_data, np.hstack((tgt_sig, ems)))
-
-	hsd_data = np.zeros(n_pixel)
+	targ_P = cached_unmix(hsi_data, np.hstack((tgt_sig, ems))) if kwargs.get('targ_P') is None else kwargs['targ_P']
 
-	for i in range(n_pixel):
-		z = hsi_data[:,i] - ems @ P[i,:].T
-		w = hsi_data[:,i] - np.hstack((tgt_sig, ems)) @ targ_P[i,:].T
-		hsd_data[i] = z[np.newaxis,:] @ sig_inv @ z[:,np.newaxis] / (w[np.newaxis,:] @ sig_inv @ w[:,np.newaxis])
+	# residuals of both unmixings, Mahalanobis ratio for all pixels at once
+	z = hsi_data - ems @ P.T
+	w = hsi_data - np.hstack((tgt_sig, ems)) @ targ_P.T
+	hsd_data = np.sum(z * (sig_inv @ z), 0) / np.sum(w * (sig_inv @ w), 0)
 
-	tgt_p = targ_P[:,:tgt_sig.shape[1]]
-	return hsd_data, {'tgt_p': tgt_p.squeeze()}
+	# n (one target) or n_tgt x n target proportions
+	tgt_p = targ_P[:,:tgt_sig.shape[1]].T
+	return hsd_data, {'tgt_p': tgt_p[0] if tgt_p.shape[0] == 1 else tgt_p}
@@ -1,8 +1,8 @@
 from hsi_toolkit.util import rx_det
-from hsi_toolkit.util import unmix
+from hsi_toolkit.util import cached_unmix
 import numpy as np
 
-def hsd_local_detector(hsi_img, tgt_sig, ems, mask = None, guard_win = 2, bg_win = 4, beta = 0):
+def hsd_local_detector(hsi_img, tgt_sig, ems, mask = None, guard_win = 2, bg_win = 4, beta = 0, n_jobs = None):
 	"""
 	Hybrid Subpixel Detector with RX style local background estimation
 
@@ -14,6 +14,7 @@ def hsd_local_detector(hsi_img, tgt_sig, ems, mask = None, guard_win = 2, bg_win
 	 guard_win - guard window radius (square,symmetric about pixel of interest)
 	 bg_win - background window radius
 	 beta - scalar value used to diagonal load covariance
+	 n_jobs - (optional) number of processes to run the sliding window in, -1 for one per CPU
 
 	Outputs:
 	 out - detector image
@@ -28,24 +29,16 @@ def hsd_local_detector(hsi_img, tgt_sig, ems, mask = None, guard_win = 2, bg_win
 	n_row, n_col, n_band = hsi_img.shape
 	hsi_data = hsi_img.reshape((n_row * n_col, n_band), order='F').T
 
-	reg = beta * np.eye(n_band)
-
 	# unmix data with only background endmembers
-	P = unmix(hsi_data, ems)
+	P = cached_unmix(hsi_data, ems)
 
 	# unmix data with target signature as well
-	targ_P = unmix(hsi_data, np.hstack((tgt_sig, ems)))
+	targ_P = cached_unmix(hsi_data, np.hstack((tgt_sig, ems)))
 
-	out, kwargsout = rx_det(hsd_local_helper, hsi_img, tgt_sig, mask, guard_win, bg_win, ems = ems, reg = reg, P = P, targ_P = targ_P)
+	out, kwargsout = rx_det(hsd_local_helper, hsi_img, tgt_sig, mask, guard_win, bg_win, beta, n_jobs = n_jobs, ems = ems, P = P, targ_P = targ_P)
 	return out
 
-def hsd_local_helper(x, ind, bg, b_mask_list, args, kwargs):
-	if bg is not None:
-		sigma = np.cov(bg.T, rowvar=False)
-		sig_inv = np.linalg.pinv(sigma + kwargs['reg'])
-	else:
-		sig_inv = args['global_siginv']
-
+def hsd_local_helper(x, ind, mu, sig_inv, args, kwargs):
 	z = x - kwargs['ems'] @ kwargs['P'][ind,:]
 	w = x - np.hstack((args['tgt_sig'], kwargs['ems'])) @ kwargs['targ_P'][ind,:]
 	r = (z[np.newaxis,:] @ sig_inv @ z[:,np.newaxis]) / (w[np.newaxis,:] @ sig_inv @ w[:,np.newaxis])
@@ -1,9 +1,10 @@
 from hsi_toolkit.util import img_det
-from hsi_toolkit.util import unmix
+from hsi_toolkit.util import get_bg_model
+from hsi_toolkit.util import cached_unmix
 import numpy as np
 from sklearn.mixture import GaussianMixture
 
-def hua_detector(hsi_img, tgt_sig, ems, mask = None, n_comp = 2, sig_inv = None):
+def hua_detector(hsi_img, tgt_sig, ems, mask = None, n_comp = 2, sig_inv = None, bg_model = None, cov_method = 'pinv'):
 	"""
 	Hybrid Unstructured Abundance Detector
 
@@ -20,6 +21,9 @@ def hua_detector(hsi_img, tgt_sig, ems, mask = None, n_comp = 2, sig_inv = None)
 	        if not present or empty, no mask restrictions are used
 	 ems - background endmembers
 	 siginv - background inverse covariance (n_band x n_band matrix)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 hua_out - detector image
@@ -31,23 +35,32 @@ def hua_detector(hsi_img, tgt_sig, ems, mask = None, n_comp = 2, sig_inv = None)
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	hua_out, kwargsout = img_det(hua_helper, hsi_img, tgt_sig, mask, ems = ems, n_comp = n_comp, sig_inv = sig_inv)
+	hua_out, kwargsout = img_det(hua_helper, hsi_img, tgt_sig, mask, ems = ems, n_comp = n_comp, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method)
 	return hua_out
 
+def hua_fit(hsi_data, tgt_sig, kwargs):
+	# abundance mixture and score ranges fit once (e.g. on a subsample), so every block / tile is scaled the same
+	_, fit = hua_helper(hsi_data, tgt_sig, kwargs)
+	return dict(kwargs, **fit)
+
 def hua_helper(hsi_data, tgt_sig, kwargs):
 	ems = kwargs['ems']
 	n_comp = kwargs['n_comp']
-	sig_inv = np.linalg.pinv(np.cov(hsi_data.T, rowvar = False)) if kwargs['sig_inv'] is None else kwargs['sig_inv']
+	bg_model = get_bg_model(hsi_data, kwargs)
+	sig_inv = bg_model.sig_inv
 
 	n_pixel = hsi_data.shape[1]
 
-	# unmix data with only background endmembers
-	P = unmix(hsi_data, ems)
+	# unmix data with only background endmembers (unless given precomputed)
+	P = cached_unmix(hsi_data, ems) if kwargs.get('P') is None else kwargs['P']
 
 	# unmix data with target signature as well
-	targ_P = unmix(hsi_data, np.hstack((tgt_sig, ems)))
+	targ_P = cached_unmix(hsi_data, np.hstack((tgt_sig, ems))) if kwargs.get('targ_P') is None else kwargs['targ_P']
 
-	gmm_bg = GaussianMixture(n_components = n_comp, max_iter = 1, init_params = 'random').fit(P)
+	# background abundance mixture (unless given already fit, see hua_fit)
+	gmm_bg = kwargs.get('gmm_bg')
+	if gmm_bg is None:
+		gmm_bg = GaussianMixture(n_components = n_comp, max_iter = 1, init_params = 'random').fit(P)
 
 	# compute mixture likelihood ratio of each pixel
 	n_endmeber = ems.shape[1]
@@ -61,8 +74,9 @@ def hua_helper(hsi_data, tgt_sig, kwargs):
 		x = hsi_data[:,i]
 		hua_data[i] = x[np.newaxis,:] @ sig_inv @ s / (x[np.newaxis,:] @ sig_inv @ x[:,np.newaxis])
 
-	hud_rg = np.max(hua_data) - np.min(hua_data)
-	bg_rg = np.max(ll_bg) - np.min(ll_bg)
+	# score ranges of the data (unless given, see hua_fit)
+	hud_rg = np.max(hua_data) - np.min(hua_data) if kwargs.get('hud_rg') is None else kwargs['hud_rg']
+	bg_rg = np.max(ll_bg) - np.min(ll_bg) if kwargs.get('bg_rg') is None else kwargs['bg_rg']
 	hua_data = hua_data + ll_tgt * (hud_rg/3) -  ll_bg * (hud_rg/(3*bg_rg))
 
-	return hua_data, {}
+	return hua_data, {'gmm_bg': gmm_bg, 'hud_rg': hud_rg, 'bg_rg': bg_rg}
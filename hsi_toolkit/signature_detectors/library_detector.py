@@ -0,0 +1,88 @@
+from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
+import numpy as np
+
+def library_detector(hsi_img, tgt_lib, mask = None, method = 'ace_rt', mu = None, sig_inv = None, bg_model = None, tile_rows = None, cov_method = 'pinv'):
+	"""
+	Signature detection against a library of target signatures
+	 all signatures are scored in one pass: the data and the library are whitened
+	 once and every pixel/signature pair comes from a single matrix product
+
+	Inputs:
+	 hsi_image - n_row x n_col x n_band hyperspectral image
+	 tgt_lib - target signatures (n_band x n_sig)
+	 mask - binary image limiting detector operation to pixels where mask is true
+	        if not present or empty, no mask restrictions are used
+	 method - detection statistic, one of
+	          'smf' - Spectral Matched Filter
+	          'ace' - Squared Adaptive Cosine/Coherence Estimator
+	          'ace_rt' - Adaptive Cosine/Coherence Estimator (square root)
+	          'sam' - Spectral Angle Mapper (cosine of the angle, no background statistics)
+	 mu - (optional) background mean (n_band x 1 column vector)
+	 sig_inv - (optional) background inverse covariance (n_band x n_band matrix)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
+
+	Outputs:
+	 lib_out - detector image per signature (n_row x n_col x n_sig)
+	 max_out - max detector score over the signatures
+	 sig_index - index of the signature with the max score
+	"""
+	if tgt_lib.ndim == 1:
+		tgt_lib = tgt_lib[:, np.newaxis]
+
+	if method == 'sam':
+		max_out, kwargsout = img_det(library_helper, hsi_img, tgt_lib, mask, method = method, pixel_out = ['lib_data', 'sig_index'], tile_rows = tile_rows)
+	else:
+		max_out, kwargsout = img_det(library_helper, hsi_img, tgt_lib, mask, method = method, pixel_out = ['lib_data', 'sig_index'], mu = mu, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method, tile_rows = tile_rows)
+
+	lib_out = kwargsout['lib_data']
+	if lib_out.ndim == 2:
+		lib_out = lib_out[:, :, np.newaxis]
+
+	return lib_out, max_out, kwargsout['sig_index']
+
+def library_helper(hsi_data, tgt_lib, kwargs):
+	lib_data = library_scores(hsi_data, tgt_lib, kwargs['method'], kwargs)
+	return np.max(lib_data, 0), {'lib_data': lib_data, 'sig_index': np.argmax(lib_data, 0)}
+
+def library_scores(hsi_data, tgt_lib, method, kwargs = None):
+	"""
+	Detector scores of every spectrum against every library signature
+
+	Inputs:
+	 hsi_data - n_band x n_pixel array of hyperspectral data
+	 tgt_lib - target signatures (n_band x n_sig)
+	 method - 'smf', 'ace', 'ace_rt' or 'sam' (see library_detector)
+	 kwargs - (optional) bg_model, mu, sig_inv background statistics (see get_bg_model)
+          and wz, the whitened centered data bg_model.whiten(hsi_data - mu) if already computed
+
+	Outputs:
+	 lib_data - n_sig x n_pixel detector scores
+	"""
+	if method == 'sam':
+		prod = tgt_lib.T @ hsi_data
+		return prod / np.sqrt(np.sum(tgt_lib ** 2, 0)[:, np.newaxis] * np.sum(hsi_data ** 2, 0))
+
+	bg_model = get_bg_model(hsi_data, {} if kwargs is None else kwargs)
+	mu = bg_model.mu[:, np.newaxis]
+
+	# Mahalanobis inner products become dot products of whitened vectors
+	ws = bg_model.whiten(tgt_lib - mu)
+	wz = bg_model.whiten(hsi_data - mu) if kwargs is None or kwargs.get('wz') is None else kwargs['wz']
+
+	prod = ws.T @ wz
+	s_norm = np.sqrt(np.sum(ws ** 2, 0))[:, np.newaxis]
+
+	if method == 'smf':
+		return prod / s_norm
+
+	z_norm = np.sqrt(np.sum(wz ** 2, 0))
+	if method == 'ace_rt':
+		return prod / (s_norm * z_norm)
+	if method == 'ace':
+		return (prod / (s_norm * z_norm)) ** 2
+
+	raise ValueError('unknown method ' + str(method))
@@ -1,8 +1,8 @@
-from hsi_toolkit.util import pca
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
 import numpy as np
 
-def osp_detector(hsi_img, tgt_sig, mask = None, n_dim_ss = 2):
+def osp_detector(hsi_img, tgt_sig, mask = None, n_dim_ss = 2, chunk_size = 16384):
 	"""
 	Orthogonal Subspace Projection Detector
 
@@ -12,6 +12,7 @@ def osp_detector(hsi_img, tgt_sig, mask = None, n_dim_ss = 2):
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
 	 n_dim_ss - number of dimensions to use in the background subspace
+	 chunk_size - number of pixels scored at a time (bounds the temporary memory)
 
 	Outputs:
 	 osp_out - detector image
@@ -23,7 +24,7 @@ def osp_detector(hsi_img, tgt_sig, mask = None, n_dim_ss = 2):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	osp_out, kwargsout = img_det(osp_helper, hsi_img, tgt_sig, mask, n_dim_ss = n_dim_ss)
+	osp_out, kwargsout = img_det(osp_helper, hsi_img, tgt_sig, mask, n_dim_ss = n_dim_ss, chunk_size = chunk_size)
 
 	return osp_out
 
@@ -31,12 +32,12 @@ def osp_helper(hsi_data, tgt_sig, kwargs):
 	n_dim_ss = kwargs['n_dim_ss']
 	# see Eismann, pp670
 	n_band, n_pixel = hsi_data.shape
-	mu = np.mean(hsi_data, 1)
-	mu = mu[:, np.newaxis]
-	x = hsi_data - mu
+	bg_model = get_bg_model(hsi_data, kwargs)
+	mu = bg_model.mu[:, np.newaxis]
+	chunk_size = kwargs.get('chunk_size') or n_pixel
 
-	# get PCA rotation, no dim reduction
-	_, _, evecs, _, _ = pca(hsi_data, 1)
+	# get PCA rotation (eigenvectors of the background covariance), no dim reduction
+	evecs = bg_model.evecs
 	s = tgt_sig - mu
 
 	# get a subspace that theoretically encompasses the background
@@ -49,6 +50,6 @@ def osp_helper(hsi_data, tgt_sig, kwargs):
 
 	osp_data = np.zeros(n_pixel)
 
-	for i in range(n_pixel):
-		osp_data[i] = f @ x[:,i]
+	for c in range(0, n_pixel, chunk_size):
+		osp_data[c:c + chunk_size] = f @ (hsi_data[:, c:c + chunk_size] - mu)
 	return osp_data, {}
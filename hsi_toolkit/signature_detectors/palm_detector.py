@@ -1,8 +1,8 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_gmm, matched_filters
 import numpy as np
-from sklearn.mixture import GaussianMixture
 
-def palm_detector(hsi_img, tgt_sig, mask = None, n_comp = 5):
+def palm_detector(hsi_img, tgt_sig, mask = None, n_comp = 5, n_jobs = None, gmm = None, chunk_size = 16384):
 	"""
 	Pairwise Adaptive Linear Matched Filter
 
@@ -12,6 +12,11 @@ def palm_detector(hsi_img, tgt_sig, mask = None, n_comp = 5):
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
 	 n_comp - number of Gaussian components to use
+	 n_jobs - (optional) number of threads scoring blocks of pixels (-1 for one per CPU),
+	          the mixture model is fit once on all the pixels
+	 gmm - (optional) pre-fitted mixture model (util.MixtureModel or fitted sklearn GaussianMixture)
+	 chunk_size - number of pixels scored at a time (bounds the temporary memory),
+	              float32 images are scored in float32
 
 	Outputs:
 	 palm_out - detector image
@@ -23,33 +28,33 @@ def palm_detector(hsi_img, tgt_sig, mask = None, n_comp = 5):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	palm_out, kwargsout = img_det(palm_helper, hsi_img, tgt_sig, mask, n_comp = n_comp)
+	palm_out, kwargsout = img_det(palm_helper, hsi_img, tgt_sig, mask, n_jobs = n_jobs, fit_func = palm_fit, n_comp = n_comp, gmm = gmm, chunk_size = chunk_size)
 	return palm_out
 
-def palm_helper(hsi_data, tgt_sig, kwargs):
-	n_comp = kwargs['n_comp']
-	n_pixel = hsi_data.shape[1]
+def palm_fit(hsi_data, tgt_sig, kwargs):
+	# fit the model (unless given)
+	gmm = get_gmm(hsi_data, kwargs)
+	filt = matched_filters(tgt_sig, gmm.means, gmm.sig_inv)
 
-	# fit the model
-	gmm = GaussianMixture(n_components = n_comp, max_iter = 1, init_params = 'random').fit(hsi_data.T)
-	means = gmm.means_
-	covariances = gmm.covariances_
-	sig_inv = np.zeros(covariances.shape)
-	filt = np.zeros(means.shape)
+	return dict(kwargs, means = gmm.means, filt = filt)
 
-	for i in range(n_comp):
-		sig_inv[i,:,:] = np.linalg.pinv(covariances[i,:,:])
+def palm_helper(hsi_data, tgt_sig, kwargs):
+	# fit the model unless already fit on the whole image
+	if kwargs.get('filt') is None:
+		kwargs = palm_fit(hsi_data, tgt_sig, kwargs)
 
-		s = tgt_sig - means[i,:][:,np.newaxis]
-		filt[i,:] = s.T @ sig_inv[i,:,:] / np.sqrt(s.T @ sig_inv[i,:,:] @ s)
+	n_pixel = hsi_data.shape[1]
+	chunk_size = kwargs.get('chunk_size') or n_pixel
 
-	palm_data = np.zeros(n_pixel)
+	# filter outputs of all components with one n_comp x n_band filter matrix product,
+	# filt_j @ (x - mean_j) = filt_j @ x - filt_j @ mean_j
+	dtype = np.float32 if hsi_data.dtype == np.float32 else np.float64
+	filt = kwargs['filt'].astype(dtype)
+	offset = np.sum(kwargs['filt'] * kwargs['means'], 1).astype(dtype)[:, np.newaxis]
 
-	for i in range(n_pixel):
-		dists = np.zeros(n_comp)
-		for j in range(n_comp):
-			dists[j] = (filt[j,:] @ (hsi_data[:,i] - means[j,:])) ** 2
+	palm_data = np.zeros(n_pixel, dtype = dtype)
 
-		palm_data[i] = np.min(dists)
+	for c in range(0, n_pixel, chunk_size):
+		palm_data[c:c + chunk_size] = np.min((filt @ hsi_data[:, c:c + chunk_size] - offset) ** 2, 0)
 
 	return palm_data, {}
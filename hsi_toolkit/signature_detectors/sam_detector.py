@@ -1,15 +1,18 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.signature_detectors.library_detector import library_scores
 import numpy as np
 
-def sam_detector(hsi_img, tgt_sig, mask = None):
+def sam_detector(hsi_img, tgt_sig, mask = None, tile_rows = None):
 	"""
 	Spectral Angle Mapper
 
 	Inputs:
 	 hsi_image - n_row x n_col x n_band hyperspectral image
 	 tgt_sig - target signature (n_band x 1 - column vector)
+	           or signatures (n_band x n_sig), the output is then the max over the signatures
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
 
 	Outputs:
 	 sam_out - detector image
@@ -21,12 +24,10 @@ def sam_detector(hsi_img, tgt_sig, mask = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	sam_out, kwargsout = img_det(sam_helper, hsi_img, tgt_sig, mask)
+	sam_out, kwargsout = img_det(sam_helper, hsi_img, tgt_sig, mask, tile_rows = tile_rows)
 
 	return sam_out
 
 def sam_helper(hsi_data, tgt_sig, kwargs):
-	prod = tgt_sig.T @ hsi_data
-	mag = np.sqrt(tgt_sig.T @ tgt_sig * np.sum(hsi_data ** 2, 0))
-	sam_data = prod / mag
-	return sam_data.squeeze(), {}
+	sam_data = library_scores(hsi_data, tgt_sig, 'sam')
+	return np.max(sam_data, 0), {}
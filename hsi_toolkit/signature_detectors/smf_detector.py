@@ -1,7 +1,8 @@
 from hsi_toolkit.util import img_det
+from hsi_toolkit.util import get_bg_model
 import numpy as np
 
-def smf_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
+def smf_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None, bg_model = None, tile_rows = None, cov_method = 'pinv'):
 	"""
 	Spectral Matched Filter
 
@@ -12,6 +13,10 @@ def smf_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
 	        if not present or empty, no mask restrictions are used
 	 mu - (optional) mean for filter (if not provided, computed from image)
 	 siginv - (optional) inverse covariance for filter (if not provided, computed from image)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 smf_out - detector image
@@ -22,7 +27,7 @@ def smf_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
 	6/2/2018 - Edited by Alina Zare
 	10/2018 - Python Implementation by Yutai Zhou
 	"""
-	smf_out, kwargsout = img_det(smf_det_array_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv)
+	smf_out, kwargsout = img_det(smf_det_array_helper, hsi_img, tgt_sig, mask, mu = mu, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method, tile_rows = tile_rows)
 	return smf_out, kwargsout['mu'], kwargsout['sig_inv']
 
 def smf_det_array_helper(hsi_data, tgt_sig, kwargs):
@@ -49,8 +54,9 @@ def smf_det_array_helper(hsi_data, tgt_sig, kwargs):
 	 on hyperspectral (non additive) data
 	 also take positive square root of filter
 	"""
-	mu = np.mean(hsi_data, axis = 1) if kwargs['mu'] is None else kwargs['mu']
-	sig_inv = np.linalg.pinv(np.cov(hsi_data.T, rowvar = False)) if kwargs['sig_inv'] is None else kwargs['sig_inv']
+	bg_model = get_bg_model(hsi_data, kwargs)
+	mu = bg_model.mu
+	sig_inv = bg_model.sig_inv
 
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
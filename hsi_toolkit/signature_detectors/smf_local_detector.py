@@ -1,7 +1,7 @@
 from hsi_toolkit.util import rx_det
 import numpy as np
 
-def smf_local_detector(hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4):
+def smf_local_detector(hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4, rank_update = False, n_jobs = None):
 	"""
 	Spectral Matched Filter with RX style local background estimation
 
@@ -12,6 +12,10 @@ def smf_local_detector(hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4)
 	        if not present or empty, no mask restrictions are used
 	 guard_win - guard window radius (square,symmetric about pixel of interest)
 	 bg_win - background window radius
+	 rank_update - update the local inverse covariance between neighbouring windows with
+	               Sherman-Morrison-Woodbury rank-k updates instead of inverting every window
+	               (needs more background pixels than bands)
+	 n_jobs - (optional) number of processes to run the sliding window in, -1 for one per CPU
 
 	Outputs:
 	 out - detector image
@@ -22,17 +26,10 @@ def smf_local_detector(hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4)
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	out, kwargsout = rx_det(smf_local_helper, hsi_img, tgt_sig, mask = mask, guard_win = guard_win, bg_win = bg_win)
+	out, kwargsout = rx_det(smf_local_helper, hsi_img, tgt_sig, mask = mask, guard_win = guard_win, bg_win = bg_win, rank_update = rank_update, n_jobs = n_jobs)
 	return out
 
-def smf_local_helper(x, ind, bg, b_mask_list, args, kwargs):
-	if bg is None:
-		sig_inv = args['global_sig_inv']
-		mu = args['mu']
-	else:
-		sig_inv = np.linalg.pinv(np.cov(bg.T, rowvar = False))
-		mu = np.mean(bg, 1)
-
+def smf_local_helper(x, ind, mu, sig_inv, args, kwargs):
 	s = args['tgt_sig'] - np.reshape(mu, (-1,1))
 	z = np.reshape(x, (-1,1)) - np.reshape(mu, (-1,1))
 	f = (s.T @ sig_inv) / np.sqrt(s.T @ sig_inv @ s)
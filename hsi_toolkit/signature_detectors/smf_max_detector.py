@@ -1,8 +1,7 @@
-from hsi_toolkit.util import img_det
-from hsi_toolkit.signature_detectors import smf_det_array_helper
+from hsi_toolkit.signature_detectors.library_detector import library_detector
 import numpy as np
 
-def smf_max_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
+def smf_max_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None, bg_model = None, tile_rows = None, cov_method = 'pinv'):
 	"""
 	Spectral Matched Filter, Max over targets
 
@@ -11,6 +10,12 @@ def smf_max_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
 	 tgt_sigs - target signatures (n_band x n_signatures)
 	 mask - binary image limiting detector operation to pixels where mask is true
 	        if not present or empty, no mask restrictions are used
+	 mu - (optional) mean for filter (if not provided, computed from image)
+	 sig_inv - (optional) inverse covariance for filter (if not provided, computed from image)
+	 bg_model - (optional) BackgroundModel with precomputed background statistics (e.g. shared by several detectors)
+	 tile_rows - (optional) number of image rows to process at a time, for images larger than memory (e.g. np.memmap)
+	 cov_method - inversion method of the background covariance when it is computed here,
+	              'pinv' (default), 'floor' or 'chol' (Cholesky whitening, see util.BackgroundModel)
 
 	Outputs:
 	 smf_out - detector image
@@ -21,13 +26,6 @@ def smf_max_detector(hsi_img, tgt_sig, mask = None, mu = None, sig_inv = None):
 	if tgt_sig.ndim == 1:
 		tgt_sig = tgt_sig[:, np.newaxis]
 
-	n_sig = tgt_sig.shape[1]
-	n_row, n_col, n_band = hsi_img.shape
-
-	sig_out = np.zeros((n_row, n_col, n_sig))
-
-	for i in range(n_sig):
-		sig_out[:,:,i], kwargsout = img_det(smf_det_array_helper, hsi_img, tgt_sig[:,i][:,np.newaxis], mask, mu = mu, sig_inv = mu)
-
-	smf_out = np.max(sig_out, 2)
+	# all signatures scored at once against the shared background statistics
+	_, smf_out, _ = library_detector(hsi_img, tgt_sig, mask, 'smf', mu = mu, sig_inv = sig_inv, bg_model = bg_model, cov_method = cov_method, tile_rows = tile_rows)
 	return smf_out
@@ -1,7 +1,15 @@
+from hsi_toolkit.util.abundance_cache import *
+from hsi_toolkit.util.background_model import *
+from hsi_toolkit.util.cluster_stats import *
+from hsi_toolkit.util.cov_inv import *
 from hsi_toolkit.util.get_hsi_bands import *
 from hsi_toolkit.util.get_RGB import *
 from hsi_toolkit.util.img_det import *
 from hsi_toolkit.util.img_seg import *
+from hsi_toolkit.util.local_stats import *
+from hsi_toolkit.util.mixture_model import *
+from hsi_toolkit.util.noise_cov import *
+from hsi_toolkit.util.parallel import *
 from hsi_toolkit.util.pca import *
 from hsi_toolkit.util.rx_det import *
 from hsi_toolkit.util.unmix import *
@@ -0,0 +1,134 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from hsi_toolkit.util.unmix import unmix
+
+class AbundanceCache:
+	"""
+	Cache of unmixing abundances shared across detectors
+	 the hybrid detectors (abd, ha, hsd, hua, hsd_local) unmix the same scene with the same
+	 endmember sets; abundances are kept under a fingerprint of the data, the endmembers
+	 and the mask, so each endmember set is unmixed once per scene. The least recently used
+	 arrays are evicted past max_items, and saved as .npy files in spill_dir (if given)
+	 to be loaded back instead of unmixing again
+
+	Inputs:
+	 max_items - number of abundance arrays kept in memory (0 disables the in-memory cache)
+	 spill_dir - (optional) directory where evicted abundance arrays are stored
+	 enabled - if False, unmix always unmixes and nothing is stored
+
+	Example:
+	 P = abundance_cache.unmix(hsi_data, ems)    # module level cache used by the detectors
+	 abundance_cache.spill_dir = '/tmp/abundances'
+	 abundance_cache.enabled = False             # detectors unmix every time, nothing is kept
+	 abundance_cache.clear()                     # free the abundances kept so far
+	"""
+	def __init__(self, max_items = 8, spill_dir = None, enabled = True):
+		self.max_items = max_items
+		self.spill_dir = spill_dir
+		self.enabled = enabled
+		self.hits = 0
+		self.misses = 0
+		self._items = OrderedDict()
+		self._lock = threading.Lock()
+
+	def unmix(self, data, endmembers, mask = None, method = 'fcls', cache = None):
+		"""
+		Cached util.unmix
+
+		Inputs:
+		 data - n_band x n_pixel array of spectra
+		 endmembers - n_band x n_endmember array of endmember spectra
+		 mask - (optional) binary mask of the n_pixel pixels to unmix
+		 method - unmixing method (see util.unmix)
+		 cache - (optional) False to bypass the cache for this call (default self.enabled)
+
+		Outputs:
+		 P - n_pixel (or n_mask) x n_endmember abundances, read only when cached
+		"""
+		if not (self.enabled if cache is None else cache):
+			return unmix(data if mask is None else data[:, mask.astype(bool)], endmembers, method)
+
+		key = fingerprint(data, endmembers, mask, method)
+		P = self.get(key)
+		if P is None:
+			P = unmix(data if mask is None else data[:, mask.astype(bool)], endmembers, method)
+			self.put(key, P)
+		return P
+
+	def get(self, key):
+		"""
+		Abundances stored under key, from memory or spill_dir, None if not cached
+		"""
+		with self._lock:
+			if key in self._items:
+				self._items.move_to_end(key)
+				self.hits += 1
+				return self._items[key]
+
+		path = self._path(key)
+		if path is not None and os.path.exists(path):
+			P = np.load(path)
+			self.put(key, P)
+			self.hits += 1
+			return P
+
+		self.misses += 1
+		return None
+
+	def put(self, key, P):
+		"""
+		Store abundances under key, evicting (and spilling) the least recently used past max_items
+		"""
+		P.flags.writeable = False
+		evicted = []
+		with self._lock:
+			self._items[key] = P
+			self._items.move_to_end(key)
+			while len(self._items) > self.max_items:
+				evicted.append(self._items.popitem(last = False))
+
+		for old_key, old_P in evicted:
+			path = self._path(old_key)
+			if path is not None and not os.path.exists(path):
+				os.makedirs(self.spill_dir, exist_ok = True)
+				np.save(path, old_P)
+
+	def clear(self):
+		"""
+		Drop the in-memory abundances (files in spill_dir are kept)
+		"""
+		with self._lock:
+			self._items.clear()
+
+	def _path(self, key):
+		return None if self.spill_dir is None else os.path.join(self.spill_dir, key + '.npy')
+
+def fingerprint(data, endmembers, mask = None, method = 'fcls'):
+	"""
+	Cache key of an unmixing problem, a hash of the data, endmembers and mask values and the method
+
+	Outputs:
+	 key - hex digest string
+	"""
+	data = np.asarray(data)
+
+	h = hashlib.blake2b(digest_size = 20)
+	h.update(str((data.shape, str(data.dtype), np.shape(endmembers), method)).encode())
+	h.update(np.ascontiguousarray(data))
+	h.update(np.ascontiguousarray(endmembers, dtype = np.float64))
+	if mask is not None:
+		h.update(np.packbits(np.asarray(mask, dtype = bool)))
+	return h.hexdigest()
+
+# cache shared by the detectors
+abundance_cache = AbundanceCache()
+
+def cached_unmix(data, endmembers, mask = None, method = 'fcls', cache = None):
+	"""
+	util.unmix through the shared abundance_cache (see AbundanceCache.unmix),
+	 cache = False (or abundance_cache.enabled = False) bypasses it
+	"""
+	return abundance_cache.unmix(data, endmembers, mask, method, cache)
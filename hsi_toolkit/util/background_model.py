@@ -0,0 +1,175 @@
+import numpy as np
+from hsi_toolkit.util.cov_inv import cov_inv, loaded_chol, whitener, _tril_inv
+
+class BackgroundModel:
+	"""
+	Background statistics shared across detectors
+	 the mean and covariance are computed once, the eigendecomposition, Cholesky factor
+	 and inverse covariance on first use, and all of them are kept, so a single model
+	 can be passed to every detector run on a scene (bg_model argument)
+
+	Inputs:
+	 hsi_data - (optional) n_band x n_pixel array of background spectra
+	 mu - (optional) background mean (n_band vector), computed from hsi_data if not given
+	 sigma - (optional) background covariance (n_band x n_band matrix), computed from hsi_data if not given
+	 sig_inv - (optional) background inverse covariance, computed from sigma with method if not given
+	 method - inversion method of sig_inv and whitening (see util.cov_inv):
+	          'pinv' - eigh pseudo-inverse (default), 'floor' - eigenvalues floored,
+	          'chol' - Cholesky, Mahalanobis terms are ||inv(chol) @ z||^2
+
+	Attributes (computed on first use):
+	 mu - background mean (n_band vector)
+	 sigma - background covariance
+	 sig_inv - background inverse covariance
+	 evals, evecs - eigenvalues (descending) and eigenvectors (columns) of sigma
+	 chol - lower triangular Cholesky factor of sigma (diagonally loaded if sigma is singular, see loaded_chol)
+	 whitening - whitening matrix W (n_keep x n_band), W.T @ W = sig_inv
+	"""
+	def __init__(self, hsi_data = None, mu = None, sigma = None, sig_inv = None, method = 'pinv'):
+		if method not in ('pinv', 'floor', 'chol'):
+			raise ValueError('unknown method ' + str(method))
+
+		self.hsi_data = hsi_data
+		self.method = method
+		self._mu = None if mu is None else np.asarray(mu).reshape(-1)
+		self._sigma = sigma
+		self._sig_inv = sig_inv
+		self._sig_inv_given = sig_inv is not None
+		self._eig = None
+		self._chol = None
+		self._whitening = None
+
+	@classmethod
+	def from_img(cls, hsi_img, mask = None, tile_rows = None, method = 'pinv'):
+		"""
+		Background model of an image
+
+		Inputs:
+		 hsi_img - n_row x n_col x n_band hyperspectral image (array, np.memmap or other lazily loaded cube)
+		 mask - binary image of the background pixels
+		        if not present or empty, all pixels are used
+		 tile_rows - (optional) read the image tile_rows image rows at a time, mean and covariance
+		             then come from a two-pass reduction over the tiles
+		 method - inversion method ('pinv', 'floor' or 'chol', see BackgroundModel)
+
+		Outputs:
+		 bg_model - BackgroundModel of the (masked) image pixels
+		"""
+		n_row, n_col, n_band = hsi_img.shape
+		mask = np.ones((n_row, n_col), dtype=bool) if mask is None else mask.astype(bool)
+
+		if tile_rows is None:
+			hsi_data = np.reshape(hsi_img, (n_row * n_col, n_band), order='F').T
+			return cls(hsi_data[:, mask.reshape(-1, order='F')], method = method)
+
+		def read_tile(r0):
+			tile = np.asarray(hsi_img[r0:r0 + tile_rows,:,:], dtype=np.float64)
+			return tile[mask[r0:r0 + tile_rows,:]].T
+
+		n_pixel = 0
+		mu = np.zeros(n_band)
+		for r0 in range(0, n_row, tile_rows):
+			data = read_tile(r0)
+			n_pixel += data.shape[1]
+			mu += np.sum(data, 1)
+		mu /= n_pixel
+
+		sigma = np.zeros((n_band, n_band))
+		for r0 in range(0, n_row, tile_rows):
+			z = read_tile(r0) - mu[:, np.newaxis]
+			sigma += z @ z.T
+		sigma /= n_pixel - 1
+
+		return cls(mu = mu, sigma = sigma, method = method)
+
+	@property
+	def mu(self):
+		if self._mu is None:
+			self._mu = np.mean(self.hsi_data, 1)
+		return self._mu
+
+	@property
+	def sigma(self):
+		if self._sigma is None:
+			self._sigma = np.cov(self.hsi_data.T, rowvar = False)
+		return self._sigma
+
+	@property
+	def sig_inv(self):
+		if self._sig_inv is None:
+			if self.method == 'chol':
+				# inv(L).T @ inv(L) from the (loaded) Cholesky factor
+				self._sig_inv = self.whitening.T @ self.whitening
+			else:
+				# reuses the eigendecomposition, 'pinv' has the same cutoff as np.linalg.pinv
+				self._sig_inv = cov_inv(self.sigma, self.method, eig = self.eig)
+		return self._sig_inv
+
+	@property
+	def evals(self):
+		return self.eig[0]
+
+	@property
+	def evecs(self):
+		return self.eig[1]
+
+	@property
+	def eig(self):
+		if self._eig is None:
+			evals, evecs = np.linalg.eigh(self.sigma)
+			self._eig = (evals[::-1], evecs[:, ::-1])
+		return self._eig
+
+	@property
+	def chol(self):
+		if self._chol is None:
+			self._chol = loaded_chol(self.sigma)[0]
+		return self._chol
+
+	@property
+	def whitening(self):
+		if self._whitening is None:
+			if self._sig_inv_given:
+				# follow the given inverse covariance, W = sqrt(evals) evecs.T of sig_inv
+				evals, evecs = np.linalg.eigh(self.sig_inv)
+				keep = evals > 1e-15 * np.max(np.abs(evals))
+				self._whitening = (evecs[:, keep] * np.sqrt(evals[keep])).T
+			elif self.method == 'chol':
+				self._whitening = _tril_inv(self.chol)
+			else:
+				# 'pinv' has the same small eigenvalue cutoff as np.linalg.pinv
+				self._whitening = whitener(self.sigma, self.method, eig = self.eig)
+		return self._whitening
+
+	def whiten(self, x):
+		"""
+		Whitened (decorrelated, unit variance) spectra W @ x, so that Mahalanobis
+		terms become squared norms; x is n_band x n (subtract mu first)
+		"""
+		return self.whitening @ x
+
+def get_bg_model(hsi_data, kwargs):
+	"""
+	Background model for an array based detector helper
+
+	Inputs:
+	 hsi_data - n_band x n_pixel array of spectra given to the detector
+	 kwargs - detector arguments, optional bg_model (BackgroundModel), mu, sig_inv and cov_method;
+	          mu / sig_inv, when given, take precedence over bg_model; cov_method is the inversion
+	          method of a model built here (default 'pinv', a given bg_model keeps its own)
+
+	Outputs:
+	 bg_model - kwargs['bg_model'], or a BackgroundModel of hsi_data
+	"""
+	bg_model = kwargs.get('bg_model')
+	mu = kwargs.get('mu')
+	sig_inv = kwargs.get('sig_inv')
+
+	if bg_model is None:
+		return BackgroundModel(hsi_data, mu = mu, sig_inv = sig_inv, method = kwargs.get('cov_method') or 'pinv')
+	if mu is None and sig_inv is None:
+		return bg_model
+
+	# keep the data and the covariance of the model (for evecs, chol, ...), computed from hsi_data if it has neither
+	sigma = bg_model.sigma if bg_model._sigma is not None or bg_model.hsi_data is not None else None
+	return BackgroundModel(hsi_data, mu = bg_model.mu if mu is None else mu, sigma = sigma, sig_inv = bg_model.sig_inv if sig_inv is None else sig_inv, method = bg_model.method)
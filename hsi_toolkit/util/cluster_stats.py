@@ -0,0 +1,141 @@
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from hsi_toolkit.util.cov_inv import sym_pinv
+
+def cluster_stats(hsi_data, labels, n_cluster):
+	"""
+	Mean and inverse covariance of every cluster of spectra
+	 the covariances are inverted together, one batched eigh pseudo-inverse over the stack
+
+	Inputs:
+	 hsi_data - n_band x n_pixel array of spectra
+	 labels - cluster label of each pixel (n_pixel, values 0 to n_cluster - 1)
+	 n_cluster - number of clusters
+
+	Outputs:
+	 mu - cluster means (n_cluster x n_band)
+	 sig_inv - cluster inverse covariances (n_cluster x n_band x n_band)
+	"""
+	n_band = hsi_data.shape[0]
+	mu = np.zeros((n_cluster, n_band))
+	sigma = np.zeros((n_cluster, n_band, n_band))
+
+	for k in range(n_cluster):
+		z = hsi_data[:, labels == k]
+		mu[k] = np.mean(z, 1)
+		sigma[k] = np.cov(z.T, rowvar = False)
+
+	return mu, sym_pinv(sigma)
+
+def stream_cluster_stats(hsi_img, n_cluster, tile_rows, mask = None, batch_size = 1024, random_state = None):
+	"""
+	Streaming k-means clustering and cluster statistics of an image too large to hold in memory
+	 the image is read tile_rows image rows at a time (works on a np.memmap): one pass fits the
+	 centroids with mini-batches of batch_size pixels (MiniBatchKMeans), a second pass labels the
+	 pixels and accumulates the count, sum and scatter of every cluster, about its centroid;
+	 the tiles are visited in random order and the mini-batches drawn at random from the pixels read,
+	 so the centroids are not biased toward the last rows seen
+
+	Inputs:
+	 hsi_img - n_row x n_col x n_band hyperspectral image (array, np.memmap or other lazily loaded cube)
+	 n_cluster - number of clusters
+	 tile_rows - number of image rows read at a time
+	 mask - binary image of the pixels to cluster
+	        if not present or empty, all pixels are used
+	 batch_size - number of pixels per mini-batch
+	 random_state - (optional) seed of the tile order, mini-batch draws and MiniBatchKMeans
+
+	Outputs:
+	 clusters - (kmeans, mu, sig_inv), the fitted MiniBatchKMeans (kmeans.predict labels new pixels),
+	            cluster means (n_cluster x n_band) and inverse covariances (n_cluster x n_band x n_band)
+	"""
+	n_row, n_col, n_band = hsi_img.shape
+	mask = np.ones((n_row, n_col), dtype=bool) if mask is None else mask.astype(bool)
+
+	def read_tile(r0):
+		tile = np.asarray(hsi_img[r0:r0 + tile_rows,:,:], dtype=np.float64)
+		return tile[mask[r0:r0 + tile_rows,:]]
+
+	# fit the centroids, the first mini-batch needs at least n_cluster pixels
+	rng = np.random.RandomState(random_state)
+	kmeans = MiniBatchKMeans(n_clusters = n_cluster, batch_size = batch_size, n_init = 3, random_state = random_state)
+	batch = np.zeros((0, n_band))
+	for r0 in rng.permutation(np.arange(0, n_row, tile_rows)):
+		# pixels left over from the previous tiles mixed in with this tile's
+		batch = np.vstack((batch, read_tile(r0)))
+		batch = batch[rng.permutation(batch.shape[0])]
+		while batch.shape[0] >= max(batch_size, n_cluster):
+			kmeans.partial_fit(batch[:batch_size])
+			batch = batch[batch_size:]
+	if batch.shape[0] >= n_cluster or (batch.shape[0] > 0 and hasattr(kmeans, 'cluster_centers_')):
+		kmeans.partial_fit(batch)
+
+	# per cluster count, sum and scatter about the centroid in one pass
+	centers = kmeans.cluster_centers_
+	count = np.zeros(n_cluster)
+	total = np.zeros((n_cluster, n_band))
+	scatter = np.zeros((n_cluster, n_band, n_band))
+	for r0 in range(0, n_row, tile_rows):
+		data = read_tile(r0)
+		if data.shape[0] == 0: continue
+		labels = kmeans.predict(data)
+
+		for k in np.unique(labels):
+			z = data[labels == k] - centers[k]
+			count[k] += z.shape[0]
+			total[k] += np.sum(z, 0)
+			scatter[k] += z.T @ z
+
+	# shift the sums back from the centroids to the cluster means (clusters left empty keep the centroid)
+	n = np.maximum(count, 1)[:, np.newaxis]
+	d = total / n
+	sigma = (scatter - n[:, :, np.newaxis] * d[:, :, np.newaxis] * d[:, np.newaxis, :]) / np.maximum(n - 1, 1)[:, :, np.newaxis]
+
+	return kmeans, centers + d, sym_pinv(sigma)
+
+def matched_filters(tgt_sig, mu, sig_inv):
+	"""
+	Normalized matched filter of the target for every cluster (or mixture component)
+	 f_k = s_k^T sig_inv_k / sqrt(s_k^T sig_inv_k s_k), s_k = tgt_sig - mu_k
+
+	Inputs:
+	 tgt_sig - target signature (n_band x 1 - column vector)
+	 mu - cluster means (n_cluster x n_band)
+	 sig_inv - cluster inverse covariances (n_cluster x n_band x n_band)
+
+	Outputs:
+	 filt - matched filters (n_cluster x n_band)
+	"""
+	s = tgt_sig.reshape(1, -1) - mu
+	s_sig_inv = np.einsum('kb,kbc->kc', s, sig_inv)
+	return s_sig_inv / np.sqrt(np.sum(s_sig_inv * s, 1))[:, np.newaxis]
+
+def cluster_scores(hsi_data, labels, mu, sig_inv = None, filt = None):
+	"""
+	Score every pixel against the statistics of its own cluster
+	 pixels are grouped by label and each group is scored with one batched
+	 quadratic (or linear) form instead of one small product per pixel
+
+	Inputs:
+	 hsi_data - n_band x n_pixel array of spectra
+	 labels - cluster label of each pixel (n_pixel)
+	 mu - cluster means (n_cluster x n_band)
+	 sig_inv - cluster inverse covariances (n_cluster x n_band x n_band), for Mahalanobis distances
+	 filt - (instead of sig_inv) cluster filters (n_cluster x n_band), for filter outputs
+
+	Outputs:
+	 scores - (x - mu_k)^T sig_inv_k (x - mu_k), or filt_k (x - mu_k), for each pixel x of cluster k (n_pixel)
+	"""
+	scores = np.zeros(hsi_data.shape[1])
+
+	for k in range(mu.shape[0]):
+		group = np.flatnonzero(labels == k)
+		if group.size == 0: continue
+		z = hsi_data[:, group] - mu[k][:, np.newaxis]
+
+		if filt is None:
+			scores[group] = np.sum(z * (sig_inv[k] @ z), 0)
+		else:
+			scores[group] = filt[k] @ z
+
+	return scores
@@ -0,0 +1,136 @@
+import numpy as np
+from scipy.linalg import solve_triangular
+
+def sym_pinv(sigma, rcond = 1e-15, eig = None):
+	"""
+	Pseudo-inverse of a symmetric matrix, or stack of them, through eigh
+	 same cutoff rule as np.linalg.pinv, but does not hit the SVD convergence
+	 failures of np.linalg.pinv on rank deficient window covariances, and eigh
+	 is several times faster than the SVD behind np.linalg.pinv
+
+	Inputs:
+	 sigma - n_band x n_band matrix or ... x n_band x n_band stack
+	 rcond - relative cutoff for small eigenvalues, scalar or one per matrix, or a function
+	         of the largest absolute eigenvalue(s) returning the cutoff (e.g. a MATLAB style tolerance)
+	 eig - (optional) precomputed np.linalg.eigh(sigma)
+
+	Outputs:
+	 sig_inv - pseudo-inverse(s), same shape as sigma
+	"""
+	evals, evecs = np.linalg.eigh(sigma) if eig is None else eig
+	s_max = np.max(np.abs(evals), -1, keepdims = True)
+	cutoff = np.asarray(rcond(s_max[..., 0]) if callable(rcond) else rcond)[..., np.newaxis] * s_max
+
+	inv_evals = np.zeros_like(evals)
+	keep = np.abs(evals) > cutoff
+	inv_evals[keep] = 1 / evals[keep]
+
+	return (evecs * inv_evals[..., np.newaxis, :]) @ np.swapaxes(evecs, -1, -2)
+
+def loaded_chol(sigma, max_load = 1e-2):
+	"""
+	Cholesky factor of a covariance, or stack of them, with automatic diagonal loading
+	 matrices that are not numerically positive definite are loaded with
+	 load * mean(diag(sigma)) * I, load = 1e-12, 1e-10, ... up to max_load, until the factorization succeeds
+
+	Inputs:
+	 sigma - n_band x n_band matrix or ... x n_band x n_band stack
+	 max_load - largest relative diagonal load tried
+
+	Outputs:
+	 L - lower triangular factors, sigma + load * mean(diag(sigma)) * I = L @ L.T
+	 load - relative diagonal load used (0 when none was needed), scalar or one per matrix
+	"""
+	sigma = np.asarray(sigma, dtype = np.float64)
+	try:
+		return np.linalg.cholesky(sigma), np.zeros(sigma.shape[:-2])
+	except np.linalg.LinAlgError:
+		pass
+
+	if sigma.ndim > 2:
+		# factor the stack matrix by matrix, only the failed ones get loaded
+		flat = sigma.reshape((-1,) + sigma.shape[-2:])
+		parts = [loaded_chol(s, max_load) for s in flat]
+		L = np.stack([p[0] for p in parts]).reshape(sigma.shape)
+		return L, np.array([p[1] for p in parts]).reshape(sigma.shape[:-2])
+
+	eye = np.eye(sigma.shape[0])
+	scale = max(np.mean(np.diag(sigma)), np.finfo(float).tiny)
+	for load in 10.0 ** np.arange(-12, np.log10(max_load) + 1, 2):
+		try:
+			return np.linalg.cholesky(sigma + load * scale * eye), load
+		except np.linalg.LinAlgError:
+			pass
+
+	raise np.linalg.LinAlgError('covariance is not positive definite with a relative diagonal load of ' + str(max_load))
+
+def cov_inv(sigma, method = 'pinv', rcond = 1e-15, eig = None):
+	"""
+	Inverse of a covariance matrix, or stack of them
+
+	Inputs:
+	 sigma - n_band x n_band matrix or ... x n_band x n_band stack
+	 method - 'pinv' - eigh pseudo-inverse, eigenvalues below rcond * max dropped (same as np.linalg.pinv)
+	          'floor' - eigh inverse with the eigenvalues floored at rcond * max
+	          'chol' - Cholesky inverse, diagonally loaded if not positive definite (see loaded_chol)
+	 rcond - relative eigenvalue cutoff / floor ('pinv' and 'floor')
+	 eig - (optional) precomputed np.linalg.eigh(sigma) ('pinv' and 'floor')
+
+	Outputs:
+	 sig_inv - inverse(s), same shape as sigma
+	"""
+	if method == 'pinv':
+		return sym_pinv(sigma, rcond, eig)
+
+	if method == 'floor':
+		evals, evecs = np.linalg.eigh(sigma) if eig is None else eig
+		evals = np.maximum(evals, rcond * np.max(np.abs(evals), -1, keepdims = True))
+		return (evecs / evals[..., np.newaxis, :]) @ np.swapaxes(evecs, -1, -2)
+
+	if method == 'chol':
+		L_inv = _tril_inv(loaded_chol(sigma)[0])
+		return np.swapaxes(L_inv, -1, -2) @ L_inv
+
+	raise ValueError('unknown method ' + str(method))
+
+def whitener(sigma, method = 'pinv', rcond = 1e-15, eig = None):
+	"""
+	Whitening operator W of a covariance matrix, or stack of them, with W.T @ W = cov_inv(sigma, method)
+	 so Mahalanobis terms z.T @ sig_inv @ z become squared norms ||W @ z||^2
+	 (for 'chol', W = inv(L), the inverse Cholesky factor)
+
+	Inputs:
+	 sigma - n_band x n_band matrix or ... x n_band x n_band stack
+	 method, rcond, eig - see cov_inv
+
+	Outputs:
+	 W - n_keep x n_band whitening matrix ('pinv' drops the directions below the cutoff),
+	     n_band x n_band for the other methods and for stacks (dropped directions are zero rows)
+	"""
+	if method == 'chol':
+		return _tril_inv(loaded_chol(sigma)[0])
+
+	evals, evecs = np.linalg.eigh(sigma) if eig is None else eig
+	s_max = np.max(np.abs(evals), -1, keepdims = True)
+
+	if method == 'floor':
+		scale = 1 / np.sqrt(np.maximum(evals, rcond * s_max))
+	elif method == 'pinv':
+		keep = evals > rcond * s_max
+		if evals.ndim == 1:
+			evals, evecs, keep = evals[keep], evecs[:, keep], keep[keep]
+		scale = np.zeros_like(evals)
+		scale[keep] = 1 / np.sqrt(evals[keep])
+	else:
+		raise ValueError('unknown method ' + str(method))
+
+	return np.swapaxes(evecs * scale[..., np.newaxis, :], -1, -2)
+
+def _tril_inv(L):
+	"""
+	Inverse of a lower triangular matrix (or stack), by solves against the identity
+	"""
+	eye = np.eye(L.shape[-1])
+	if L.ndim == 2:
+		return solve_triangular(L, eye, lower = True)
+	return np.linalg.solve(L, np.broadcast_to(eye, L.shape))
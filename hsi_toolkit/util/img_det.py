@@ -1,49 +1,258 @@
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from hsi_toolkit.util.background_model import BackgroundModel
+from hsi_toolkit.util.parallel import n_workers, blas_limits
 
-def img_det(det_func, hsi_img, tgt_sig, mask = None, **kwargs):
+def img_det(det_func, hsi_img, tgt_sig, mask = None, tile_rows = None, out = None, n_jobs = None, fit_func = None, pixel_out = (), **kwargs):
 	"""
 	Wrapper to use array based detector as a image based detector with the given mask
 
+	Inputs:
+	 det_func - array based detector, det_func(hsi_data, tgt_sig, kwargs) returning (det_data, kwargsout)
+	 hsi_img - n_row x n_col x n_band hyperspectral image (array, np.memmap or other lazily loaded cube)
+	 tgt_sig - target signature(s) passed on to det_func
+	 mask - binary image limiting detector operation to pixels where mask is true
+	        if not present or empty, no mask restrictions are used
+	 tile_rows - (optional) out-of-core mode, the image is read tile_rows image rows at a time:
+	             a two-pass reduction gives the background mean and inverse covariance
+	             (filled into kwargs mu / sig_inv when the detector takes them and they are None,
+	             inverted with kwargs cov_method if given, see util.BackgroundModel),
+	             then det_func scores one tile at a time
+	 out - (optional) preallocated n_row x n_col output, e.g. a np.memmap, for the detector image
+	 n_jobs - (optional) number of threads (-1 for one per CPU), the pixels (or tiles) are split into
+	          blocks scored concurrently and the outputs merged; BLAS threads are limited to
+	          cpu_count / n_jobs per worker while the blocks run
+	 fit_func - (optional) global fit of the detector, fit_func(hsi_data, tgt_sig, kwargs) returning
+	            the kwargs with the fitted model (e.g. mixture model, subspaces) filled in; run once on
+	            the masked pixels (a strided subset of the image rows in out-of-core mode) before
+	            any block is scored, so every block uses the same model
+	 pixel_out - names of the per pixel outputs of det_func in kwargsout (n or k x n arrays),
+	             merged across blocks / tiles and reshaped into n_row x n_col (x k) images
+	 kwargs - detector arguments, n_row x n_col (x k) image-like arguments are linearized and masked
+	          (and split with the pixels into blocks), all others are passed on as they are
+
+	Outputs:
+	 det_out - detector image
+	 kwargsout - other detector outputs, the pixel_out ones as images
+
 	Taylor C. Glenn
 	5/5/2018 - Edited by Alina Zare
 	10/2018 - Python Implementation by Yutai Zhou
 	"""
 	n_row, n_col, n_band = hsi_img.shape
 	n_pixels = n_row * n_col
-	if mask is None:
-		mask = np.ones(n_row * n_col, dtype=bool)
-	else:
-		mask_rows, mask_cols = mask.shape
-		mask = mask.reshape(mask_rows * mask_cols, order ='F').astype(bool)
+	mask = np.ones((n_row, n_col), dtype=bool) if mask is None else mask.astype(bool)
+
+	if tile_rows is not None:
+		return _img_det_tiled(det_func, hsi_img, tgt_sig, mask, tile_rows, out, n_jobs, fit_func, pixel_out, kwargs)
+
+	mask = mask.reshape(n_pixels, order ='F')
 	hsi_data = np.reshape(hsi_img, (n_pixels, n_band), order='F').T
 
 	# Linearize image-like inputs
 	# Mask linearized (n x n) pixel arguments
+	pixel_keys = _image_keys(kwargs, n_row, n_col)
+	kwargs = _linearize_kwargs(kwargs, n_row, n_col, mask)
+
+	# skip the masked copy when every pixel is used
+	if not np.all(mask):
+		hsi_data = hsi_data[:, mask]
+	if fit_func is not None:
+		kwargs = fit_func(hsi_data, tgt_sig, kwargs)
+
+	det_data = np.empty(n_pixels)
+	det_data[mask], kwargsout = _det_blocks(det_func, hsi_data, tgt_sig, kwargs, n_jobs, pixel_keys, pixel_out)
+
+	# Reshape the per pixel outputs back into images, k x n outputs become n_row x n_col x k images
+	for key in pixel_out:
+		if key in kwargsout:
+			val = _pixel_rows(kwargsout[key])
+			tmp = np.empty((n_pixels, val.shape[0]), dtype = val.dtype)
+			tmp[mask] = val.T
+			kwargsout[key] = np.reshape(tmp, (n_row, n_col) if val.shape[0] == 1 else (n_row, n_col, val.shape[0]), order='F')
+
+	det_out = np.reshape(det_data, (n_row, n_col), order='F')
+	if out is not None:
+		out[:] = det_out
+		det_out = out
+
+	return det_out, kwargsout
+
+def _det_blocks(det_func, hsi_data, tgt_sig, kwargs, n_jobs, pixel_keys = (), pixel_out = ()):
+	"""
+	Run an array based detector on blocks of pixels in a thread pool and merge the outputs
+
+	Inputs:
+	 det_func - array based detector
+	 hsi_data - n_band x n_pixel array of spectra
+	 tgt_sig - target signature(s) passed on to det_func
+	 kwargs - detector arguments
+	 n_jobs - number of threads, None or 1 calls det_func once on all the pixels
+	 pixel_keys - names of the per pixel arguments (n or k x n arrays), split with the pixels
+	 pixel_out - names of the per pixel outputs (n or k x n arrays), concatenated
+
+	Outputs:
+	 det_data - detector output (n_pixel)
+	 kwargsout - other detector outputs, the pixel_out ones concatenated (others are taken from the first block)
+	"""
+	n_pixel = hsi_data.shape[1]
+	n_jobs = min(n_workers(n_jobs), n_pixel // 2)
+	if n_jobs <= 1:
+		return det_func(hsi_data, tgt_sig, kwargs)
+
+	edges = np.linspace(0, n_pixel, n_jobs + 1).astype(int)
+	def det_block(i):
+		b0, b1 = edges[i], edges[i + 1]
+		return det_func(hsi_data[:, b0:b1], tgt_sig, _slice_kwargs(kwargs, pixel_keys, b0, b1))
+
+	with blas_limits(n_jobs), ThreadPoolExecutor(max_workers = n_jobs) as pool:
+		parts = list(pool.map(det_block, range(n_jobs)))
+
+	det_data = np.concatenate([np.reshape(part[0], -1) for part in parts])
+	kwargsout = dict(parts[0][1])
+	for key in pixel_out:
+		if key in kwargsout:
+			kwargsout[key] = np.concatenate([_pixel_rows(part[1][key]) for part in parts], 1)
+
+	return det_data, kwargsout
+
+def _slice_kwargs(kwargs, pixel_keys, b0, b1):
+	"""
+	Block b0:b1 of the per pixel (n or k x n) detector arguments named in pixel_keys
+	"""
+	out = dict(kwargs)
+	for key in pixel_keys:
+		out[key] = kwargs[key][..., b0:b1]
+	return out
+
+def _pixel_rows(val):
+	"""
+	Per pixel output (n or k x n) as a k x n array
+	"""
+	val = np.asarray(val)
+	return val.reshape(int(np.prod(val.shape[:-1])), val.shape[-1])
+
+def _img_det_tiled(det_func, hsi_img, tgt_sig, mask, tile_rows, out, n_jobs, fit_func, pixel_out, kwargs):
+	"""
+	Out-of-core img_det, only tile_rows x n_col x n_band of the image is in memory at once
+
+	Inputs:
+	 det_func - array based detector, det_func(hsi_data, tgt_sig, kwargs) returning (det_data, kwargsout)
+	 hsi_img - n_row x n_col x n_band hyperspectral image (array, np.memmap or other lazily loaded cube)
+	 tgt_sig - target signature(s) passed on to det_func
+	 mask - n_row x n_col binary image of pixels to run the detector on
+	 tile_rows - number of image rows per tile
+	 out - preallocated n_row x n_col output or None
+	 n_jobs - number of threads scoring tiles concurrently (n_jobs tiles are in memory at once)
+	 fit_func - global fit of the detector or None
+	 pixel_out - names of the per pixel outputs (n or k x n arrays)
+	 kwargs - dictionary of detector arguments
+
+	Outputs:
+	 det_out - detector image
+	 kwargsout - other detector outputs, the pixel_out ones as images (others are taken from the last tile)
+	"""
+	n_row, n_col, n_band = hsi_img.shape
+	tiles = [(r, min(r + tile_rows, n_row)) for r in range(0, n_row, tile_rows)]
+
+	def read_tile(r0, r1):
+		tile_mask = mask[r0:r1,:].reshape(-1, order='F')
+		tile = np.asarray(hsi_img[r0:r1,:,:], dtype=np.float64)
+		tile_data = tile.reshape(((r1 - r0) * n_col, n_band), order='F').T
+		return tile_data[:, tile_mask], tile_mask
+
+	# two-pass background statistics for detectors that take a background model / mu / sig_inv
+	kwargs = dict(kwargs)
+	if any(key in kwargs and kwargs[key] is None for key in ('bg_model', 'mu', 'sig_inv')):
+		bg_model = BackgroundModel.from_img(hsi_img, mask, tile_rows, kwargs.get('cov_method') or 'pinv')
+
+		if 'bg_model' in kwargs:
+			if kwargs['bg_model'] is None:
+				kwargs['bg_model'] = bg_model
+		else:
+			if kwargs.get('mu', 0) is None:
+				kwargs['mu'] = bg_model.mu
+			if kwargs.get('sig_inv', 0) is None:
+				kwargs['sig_inv'] = bg_model.sig_inv
+
+	# global fit on a strided subset of at most tile_rows image rows
+	if fit_func is not None:
+		sample = np.arange(0, n_row, -(-n_row // tile_rows))
+		sample_data = np.hstack([read_tile(r, r + 1)[0] for r in sample])
+		kwargs = fit_func(sample_data, tgt_sig, kwargs)
+
+	def score_tile(tile):
+		r0, r1 = tile
+		data, tile_mask = read_tile(r0, r1)
+		if data.shape[1] == 0:
+			return None
+
+		# image coordinates of the tile's masked pixels
+		ind = np.flatnonzero(tile_mask)
+		rows, cols = r0 + ind % (r1 - r0), ind // (r1 - r0)
+
+		tile_kwargs = _linearize_kwargs(kwargs, n_row, n_col, tile_mask, (r0, r1))
+		tile_det, tile_out = det_func(data, tgt_sig, tile_kwargs)
+		return ind, rows, cols, tile_det, tile_out
+
+	# score tile by tile, or n_jobs tiles at a time in a thread pool
+	n_jobs = min(n_workers(n_jobs), len(tiles))
+	det_out = np.empty((n_row, n_col)) if out is None else out
+	img_out = {}
+	kwargsout = {}
+
+	with blas_limits(n_jobs), ThreadPoolExecutor(max_workers = n_jobs) as pool:
+		if n_jobs > 1:
+			scored = (res for i in range(0, len(tiles), n_jobs) for res in pool.map(score_tile, tiles[i:i + n_jobs]))
+		else:
+			scored = map(score_tile, tiles)
+
+		for res in scored:
+			if res is None: continue
+			ind, rows, cols, tile_det, kwargsout = res
+			det_out[rows, cols] = tile_det
+
+			# per pixel outputs go into images
+			for key in pixel_out:
+				if key in kwargsout:
+					val = _pixel_rows(kwargsout[key])
+					if key not in img_out:
+						img_out[key] = np.empty((n_row, n_col) if val.shape[0] == 1 else (n_row, n_col, val.shape[0]), dtype = val.dtype)
+					img_out[key][rows, cols] = val.T.squeeze(-1) if val.shape[0] == 1 else val.T
+
+	kwargsout.update(img_out)
+	return det_out, kwargsout
+
+def _image_keys(kwargs, n_row, n_col):
+	"""
+	Names of the image-like (n_row x n_col or n_row x n_col x k) detector arguments, the per pixel arguments once linearized
+	"""
+	return [key for key, val in kwargs.items() if type(val) == np.ndarray and val.ndim in (2, 3) and val.shape[:2] == (n_row, n_col)]
+
+def _linearize_kwargs(kwargs, n_row, n_col, mask, rows = None):
+	"""
+	Linearize (column major, like the image) and mask image-like detector arguments
+
+	Inputs:
+	 kwargs - dictionary of detector arguments
+	 n_row, n_col - image size
+	 mask - linearized binary mask of the pixels (or tile pixels) given to the detector
+	 rows - (optional) (first, last + 1) image rows of the current tile
+
+	Outputs:
+	 kwargs - copy of kwargs with n_row x n_col images as masked 1D arrays and
+	          n_row x n_col x k images as masked k x n arrays
+	"""
+	r0, r1 = (0, n_row) if rows is None else rows
+	out = dict(kwargs)
+
 	for key, val in kwargs.items():
-		if type(val) == np.ndarray: # CHECK ME
+		if type(val) == np.ndarray:
 			sz = val.shape
 			if len(sz) == 2 and sz == (n_row, n_col):
-				val = np.reshape(val,(1, n_pixels), order='F')
-				val = val[mask == 1]
-				kwargs[key] = val
-				print('image input to img_det!1')
+				out[key] = val[r0:r1,:].reshape(-1, order='F')[mask]
 
 			elif len(sz) == 3 and sz[:2] == (n_row, n_col):
-				val = np.reshape(val,(n_pix, sz[-1]), order='F').T
-				val = val[:, mask == 1]
-				kwargs[key] = val
-				print('image input to img_det!2')
+				out[key] = val[r0:r1,:,:].reshape(((r1 - r0) * n_col, sz[-1]), order='F').T[:, mask]
 
-	det_data = np.empty(n_pixels)
-	det_data[mask == 1], kwargsout = det_func(hsi_data[:, mask == 1], tgt_sig, kwargs)
-
-	if len(kwargsout) > 0:
-		# Reshape image-like flattened outputs back into images
-		for key, val in kwargsout.items():
-			if type(val) is np.ndarray:
-				if val.squeeze().ndim == 1 and val.size == np.sum(mask):
-					tmp = np.empty(n_pixels)
-					tmp[mask == 1] = val
-					kwargsout[key] = np.reshape(tmp, (n_row, n_col), order='F')
-
-	return np.reshape(det_data, (n_row, n_col), order='F'), kwargsout
+	return out
@@ -0,0 +1,193 @@
+import numpy as np
+from hsi_toolkit.util.cov_inv import sym_pinv
+
+def local_stats(hsi_img, guard_win, bg_win, mask = None):
+	"""
+	Local background statistics for RX style sliding window detectors
+	 keeps running column sums of the per-band values and band-pair outer products
+	 over the rows spanned by the window, so the mean and covariance of every
+	 annulus (background minus guard) window on an image row come from prefix-sum
+	 differences in O(n_band^2) per pixel, independent of the window size
+
+	Inputs:
+	 hsi_img - n_row x n_col x n_band hyperspectral image (array or np.memmap)
+	 guard_win - guard window radius (square,symmetric about pixel of interest)
+	 bg_win - background window radius
+	 mask - binary image of pixels allowed in the background windows
+	        if not present or empty, all pixels are used
+
+	Outputs (generator, one item per image row of fully valid window centers):
+	 row - image row of the window centers
+	 cols - image columns of the window centers (n_valid)
+	 n_bg - number of background pixels in each window (n_valid)
+	 mu - background means (n_valid x n_band)
+	 sigma - background covariances (n_valid x n_band x n_band)
+
+	 memory use is O(n_col x n_band^2), windows with fewer than 2 background
+	 pixels have undefined (nan) covariance, like np.cov
+	"""
+	for row, cols, s0, s1, s2, offset in _window_sums(hsi_img, guard_win, bg_win, mask):
+		with np.errstate(invalid = 'ignore', divide = 'ignore'):
+			mu = s1 / s0[:, np.newaxis]
+			sigma = (s2 - s1[:, :, np.newaxis] * mu[:, np.newaxis, :]) / (s0 - 1)[:, np.newaxis, np.newaxis]
+
+		yield row, cols, s0, mu + offset, sigma
+
+def local_sig_inv(hsi_img, guard_win, bg_win, mask = None, beta = 0, rank_update = False, n_refactor = 16, centers = None):
+	"""
+	Local background mean and inverse covariance for RX style sliding window detectors
+	 by default every window covariance (diagonal loaded by beta) is inverted directly;
+	 in rank update mode the inverse is carried along each image row with
+	 Sherman-Morrison-Woodbury updates for the pixels entering the window and
+	 downdates for the pixels leaving it, O(k n_band^2) per step for k changed pixels
+	 instead of O(n_band^3), and recomputed exactly every n_refactor steps to control drift
+
+	Inputs:
+	 hsi_img - n_row x n_col x n_band hyperspectral image (array or np.memmap)
+	 guard_win - guard window radius (square,symmetric about pixel of interest)
+	 bg_win - background window radius
+	 mask - binary image of pixels allowed in the background windows
+	        if not present or empty, all pixels are used
+	 beta - scalar value used to diagonal load the local covariances
+	 rank_update - use Sherman-Morrison-Woodbury updates between windows
+	               needs nonsingular window covariances (more background pixels than bands, or beta > 0),
+	               rows where that does not hold are inverted directly
+	 n_refactor - number of window steps between exact inversions in rank update mode
+	 centers - binary image of the window centers that need an inverse
+	           if not present or empty, all window centers are used
+
+	Outputs (generator, one item per image row of fully valid window centers):
+	 row - image row of the window centers
+	 cols - image columns of the window centers (n_valid)
+	 n_bg - number of background pixels in each window (n_valid)
+	 mu - background means (n_valid x n_band)
+	 sig_inv - background inverse covariances (n_valid x n_band x n_band)
+	           nan for skipped centers and windows with fewer than 2 background pixels
+	"""
+	n_band = hsi_img.shape[2]
+	weight = None if mask is None else mask.astype(bool)
+
+	for row, cols, s0, s1, s2, offset in _window_sums(hsi_img, guard_win, bg_win, mask):
+		with np.errstate(invalid = 'ignore', divide = 'ignore'):
+			mu = s1 / s0[:, np.newaxis]
+			scatter = s2 - s1[:, :, np.newaxis] * mu[:, np.newaxis, :]
+
+		sig_inv = np.full(scatter.shape, np.nan)
+
+		if rank_update and np.all(s0 >= 2) and (beta > 0 or np.all(s0 > n_band)):
+			_row_rank_updates(hsi_img, weight, row, s0, s1, scatter, offset, guard_win, bg_win, beta, n_refactor, sig_inv)
+		else:
+			todo = s0 >= 2
+			if centers is not None:
+				todo &= centers[row, cols].astype(bool)
+			if np.any(todo):
+				n = s0[todo][:, np.newaxis, np.newaxis]
+				sig_inv[todo] = sym_pinv(scatter[todo] / (n - 1) + beta * np.eye(n_band))
+
+		yield row, cols, s0, mu + offset, sig_inv
+
+def _row_rank_updates(hsi_img, weight, row, s0, s1, scatter, offset, guard_win, bg_win, beta, n_refactor, sig_inv):
+	"""
+	Sherman-Morrison-Woodbury sweep along one row of windows for local_sig_inv
+	 carries M = inv(scatter + beta (n - 1) I), so that sig_inv = (n - 1) M,
+	 through the change of the pixel sums and of the mean term between neighbour windows
+	"""
+	n_band = hsi_img.shape[2]
+	mask_width = 1 + 2 * guard_win + 2 * bg_win
+	guard_width = 1 + 2 * guard_win
+	top = row - guard_win - bg_win
+	eye = np.eye(n_band)
+
+	def pixels(col, r0, n_r):
+		x = np.asarray(hsi_img[r0:r0 + n_r, col, :], dtype = np.float64) - offset
+		return x if weight is None else x[weight[r0:r0 + n_r, col]]
+
+	M = None
+	for k in range(s0.size):
+		M_prev = M
+		M = None
+
+		if k % n_refactor != 0 and (beta == 0 or s0[k] == s0[k - 1]):
+			# column k - 1 leaves the window and column k - 1 + mask_width enters,
+			# the guard window drops column k - 1 + bg_win and takes column k - 1 + bg_win + guard_width
+			x_in = np.vstack((pixels(k - 1 + mask_width, top, mask_width), pixels(k - 1 + bg_win, top + bg_win, guard_width)))
+			x_out = np.vstack((pixels(k - 1, top, mask_width), pixels(k - 1 + bg_win + guard_width, top + bg_win, guard_width)))
+
+			V = np.vstack((x_in, x_out, s1[k], s1[k - 1])).T
+			d = np.hstack((np.ones(x_in.shape[0]), -np.ones(x_out.shape[0]), -1 / s0[k], 1 / s0[k - 1]))
+
+			MV = M_prev @ V
+			cap = np.diag(1 / d) + V.T @ MV
+			if np.linalg.cond(cap) < 1e10:
+				M = M_prev - MV @ np.linalg.solve(cap, MV.T)
+				M = (M + M.T) / 2
+
+		if M is None:
+			M = sym_pinv(scatter[k] + beta * (s0[k] - 1) * eye)
+
+		sig_inv[k] = (s0[k] - 1) * M
+
+def _window_sums(hsi_img, guard_win, bg_win, mask):
+	"""
+	Sliding window sums behind local_stats
+	 yields the pixel count, sum and sum of outer products of each annulus window,
+	 computed on data shifted by the global (masked) mean to keep the running sums well conditioned
+	"""
+	n_row, n_col, n_band = hsi_img.shape
+
+	mask_width = 1 + 2 * guard_win + 2 * bg_win
+	guard_width = 1 + 2 * guard_win
+	half_width = guard_win + bg_win
+	n_valid = n_col - mask_width + 1
+
+	if n_valid < 1 or n_row < mask_width:
+		return
+
+	weight = np.ones((n_row, n_col)) if mask is None else mask.astype(float)
+
+	# global mean of the background pixels, accumulated a row at a time
+	offset = np.zeros(n_band)
+	for r in range(n_row):
+		offset += weight[r,:] @ hsi_img[r,:,:]
+	offset /= max(np.sum(weight), 1)
+
+	def row_sums(r):
+		x = np.asarray(hsi_img[r,:,:], dtype = np.float64) - offset
+		xw = x * weight[r,:][:, np.newaxis]
+		return weight[r,:], xw, xw[:, :, np.newaxis] * x[:, np.newaxis, :]
+
+	def box(c0, c1, c2, start, width):
+		# sum over window columns [i + start, i + start + width) for every valid i
+		out = []
+		for c in (c0, c1, c2):
+			p = np.zeros((n_col + 1,) + c.shape[1:])
+			np.cumsum(c, axis = 0, out = p[1:])
+			out.append(p[start + width:start + width + n_valid] - p[start:start + n_valid])
+		return out
+
+	cols = np.arange(n_valid) + half_width
+
+	# running column sums over the rows of the full window and of the guard window
+	bg_sums = [np.zeros((n_col,)), np.zeros((n_col, n_band)), np.zeros((n_col, n_band, n_band))]
+	gd_sums = [np.zeros((n_col,)), np.zeros((n_col, n_band)), np.zeros((n_col, n_band, n_band))]
+	for r in range(mask_width):
+		for acc, val in zip(bg_sums, row_sums(r)):
+			acc += val
+	for r in range(bg_win, bg_win + guard_width):
+		for acc, val in zip(gd_sums, row_sums(r)):
+			acc += val
+
+	for j in range(n_row - mask_width + 1):
+		if j > 0:
+			# slide both windows down one row
+			for acc, new, old in zip(bg_sums, row_sums(j + mask_width - 1), row_sums(j - 1)):
+				acc += new
+				acc -= old
+			for acc, new, old in zip(gd_sums, row_sums(j + bg_win + guard_width - 1), row_sums(j + bg_win - 1)):
+				acc += new
+				acc -= old
+
+		o0, o1, o2 = box(*bg_sums, 0, mask_width)
+		i0, i1, i2 = box(*gd_sums, bg_win, guard_width)
+
+		yield j + half_width, cols, o0 - i0, o1 - i1, o2 - i2, offset
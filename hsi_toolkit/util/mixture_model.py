@@ -0,0 +1,202 @@
+import numpy as np
+from scipy.special import logsumexp
+from sklearn.mixture import GaussianMixture
+from hsi_toolkit.util.cov_inv import sym_pinv, loaded_chol, whitener
+
+class MixtureModel:
+	"""
+	Gaussian mixture background shared across detectors
+	 the mixture is fit once (on all the pixels or a random subsample), and the inverse
+	 covariances and Cholesky factors of the components are computed on first use and kept,
+	 so one model can be passed to every mixture detector (gmm_anomaly, palm, ccmf, gmrx) run
+	 on a scene, saved to a .npz file and loaded back for later scenes from the same sensor
+
+	Inputs:
+	 weights - component weights (n_comp vector)
+	 means - component means (n_comp x n_band)
+	 covariances - component covariances (n_comp x n_band x n_band)
+
+	Attributes (computed on first use):
+	 sig_inv - component inverse covariances, eigh pseudo-inverses (n_comp x n_band x n_band)
+	 chol - lower triangular Cholesky factors of the covariances (diagonally loaded if singular, see loaded_chol)
+	 prec_chol - whitening matrices inv(chol), ||prec_chol[k] @ (x - means[k])||^2 is the Mahalanobis distance
+	 log_det - log determinants of the (loaded) covariances
+	 log_norm - log weights plus log normalizing constants of the components
+	 sklearn_gmm - the sklearn GaussianMixture the model was made from (from_gmm / fit), None otherwise
+
+	Example:
+	 gmm = MixtureModel.from_img(hsi_img, 5, n_sample = 20000)
+	 gmm.save('flight_line.npz')
+	 gmm_out = gmm_anomaly(hsi_img, 5, gmm = MixtureModel.load('flight_line.npz'))
+	"""
+	def __init__(self, weights, means, covariances):
+		self.weights = np.asarray(weights, dtype = np.float64)
+		self.means = np.asarray(means, dtype = np.float64)
+		self.covariances = np.asarray(covariances, dtype = np.float64)
+		self._sig_inv = None
+		self._chol = None
+		self._prec_chol = None
+		self.sklearn_gmm = None
+
+	@classmethod
+	def fit(cls, hsi_data, n_comp, n_sample = None, max_iter = 1, init_params = 'random'):
+		"""
+		Fit a mixture (sklearn GaussianMixture) to spectra
+
+		Inputs:
+		 hsi_data - n_band x n_pixel array of spectra
+		 n_comp - number of Gaussian components
+		 n_sample - (optional) fit on a random subsample of n_sample pixels
+		 max_iter, init_params - GaussianMixture arguments (defaults of the detectors)
+
+		Outputs:
+		 gmm - fitted MixtureModel
+		"""
+		if n_sample is not None and n_sample < hsi_data.shape[1]:
+			hsi_data = hsi_data[:, np.sort(np.random.choice(hsi_data.shape[1], n_sample, replace = False))]
+
+		gmm = GaussianMixture(n_components = n_comp, max_iter = max_iter, init_params = init_params).fit(hsi_data.T)
+		return cls.from_gmm(gmm)
+
+	@classmethod
+	def from_img(cls, hsi_img, n_comp, mask = None, n_sample = None, **kwargs):
+		"""
+		Fit a mixture to the (masked) pixels of an image
+
+		Inputs:
+		 hsi_img - n_row x n_col x n_band hyperspectral image (array, np.memmap or other lazily loaded cube),
+		           with n_sample only the sampled pixels are read
+		 n_comp - number of Gaussian components
+		 mask - binary image of the background pixels
+		        if not present or empty, all pixels are used
+		 n_sample - (optional) fit on a random subsample of n_sample pixels
+		 kwargs - other arguments of MixtureModel.fit
+
+		Outputs:
+		 gmm - fitted MixtureModel
+		"""
+		n_row, n_col, n_band = hsi_img.shape
+		mask = np.ones((n_row, n_col), dtype=bool) if mask is None else mask.astype(bool)
+		ind = np.flatnonzero(mask.reshape(-1, order='F'))
+
+		if n_sample is not None and n_sample < ind.size:
+			ind = np.sort(np.random.choice(ind, n_sample, replace = False))
+
+		rows, cols = ind % n_row, ind // n_row
+		hsi_data = np.asarray(hsi_img[rows, cols, :], dtype = np.float64).T
+		return cls.fit(hsi_data, n_comp, **kwargs)
+
+	@classmethod
+	def from_gmm(cls, gmm):
+		"""
+		MixtureModel of a fitted sklearn GaussianMixture (full covariances)
+		"""
+		model = cls(gmm.weights_, gmm.means_, gmm.covariances_)
+		model.sklearn_gmm = gmm
+		return model
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Load a mixture saved with MixtureModel.save
+		"""
+		with np.load(path) as f:
+			return cls(f['weights'], f['means'], f['covariances'])
+
+	def save(self, path):
+		"""
+		Save the mixture to a .npz file
+		"""
+		np.savez(path, weights = self.weights, means = self.means, covariances = self.covariances)
+
+	@property
+	def n_comp(self):
+		return self.weights.size
+
+	@property
+	def sig_inv(self):
+		if self._sig_inv is None:
+			self._sig_inv = sym_pinv(self.covariances)
+		return self._sig_inv
+
+	@property
+	def chol(self):
+		if self._chol is None:
+			self._chol = loaded_chol(self.covariances)[0]
+		return self._chol
+
+	@property
+	def prec_chol(self):
+		if self._prec_chol is None:
+			self._prec_chol = whitener(self.covariances, 'chol')
+		return self._prec_chol
+
+	@property
+	def log_det(self):
+		return 2 * np.sum(np.log(np.diagonal(self.chol, axis1 = 1, axis2 = 2)), 1)
+
+	def mahalanobis(self, hsi_data, chunk_size = 16384):
+		"""
+		Squared Mahalanobis distance of every pixel to every component
+
+		Inputs:
+		 hsi_data - n_band x n_pixel array of spectra
+		 chunk_size - number of pixels scored at a time
+
+		Outputs:
+		 dists - n_comp x n_pixel distances
+		"""
+		n_pixel = hsi_data.shape[1]
+		dists = np.empty((self.n_comp, n_pixel))
+
+		for c in range(0, n_pixel, chunk_size):
+			x = hsi_data[:, c:c + chunk_size]
+			for k in range(self.n_comp):
+				z = self.prec_chol[k] @ (x - self.means[k][:, np.newaxis])
+				dists[k, c:c + chunk_size] = np.sum(z ** 2, 0)
+
+		return dists
+
+	@property
+	def log_norm(self):
+		"""
+		log(w_k) plus the log normalizing constant of every component, log_prob = log_norm - mahalanobis / 2
+		"""
+		n_band = self.means.shape[1]
+		return np.log(self.weights) - 0.5 * (n_band * np.log(2 * np.pi) + self.log_det)
+
+	def log_prob(self, hsi_data, chunk_size = 16384):
+		"""
+		Weighted log density log(w_k N(x; mu_k, sigma_k)) of every pixel under every component (n_comp x n_pixel)
+		"""
+		return self.log_norm[:, np.newaxis] - 0.5 * self.mahalanobis(hsi_data, chunk_size)
+
+	def score_samples(self, hsi_data, chunk_size = 16384):
+		"""
+		Log likelihood of every pixel under the mixture (n_pixel)
+		"""
+		return logsumexp(self.log_prob(hsi_data, chunk_size), 0)
+
+	def predict(self, hsi_data, chunk_size = 16384):
+		"""
+		Highest posterior probability component of every pixel (n_pixel)
+		"""
+		return np.argmax(self.log_prob(hsi_data, chunk_size), 0)
+
+def get_gmm(hsi_data, kwargs):
+	"""
+	Mixture background for an array based detector helper
+
+	Inputs:
+	 hsi_data - n_band x n_pixel array of spectra given to the detector
+	 kwargs - detector arguments, gmm (MixtureModel, fitted sklearn GaussianMixture or None) and n_comp
+
+	Outputs:
+	 gmm - kwargs['gmm'] as a MixtureModel, or a MixtureModel with n_comp components fit to hsi_data
+	"""
+	gmm = kwargs.get('gmm')
+	if gmm is None:
+		return MixtureModel.fit(hsi_data, kwargs['n_comp'])
+	if isinstance(gmm, GaussianMixture):
+		return MixtureModel.from_gmm(gmm)
+	return gmm
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+def estimate_noise_cov(hsi_img, tile_rows = None, cache = True):
+	"""
+	Noise covariance of an image from the differences of neighbouring pixels
+	 assumes neighbour pixels are essentially the same except for noise: the differences of
+	 every pixel with its neighbour to the right and below (pixels of the last row and column
+	 excluded) are taken as array slices, and their scatter accumulated with one GEMM per block
+	 of rows; the result is cached under a hash of the image values (see image_key), so MNF, QMF
+	 and MTMF run on the same image reuse it, and an image edited in place gets a new estimate
+
+	Inputs:
+	 hsi_img - n_row x n_col x n_band hyperspectral image (array, np.memmap or other lazily loaded cube)
+	 tile_rows - (optional) number of image rows read at a time (default about 16384 pixels),
+	             each block reads one extra row for the vertical differences
+	 cache - reuse (and keep) the noise covariance of the same image
+
+	Outputs:
+	 noise_cov - n_band x n_band noise covariance, scatter of the differences / (2 (n_row - 1) (n_col - 1) - 1)
+	"""
+	n_row, n_col, n_band = hsi_img.shape
+	key = image_key(hsi_img) if cache else None
+	if key is not None:
+		with _lock:
+			if key in _cache:
+				_cache.move_to_end(key)
+				return _cache[key]
+
+	step = max(1, 16384 // n_col) if tile_rows is None else tile_rows
+	running_cov = np.zeros((n_band, n_band))
+
+	for r0 in range(0, n_row - 1, step):
+		r1 = min(r0 + step, n_row - 1)
+		tile = np.asarray(hsi_img[r0:r1 + 1,:,:], dtype=np.float64)
+
+		diff1 = (tile[:-1,1:,:] - tile[:-1,:-1,:]).reshape(-1, n_band)
+		diff2 = (tile[1:,:-1,:] - tile[:-1,:-1,:]).reshape(-1, n_band)
+		running_cov += diff1.T @ diff1 + diff2.T @ diff2
+
+	noise_cov = running_cov / (2 * (n_row - 1) * (n_col - 1) - 1)
+
+	if key is not None:
+		noise_cov.flags.writeable = False
+		with _lock:
+			_cache[key] = noise_cov
+			while len(_cache) > _max_items:
+				_cache.popitem(last = False)
+
+	return noise_cov
+
+def image_key(hsi_img):
+	"""
+	Cache key of an image (hex digest string), a hash of its shape, dtype and every value
+	 (read a block of rows at a time, so np.memmap images are not loaded whole)
+	"""
+	n_row, n_col = hsi_img.shape[:2]
+	step = max(1, 16384 // n_col)
+
+	h = hashlib.blake2b(digest_size = 20)
+	h.update(str((hsi_img.shape, str(hsi_img.dtype))).encode())
+	for r0 in range(0, n_row, step):
+		h.update(np.ascontiguousarray(hsi_img[r0:r0 + step]))
+	return h.hexdigest()
+
+# noise covariances of the last few images
+_max_items = 4
+_cache = OrderedDict()
+_lock = threading.Lock()
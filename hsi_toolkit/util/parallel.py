@@ -0,0 +1,102 @@
+import os
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+try:
+	from threadpoolctl import threadpool_limits
+except ImportError:
+	threadpool_limits = None
+
+def n_workers(n_jobs):
+	"""
+	Number of workers for an n_jobs argument: None -> 1, -1 (or any negative) -> one per CPU
+	"""
+	if n_jobs is None:
+		return 1
+	if n_jobs < 0:
+		return os.cpu_count() or 1
+	return max(1, n_jobs)
+
+def blas_limits(n_jobs):
+	"""
+	Context manager limiting the BLAS threads while n_jobs workers run in this process,
+	 each worker then gets cpu_count / n_jobs BLAS threads instead of every worker
+	 starting one per CPU (oversubscription); does nothing without threadpoolctl
+
+	Inputs:
+	 n_jobs - number of concurrent workers
+
+	Outputs:
+	 context manager, use as `with blas_limits(n_jobs): ...`
+	"""
+	n_jobs = n_workers(n_jobs)
+	if threadpool_limits is None or n_jobs <= 1:
+		return contextlib.ExitStack()
+	return threadpool_limits(limits = max(1, (os.cpu_count() or 1) // n_jobs), user_api = 'blas')
+
+def stripe_map(func, hsi_img, halo, n_jobs = None, *args):
+	"""
+	Run a sliding window image function on column stripes of the image in parallel
+	 the image is split into n_jobs stripes of output columns, the stripes are processed
+	 in a process pool and the outputs stitched back together; the cube is copied once into
+	 shared memory and every worker reads it (and the halo of columns around its stripe) from there
+
+	Inputs:
+	 func - stripe function, called as func(hsi_img, cols, *args) with the full image and
+	        the (first, last + 1) output columns of the stripe, reads columns
+	        cols[0] - halo to cols[1] + halo and returns a tuple of n_row x (cols[1] - cols[0]) outputs
+	        (must be a module level function so the worker processes can run it)
+	 hsi_img - n_row x n_col x n_band hyperspectral image
+	 halo - number of columns on each side of a stripe the function reads (e.g. guard_win + bg_win)
+	 n_jobs - number of worker processes (-1 for one per CPU), None or 1 runs func on the whole image in this process
+	 args - other arguments passed on to func
+
+	Outputs:
+	 out - tuple of n_row x n_col outputs
+	"""
+	n_row, n_col, n_band = hsi_img.shape
+	n_jobs = n_workers(n_jobs)
+
+	if n_jobs <= 1 or n_col < 2:
+		return func(hsi_img, (0, n_col), *args)
+
+	n_stripe = min(n_jobs, n_col)
+	edges = np.linspace(0, n_col, n_stripe + 1).astype(int)
+
+	# band x col x row layout, so the image and its column major pixel array are both views of the buffer
+	shm = shared_memory.SharedMemory(create = True, size = hsi_img.size * 8)
+	try:
+		data = np.ndarray((n_band, n_col, n_row), dtype = np.float64, buffer = shm.buf)
+		for r in range(n_row):
+			data[:, :, r] = np.asarray(hsi_img[r,:,:], dtype = np.float64).T
+
+		with ProcessPoolExecutor(max_workers = n_stripe) as pool:
+			futures = [pool.submit(_stripe_worker, func, shm.name, hsi_img.shape, (edges[i], edges[i + 1]), args) for i in range(n_stripe)]
+			parts = [f.result() for f in futures]
+		del data
+	finally:
+		shm.close()
+		shm.unlink()
+
+	# stitch the stripes
+	out = []
+	for k in range(len(parts[0])):
+		full = np.empty((n_row, n_col), dtype = parts[0][k].dtype)
+		for i, part in enumerate(parts):
+			full[:, edges[i]:edges[i + 1]] = part[k]
+		out.append(full)
+
+	return tuple(out)
+
+def _stripe_worker(func, shm_name, shape, cols, args):
+	n_row, n_col, n_band = shape
+	shm = shared_memory.SharedMemory(name = shm_name)
+	try:
+		data = np.ndarray((n_band, n_col, n_row), dtype = np.float64, buffer = shm.buf)
+		out = tuple(np.array(o) for o in func(data.transpose(2, 1, 0), cols, *args))
+		del data
+	finally:
+		shm.close()
+	return out
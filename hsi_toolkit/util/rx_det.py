@@ -1,17 +1,29 @@
 import numpy as np
+from hsi_toolkit.util.local_stats import local_sig_inv
+from hsi_toolkit.util.background_model import BackgroundModel
+from hsi_toolkit.util.parallel import stripe_map
 
-def rx_det(det_func, hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4, **kwargs):
+def rx_det(det_func, hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4, beta = 0, rank_update = False, n_refactor = 16, n_jobs = None, **kwargs):
 	"""
 	Wrapper to make an RX style sliding window detector given the local detection function
 
 	Inputs:
-		det_fun - detection function
+		det_fun - detection function, called as det_func(x, ind, mu, sig_inv, args, kwargs)
+		          with the local background mean and inverse covariance of the pixel
 		hsi_image - n_row x n_col x n_band hyperspectral image
 		tgt_sig - target signature (n_band x 1 - column vector)
 		mask - binary image limiting detector operation to pixels where mask is true
 	           if not present or empty, no mask restrictions are used
 		guard_win - guard window radius (square,symmetric about pixel of interest)
 		bg_win - background window radius
+		beta - scalar value used to diagonal load the local covariances
+		rank_update - update the local inverse covariance between neighbouring windows with
+		              Sherman-Morrison-Woodbury rank-k updates instead of inverting every window
+		              (needs more background pixels than bands, or beta > 0)
+		n_refactor - number of window steps between exact inversions in rank update mode
+		n_jobs - (optional) number of processes, the image is split into n_jobs column stripes
+		         (with guard_win + bg_win columns of overlap) run in parallel, -1 for one per CPU
+		         (det_func and kwargs are sent to the worker processes, so must be picklable)
 
 	Outputs:
 		det_out - detector image
@@ -20,25 +32,26 @@ def rx_det(det_func, hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4, *
 	10/2018 - Python Implementation by Yutai Zhou
 	"""
 	n_row, n_col, n_band = hsi_img.shape
-	n_pixel = n_row * n_col
-
 	mask = np.ones([n_row, n_col], dtype= bool) if mask is None else mask.astype(bool)
 
-	# create the mask
-	mask_width = 1 + 2 * guard_win + 2 * bg_win
-	half_width = guard_win + bg_win
+	# get global image/segment statistics in case we need to fall back on them
+	bg_model = BackgroundModel.from_img(hsi_img, mask)
+	global_mu = bg_model.mu
+	global_sig_inv = bg_model.sig_inv
 
-	b_mask = np.ones((mask_width, mask_width), dtype= bool)
-	b_mask[bg_win:b_mask.shape[0] - bg_win, bg_win:b_mask.shape[0] - bg_win] = 0
+	return stripe_map(rx_det_stripe, hsi_img, guard_win + bg_win, n_jobs, det_func, tgt_sig, mask, guard_win, bg_win, beta, rank_update, n_refactor, global_mu, global_sig_inv, kwargs)
 
-	hsi_data = np.reshape(hsi_img, (n_pixel, n_band), order='F').T
+def rx_det_stripe(hsi_img, stripe, det_func, tgt_sig, mask, guard_win, bg_win, beta, rank_update, n_refactor, global_mu, global_sig_inv, kwargs):
+	"""
+	rx_det on the output columns stripe = (first, last + 1) of the image, see stripe_map
+	"""
+	n_row, n_col, n_band = hsi_img.shape
+	n_pixel = n_row * n_col
+	halo = guard_win + bg_win
+	c0, c1 = max(stripe[0] - halo, 0), min(stripe[1] + halo, n_col)
+	verbose = stripe == (0, n_col)
 
-	# get global image/segment statistics in case we need to fall back on them
-	global_mu = np.mean(hsi_data[:, np.reshape(mask,-1,order='F') == 1], 1)
-	global_cov = np.cov(hsi_data[:, np.reshape(mask,-1,order='F') == 1].T, rowvar = False)
-	# s = np.float32(np.linalg.svd(global_cov, compute_uv=False))
-	# rcond = np.max(global_cov.shape)*np.spacing(np.float32(np.linalg.norm(s, ord=np.inf)))
-	global_sig_inv = np.linalg.pinv(global_cov)
+	hsi_data = np.reshape(hsi_img, (n_pixel, n_band), order='F').T
 
 	args = {
 	'hsi_data': hsi_data,
@@ -48,35 +61,35 @@ def rx_det(det_func, hsi_img, tgt_sig, mask = None, guard_win = 2, bg_win = 4, *
 	'n_sig': tgt_sig.shape[1]}
 
 	# run the detector (only on fully valid points)
-	ind_img = np.reshape(np.array(range(n_pixel)), (n_row, n_col), order='F')
-	out = np.empty((n_row, n_col))
-	det_stat = np.empty((n_row, n_col))
-
+	out = np.empty((n_row, c1 - c0))
+	det_stat = np.empty((n_row, c1 - c0))
 
-	for i in range(n_col - mask_width + 1):
-		if i % 10 == 0:
+	# local background statistics, a row of window centers at a time
+	for row, cols, n_bg, mu, sig_inv in local_sig_inv(hsi_img[:, c0:c1, :], guard_win, bg_win, mask[:, c0:c1], beta, rank_update, n_refactor, mask[:, c0:c1]):
+		if verbose and row % 10 == 0:
 			print('.')
 
-		for j in range(n_row - mask_width + 1):
-			row = j + half_width
-			col = i + half_width
+		valid = mask[row, c0 + cols]
+		if not np.any(valid):
+			continue
+		cols, n_bg, mu, sig_inv = cols[valid], n_bg[valid], mu[valid], sig_inv[valid]
 
-			if mask[row, col] == 0: continue
+		# too few background points, use the global statistics instead
+		few = n_bg < 2
+		mu[few] = global_mu
+		sig_inv[few] = global_sig_inv
 
-			b_mask_img = np.zeros((n_row, n_col))
-			b_mask_img[j:mask_width + j, i:mask_width + i] = b_mask
-			b_mask_img = np.logical_and(b_mask_img, mask)
-			b_mask_list = np.reshape(b_mask_img, (b_mask_img.size), order='F')
-			# pull out background and foreground points
-			bg = hsi_data[:, b_mask_list == 1]
-			ind = ind_img[row, col]
+		for k, col in enumerate(cols):
+			# column major pixel index in the full image
+			ind = row + (c0 + col) * n_row
 			x = hsi_data[:, ind]
 
 			# compute detection statistic
-			out[row, col], kwargout = det_func(x, ind, bg, b_mask_list, args, kwargs)
+			out[row, col], kwargout = det_func(x, ind, mu[k], sig_inv[k], args, kwargs)
 
 			if 'sig_index' in kwargout:
 				det_stat[row, col] = kwargout['sig_index']
 
-	print('\n')
-	return out, det_stat
+	if verbose:
+		print('\n')
+	return out[:, stripe[0] - c0:stripe[1] - c0], det_stat[:, stripe[0] - c0:stripe[1] - c0]
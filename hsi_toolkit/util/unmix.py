@@ -1,13 +1,201 @@
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from scipy.linalg import lu_factor, lu_solve
 from cvxopt import matrix
 from cvxopt import solvers
+from hsi_toolkit.util.parallel import n_workers
 
-def unmix(data, endmembers):
-	X = data
+def unmix(data, endmembers, method = 'fcls', n_jobs = None, chunk_size = 16384):
+	"""
+	Fully constrained (nonnegative, sum to one) linear unmixing
 
-	n_endmember = endmembers.shape[1]
+	Inputs:
+	 data - n_band x n_pixel array of spectra
+	 endmembers - n_band x n_endmember array of endmember spectra
+	 method - 'fcls' - batched active set solver run on all the pixels at once (default)
+	          'qp' - cvxopt quadratic program per pixel (see qp_unmix)
+	 n_jobs - (optional) number of processes, the pixels are split into chunks of chunk_size
+	          unmixed in a process pool (-1 for one per CPU), None or 1 unmixes in this process
+	 chunk_size - number of pixels per chunk in parallel mode
+
+	Outputs:
+	 P - n_pixel x n_endmember abundances
+	"""
+	solve = {'fcls': fcls, 'qp': qp_unmix}
+	if method not in solve:
+		raise ValueError('unknown method ' + str(method))
+
+	n_pixel = data.shape[1]
+	n_jobs = n_workers(n_jobs)
+	if n_jobs <= 1 or n_pixel <= chunk_size:
+		return solve[method](data, endmembers)
+
+	chunks = (data[:, c:c + chunk_size] for c in range(0, n_pixel, chunk_size))
+	with ProcessPoolExecutor(max_workers = n_jobs) as pool:
+		return np.vstack(list(pool.map(solve[method], chunks, repeat(endmembers))))
+
+def fcls(data, endmembers, max_iter = None, tol = 1e-10):
+	"""
+	Fully constrained least squares for all pixels at once
+	 primal active set method on min ||x - E a||^2, a >= 0, sum(a) = 1, run on every pixel together:
+	 each iteration solves the equality constrained problem on the free abundances of all pixels,
+	 grouped by their set of free abundances, with one small KKT solve per group, using only
+	 E^T E and E^T X; abundances blocked at zero are released when their multiplier is negative
+
+	Inputs:
+	 data - n_band x n_pixel array of spectra
+	 endmembers - n_band x n_endmember array of endmember spectra
+	 max_iter - (optional) maximum number of active set iterations, default 10 x n_endmember + 10
+	 tol - relative tolerance of the step and multiplier tests
+
+	Outputs:
+	 P - n_pixel x n_endmember abundances
+	"""
+	E = np.asarray(endmembers, dtype = np.float64)
+	n_endmember = E.shape[1]
+	n_pixel = data.shape[1]
+	max_iter = 10 * n_endmember + 10 if max_iter is None else max_iter
+
+	G = E.T @ E
+	B = np.asarray(data, dtype = np.float64).T @ E
+	mult_tol = tol * max(np.max(np.abs(G)), np.finfo(float).tiny)
+
+	# start from the center of the simplex with no abundance held at zero
+	P = np.full((n_pixel, n_endmember), 1 / n_endmember)
+	at_zero = np.zeros((n_pixel, n_endmember), dtype = bool)
+	todo = np.arange(n_pixel)
+
+	for _ in range(max_iter):
+		if todo.size == 0: break
+		a, w, b = P[todo], at_zero[todo], B[todo]
+
+		# minimizer over the free abundances and its sum to one multiplier
+		a_bar, nu = _eqp(G, b, w)
+		step = a_bar - a
+		moving = np.max(np.abs(step), 1) > tol
+
+		# at the minimizer of the free set: optimal unless an abundance held at zero should be released
+		stay = np.flatnonzero(~moving)
+		mult = np.where(w[stay], a[stay] @ G - b[stay] + nu[stay][:, np.newaxis], np.inf)
+		release = np.argmin(mult, 1)
+		neg = mult[np.arange(stay.size), release] < -mult_tol
+		at_zero[todo[stay[neg]], release[neg]] = False
+
+		# otherwise step toward the minimizer, up to the first abundance that reaches zero
+		move = np.flatnonzero(moving)
+		a, w, step = a[move], w[move], step[move]
+		with np.errstate(divide = 'ignore', invalid = 'ignore'):
+			ratio = np.where(~w & (step < 0), -a / step, np.inf)
+		block = np.argmin(ratio, 1)
+		t = np.minimum(1, ratio[np.arange(move.size), block])
+
+		a = a + t[:, np.newaxis] * step
+		blocked = t < 1
+		a[blocked, block[blocked]] = 0
+		w[blocked, block[blocked]] = True
+		P[todo[move]] = a
+		at_zero[todo[move]] = w
+
+		todo = np.concatenate((todo[move], todo[stay[neg]]))
+
+	P[at_zero] = 0
+	P[P < 0] = 0
+
+	return P
+
+def _eqp(G, b, at_zero):
+	"""
+	Minimizers of 1/2 a^T G a - b^T a with sum(a) = 1 and the abundances at_zero held at zero
+	 pixels are grouped by their set of free abundances, one (n_free + 1) KKT system per group
+
+	Outputs:
+	 a - n x n_endmember minimizers
+	 nu - n multipliers of the sum to one constraint
+	"""
+	n, n_endmember = b.shape
+	a = np.zeros((n, n_endmember))
+	nu = np.zeros(n)
+
+	codes = at_zero @ (1 << np.arange(n_endmember))
+	for code in np.unique(codes):
+		group = codes == code
+		free = ~at_zero[np.argmax(group)]
+		n_free = np.sum(free)
+
+		K = np.ones((n_free + 1, n_free + 1))
+		K[:n_free, :n_free] = G[np.ix_(free, free)]
+		K[-1, -1] = 0
+		K_inv = np.linalg.pinv(K)
+
+		b_free = b[group][:, free]
+		a[np.ix_(group, free)] = b_free @ K_inv[:n_free, :n_free] + K_inv[-1, :n_free]
+		nu[group] = b_free @ K_inv[:n_free, -1] + K_inv[-1, -1]
+
+	return a, nu
+
+def qp_unmix(data, endmembers):
+	"""
+	Fully constrained unmixing with the cvxopt quadratic program solver
+	 the QP matrices are built once per endmember set (and kept for later calls),
+	 the KKT matrix [2 E^T E, 1; 1^T, 0] of the sum to one least squares problem is factored once
+	 and solved for all pixels: pixels whose solution is already nonnegative are optimal
+	 and skip the QP; the others are solved one at a time, each warm started from the
+	 primal and dual solution of the previous one (its neighbour in the column major pixel order)
+
+	Inputs:
+	 data - n_band x n_pixel array of spectra
+	 endmembers - n_band x n_endmember array of endmember spectra
+
+	Outputs:
+	 P - n_pixel x n_endmember abundances
+	"""
+	X = np.asarray(data, dtype = np.float64)
+	E = np.asarray(endmembers, dtype = np.float64)
+	n_endmember = E.shape[1]
 	n_pixel = X.shape[1]
 
+	H, G, h, A, b = _qp_problem(E.tobytes(), E.shape)
+
+	# sum to one least squares solution of all pixels from one factorization of the KKT matrix
+	K = np.ones((n_endmember + 1, n_endmember + 1))
+	K[:n_endmember, :n_endmember] = 2 * (E.T @ E)
+	K[-1, -1] = 0
+	with np.errstate(all = 'ignore'):
+		P = lu_solve(lu_factor(K), np.vstack((2 * E.T @ X, np.ones(n_pixel))))[:n_endmember].T
+	todo = np.flatnonzero(~np.all(P >= 0, 1) | ~np.all(np.isfinite(P), 1))
+
+	solvers.options['show_progress'] = False
+	prev = None
+	for i in todo:
+		F = matrix(-2 * E.T @ X[:,i])
+		qp_out = None
+
+		# start from the previous pixel's primal and dual solution, moved into the interior
+		if prev is not None:
+			init = {'x': prev['x'], 'y': prev['y'],
+			        's': matrix(np.maximum(np.array(prev['s']), 0.1)), 'z': matrix(np.maximum(np.array(prev['z']), 0.1))}
+			qp_out = solvers.qp(H, F, G, h, A, b, initvals = init)
+
+		if qp_out is None or qp_out['status'] != 'optimal':
+			qp_out = solvers.qp(H, F, G, h, A, b)
+
+		P[i,:] = np.array(qp_out['x']).T
+		prev = qp_out if qp_out['status'] == 'optimal' else None
+
+	P[P<0] = 0
+
+	return P
+
+@lru_cache(maxsize = 8)
+def _qp_problem(endmember_bytes, shape):
+	"""
+	cvxopt matrices of the unmixing QP for an endmember set (cached)
+	"""
+	endmembers = np.frombuffer(endmember_bytes).reshape(shape)
+	n_endmember = shape[1]
+
 	# equality constraint A * x = b
 	# all values must sum to 1 (X1 + X2 + ... + XM = 1)
 	A = matrix(np.ones((1,n_endmember)), tc='d')
@@ -25,14 +213,4 @@ def unmix(data, endmembers):
 	h = matrix(h, tc='d')
 
 	H = matrix(np.float64(2 * (endmembers.T @ endmembers)))
-	P = np.zeros((n_pixel,n_endmember))
-
-	solvers.options['show_progress'] = False
-	for i in range(n_pixel):
-		F = matrix(np.float64((-2 * X[:,i][np.newaxis,:] @ endmembers).T), tc='d')
-		qp_out = solvers.qp(H, F, G, h, A, b)
-		P[i,:] = np.array(qp_out['x']).T
-		# print(np.array(qp_out['x']).shape)
-	P[P<0] = 0
-
-	return P
+	return H, G, h, A, b